@@ -0,0 +1,344 @@
+"""Load test of the scheduler API on synthetic databases.
+
+For each database size, a synthetic database is generated (see
+`benchmarks.make_db`) and the app is driven through Flask's test client, in
+a fresh process since routes are registered once per process, by
+concurrent simulated users and runners:
+    - users submit jobs, list them, fetch single jobs, stats and logs,
+      according to a weighted mix of operations
+    - runners claim jobs, stream their logs, send progress updates, then
+      mark them DONE
+
+The throughput, the p50/p95/p99 latency and the number of SQL statements
+of each route are reported, and saved to JSON. A previous result can be
+given to flag the routes that got slower.
+
+Usage, from the api directory:
+    $ python -m benchmarks.load_test --sizes 1000 100000 --output results.json
+    $ python -m benchmarks.load_test --sizes 1000 100000 --compare results.json
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from time import perf_counter, sleep, time
+
+from sqlalchemy.event import listen
+
+from broker import create_app
+from broker.config import Config
+from broker.core.logs import LogStorage
+from broker.core.utils import JobStatus
+from benchmarks.make_db import make_db
+
+
+# Default weights of the operations of simulated users
+MIX = {"submit": 1, "list": 4, "get": 3, "stats": 1, "logs": 1}
+# Bytes of log sent by a runner at each step of a job
+LOG_CHUNK = b"step: loss=0.123456, accuracy=0.987654\n" * 100
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    """Collects the latency and SQL statements of each request, by route.
+
+    Statements are counted per thread, since a request made with the test
+    client runs entirely in the calling thread.
+    """
+
+    def __init__(self, engine):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *_args):
+        self._local.queries = getattr(self._local, "queries", 0) + 1
+
+    def request(self, client, route, method, url, **kwargs):
+        """Makes a request and records it under its route.
+
+        Returns:
+            (flask.Response) response, with its body read
+        """
+        self._local.queries = 0
+        started = perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+        elapsed = perf_counter() - started
+        with self._lock:
+            self.samples[route].append((elapsed, self._local.queries))
+            if response.status_code >= 400:
+                self.errors[route] += 1
+        return response
+
+    def summary(self, duration):
+        """Returns the statistics of each route."""
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] for s in samples)
+            queries = [s[1] for s in samples]
+            stats = {
+                "count": len(samples),
+                "errors": self.errors[route],
+                "throughput": len(samples) / duration,
+                "mean": sum(latencies) / len(latencies),
+                "max": latencies[-1],
+                "queries_mean": sum(queries) / len(queries),
+                "queries_max": max(queries),
+            }
+            for percentile in PERCENTILES:
+                stats[f"p{percentile}"] = _percentile(latencies, percentile)
+            routes[route] = stats
+        return routes
+
+
+def _percentile(values, percentile):
+    """Nearest-rank percentile of sorted values."""
+    rank = max(int(round(percentile / 100 * len(values))), 1)
+    return values[rank - 1]
+
+
+def _user(app, recorder, stop, rand, mix, max_id, with_logs, think):
+    """Simulated user, runs operations drawn from the mix until stopped."""
+    client = app.test_client()
+    operations, weights = zip(*mix.items())
+    while not stop.is_set():
+        operation = rand.choices(operations, weights)[0]
+        if operation == "submit":
+            recorder.request(client, "POST /jobs", "POST", "/jobs", json={
+                "user": f"user{rand.randrange(50)}@mail.com",
+                "description": "Load test",
+                "command": "sleep 1",
+            })
+        elif operation == "list":
+            query = rand.choice((
+                "limit=100",
+                f"limit=100&after={rand.randrange(max_id)}",
+                "limit=100&status=WAITING",
+                f"limit=100&user=user{rand.randrange(50)}@mail.com",
+            ))
+            recorder.request(client, "GET /jobs", "GET", f"/jobs?{query}")
+        elif operation == "get":
+            recorder.request(
+                client, "GET /jobs/<id>", "GET", f"/jobs/{rand.randint(1, max_id)}")
+        elif operation == "stats":
+            recorder.request(client, "GET /jobs/stats", "GET", "/jobs/stats")
+        elif operation == "logs" and with_logs:
+            recorder.request(
+                client, "GET /jobs/<id>/logs", "GET",
+                f"/jobs/{rand.choice(with_logs)}/logs?tail=100")
+        if think:
+            sleep(rand.expovariate(1 / think))
+
+
+def _runner(app, recorder, stop, name, steps, idle):
+    """Simulated runner, runs jobs until stopped."""
+    client = app.test_client()
+    while not stop.is_set():
+        response = recorder.request(
+            client, "POST /runners/claim-job", "POST", "/runners/claim-job",
+            json={"runner": name})
+        if response.status_code != 200:
+            sleep(idle)
+            continue
+        identifier = response.get_json()["identifier"]
+        for step in range(steps):
+            recorder.request(
+                client, "POST /jobs/<id>/logs/append", "POST",
+                f"/jobs/{identifier}/logs/append?offset={step * len(LOG_CHUNK)}",
+                data=LOG_CHUNK)
+            recorder.request(
+                client, "POST /runners/update-jobs", "POST", "/runners/update-jobs",
+                json={"runner": name, "updates": [
+                    {"identifier": identifier, "progress": (step + 1) / (steps + 1)}
+                ]})
+        recorder.request(
+            client, "POST /runners/update-jobs", "POST", "/runners/update-jobs",
+            json={"runner": name, "updates": [
+                {"identifier": identifier, "status": JobStatus.DONE.name, "progress": 1}
+            ]})
+
+
+def run(size, args, workdir):
+    """Generates a database of a given size, and runs the load test on it.
+
+    Returns:
+        (dict) result of the run
+    """
+    rand = random.Random(args.seed)
+    sqlite_file = os.path.join(workdir, f"jobs-{size}.db")
+    storage = os.path.join(workdir, f"logs-{size}")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(sqlite_file + suffix):
+            os.remove(sqlite_file + suffix)
+    shutil.rmtree(storage, ignore_errors=True)
+    os.makedirs(storage)
+    started = time()
+    with_logs = make_db(
+        sqlite_file, size, waiting=args.waiting, running=args.running,
+        logs=LogStorage(storage), n_logs=args.logs, seed=args.seed)
+    generated = time() - started
+
+    config = type("BenchConfig", (Config,), {
+        "TESTING": False,
+        "DEBUG": False,
+        "DATABASE_URI": sqlite_file,
+        "STORAGE_URI": storage,
+        "REAPER_INTERVAL": 0,
+        "ARCHIVE_INTERVAL": 0,
+        "RESPONSE_CACHE_SIZE": 0 if args.no_cache else Config.RESPONSE_CACHE_SIZE,
+    })
+    app = create_app(config)
+    recorder = Recorder(app.schedule.db_manager.engine)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_user, args=(
+            app, recorder, stop, random.Random(rand.random()), args.mix, size,
+            with_logs, args.think))
+        for _ in range(args.clients)
+    ] + [
+        threading.Thread(target=_runner, args=(
+            app, recorder, stop, f"bench-runner-{i}", args.steps, args.idle))
+        for i in range(args.runners)
+    ]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    duration = perf_counter() - started
+    app.schedule.stop_reaper()
+    app.schedule.stop_timer()
+    app.schedule.db_manager.close()
+
+    routes = recorder.summary(duration)
+    return {
+        "size": size,
+        "generation_seconds": generated,
+        "duration": duration,
+        "throughput": sum(r["count"] for r in routes.values()) / duration,
+        "routes": routes,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints the p95 latency of each route against a baseline.
+
+    Returns:
+        (list) (size, route) of the routes that are slower than the baseline
+            by more than tolerance
+    """
+    regressions = []
+    previous = {r["size"]: r for r in baseline["results"]}
+    for result in results:
+        if result["size"] not in previous:
+            continue
+        for route, stats in result["routes"].items():
+            before = previous[result["size"]]["routes"].get(route)
+            if before is None:
+                continue
+            ratio = stats["p95"] / before["p95"] if before["p95"] else 1
+            slower = ratio > 1 + tolerance
+            print(
+                f"{result['size']:>9} {route:<32} p95 {before['p95'] * 1000:8.2f}ms -> "
+                f"{stats['p95'] * 1000:8.2f}ms ({ratio:5.2f}x){'  SLOWER' if slower else ''}")
+            if slower:
+                regressions.append((result["size"], route))
+    return regressions
+
+
+def _print_result(result):
+    print(
+        f"\n{result['size']} jobs (generated in {result['generation_seconds']:.1f}s), "
+        f"{result['throughput']:.0f} requests/s")
+    print(
+        f"{'route':<32} {'count':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8} {'queries':>7}")
+    for route, stats in result["routes"].items():
+        print(
+            f"{route:<32} {stats['count']:>7} {stats['errors']:>6} "
+            f"{stats['throughput']:>8.1f} {stats['p50'] * 1000:>8.2f} "
+            f"{stats['p95'] * 1000:>8.2f} {stats['p99'] * 1000:>8.2f} "
+            f"{stats['queries_mean']:>7.1f}")
+
+
+def _parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation}")
+        mix[operation] = float(weight)
+    return mix
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+        help="Numbers of jobs of the generated databases")
+    parser.add_argument("--clients", type=int, default=8, help="Number of simulated users")
+    parser.add_argument("--runners", type=int, default=4, help="Number of simulated runners")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per size")
+    parser.add_argument(
+        "--mix", type=_parse_mix, default=MIX,
+        help="Weights of the user operations, e.g. submit=1,list=4,get=3,stats=1,logs=1")
+    parser.add_argument(
+        "--think", type=float, default=0,
+        help="Mean seconds a user waits between two operations")
+    parser.add_argument("--steps", type=int, default=3, help="Log chunks and updates per job")
+    parser.add_argument(
+        "--idle", type=float, default=0.1,
+        help="Seconds a runner waits when there are no jobs")
+    parser.add_argument("--waiting", type=float, default=0.03, help="Share of WAITING jobs")
+    parser.add_argument("--running", type=float, default=0.01, help="Share of RUNNING jobs")
+    parser.add_argument("--logs", type=int, default=100, help="Number of jobs with a log")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generators")
+    parser.add_argument("--workdir", help="Where databases are generated, a temporary directory by default")
+    parser.add_argument("--output", help="Path of the JSON results")
+    parser.add_argument("--compare", help="Path of previous JSON results to compare with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="Share by which a route's p95 can grow before it is reported as slower")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="broker-bench-")
+    try:
+        results = []
+        context = multiprocessing.get_context("spawn")
+        for size in args.sizes:
+            with context.Pool(1) as pool:
+                results.append(pool.apply(run, (size, args, workdir)))
+            _print_result(results[-1])
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    options = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "workdir")}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"options": options, "results": results}, output, indent=2)
+    if args.compare:
+        print()
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Generates synthetic Broker databases at production scale.
+
+Jobs are written with bulk inserts, bypassing the ORM, with the event
+history they would have had: WAITING when received, RUNNING when claimed,
+then DONE or TERMINATED. Most jobs are finished, the most recent ones are
+still running or waiting. A sample of finished jobs gets a log file.
+
+Usage, from the api directory:
+    $ python -m benchmarks.make_db bench.db --jobs 100000 --logs-dir bench-logs
+"""
+
+
+import argparse
+import os
+import random
+import sqlite3
+from time import time
+
+from broker.core.database import DataBaseManager
+from broker.core.logs import LogStorage
+from broker.core.models import LogFile
+from broker.core.utils import JobStatus
+
+
+# Number of jobs written per executemany
+CHUNK_SIZE = 10000
+COMMANDS = (
+    "python train.py --config experiments/{}.json",
+    "docker run --gpus all --rm -v /data:/data tensorflow python run_experiments.py {}",
+    "bash scripts/preprocess.sh {}",
+    "python evaluate.py --checkpoint checkpoints/{}.ckpt",
+)
+DESCRIPTIONS = (
+    "Train model {}",
+    "Run experiment {}",
+    "Preprocess dataset {}",
+    "Evaluate checkpoint {}",
+)
+# Shapes of the jobs (gpus, gpu_memory, cpus, memory) and their weights
+SHAPES = (
+    ((0, 0, 1, 2048), 3),
+    ((1, 8000, 4, 16000), 5),
+    ((2, 16000, 8, 32000), 2),
+)
+_JOB_INSERT = (
+    "INSERT INTO jobs (identifier, user, status, last_update, runner, progress, "
+    "last_heartbeat, lease_expiry, attempts, epoch_received, description, command, "
+    "gpus, gpu_memory, cpus, memory) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_EVENT_INSERT = "INSERT INTO events (job_id, timestamp, status) VALUES (?, ?, ?)"
+
+
+def make_db(
+        sqlite_file, n_jobs, n_users=50, n_runners=20, waiting=0.03, running=0.01,
+        days=90, logs=None, n_logs=100, log_lines=2000, seed=0):
+    """Writes a database of synthetic jobs.
+
+    Args:
+        sqlite_file (str): Path of the database, must not exist
+        n_jobs (int): Number of jobs
+        n_users (int): Number of users submitting jobs
+        n_runners (int): Number of runners running jobs
+        waiting (float): Share of the jobs that are WAITING
+        running (float): Share of the jobs that are RUNNING
+        days (float): Jobs are received over that many days, until now
+        logs (broker.core.logs.LogStorage): Where the logs are written,
+            no logs if None
+        n_logs (int): Number of finished jobs with a log
+        log_lines (int): Number of lines of each log
+        seed (int): Seed of the random generator
+
+    Returns:
+        (list) identifiers of the jobs with a log
+    """
+    rand = random.Random(seed)
+    DataBaseManager(sqlite_file).close()  # Create the schema
+    connection = sqlite3.connect(sqlite_file)
+    connection.execute("PRAGMA synchronous = OFF")
+    now = time()
+    start = now - days * 24 * 3600
+    n_waiting = int(n_jobs * waiting)
+    n_running = int(n_jobs * running)
+    n_finished = n_jobs - n_waiting - n_running
+    shapes, weights = zip(*SHAPES)
+
+    with connection:
+        jobs, events = [], []
+        for identifier in range(1, n_jobs + 1):
+            received = start + (now - start) * (identifier - 1) / n_jobs
+            shape = rand.choices(shapes, weights)[0]
+            name = f"{identifier:07d}"
+            row = {
+                "identifier": identifier,
+                "user": f"user{rand.randrange(n_users)}@mail.com",
+                "status": JobStatus.WAITING.value,
+                "last_update": received,
+                "runner": None,
+                "progress": None,
+                "last_heartbeat": None,
+                "lease_expiry": None,
+                "attempts": 0,
+                "epoch_received": received,
+                "description": rand.choice(DESCRIPTIONS).format(name),
+                "command": rand.choice(COMMANDS).format(name),
+            }
+            events.append((identifier, received, JobStatus.WAITING.value))
+            if identifier <= n_finished + n_running:
+                claimed = min(received + rand.expovariate(1 / 600), now)
+                row.update(
+                    status=JobStatus.RUNNING.value, last_update=claimed, attempts=1,
+                    runner=f"runner-{rand.randrange(n_runners)}")
+                events.append((identifier, claimed, JobStatus.RUNNING.value))
+            if identifier <= n_finished:
+                ended = min(claimed + rand.lognormvariate(7, 1.5), now)
+                status = JobStatus.DONE if rand.random() < 0.9 else JobStatus.TERMINATED
+                row.update(
+                    status=status.value, last_update=ended, progress=1.0,
+                    last_heartbeat=ended)
+                events.append((identifier, ended, status.value))
+            elif row["status"] == JobStatus.RUNNING.value:
+                row.update(
+                    progress=rand.random(), last_heartbeat=now,
+                    lease_expiry=now + 24 * 3600)
+            jobs.append(tuple(row.values()) + shape)
+            if len(jobs) == CHUNK_SIZE or identifier == n_jobs:
+                connection.executemany(_JOB_INSERT, jobs)
+                connection.executemany(_EVENT_INSERT, events)
+                jobs, events = [], []
+        connection.executemany(
+            "INSERT INTO runners (identifier, last_seen) VALUES (?, ?)",
+            [(f"runner-{i}", now) for i in range(n_runners)],
+        )
+
+    with_logs = []
+    if logs is not None and n_finished:
+        with_logs = sorted(rand.sample(range(1, n_finished + 1), min(n_logs, n_finished)))
+        with connection:
+            for identifier in with_logs:
+                filename = LogFile().filename
+                connection.execute(
+                    "INSERT INTO logfiles (job_id, filename) VALUES (?, ?)",
+                    (identifier, filename),
+                )
+                logs.append(filename, b"".join(
+                    f"[{identifier}] step {i}: loss={rand.random():.6f}\n".encode()
+                    for i in range(log_lines)
+                ))
+    connection.close()
+    return with_logs
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("sqlite_file", help="Path of the database, must not exist")
+    parser.add_argument("--jobs", type=int, default=100000, help="Number of jobs")
+    parser.add_argument("--users", type=int, default=50, help="Number of users")
+    parser.add_argument("--runners", type=int, default=20, help="Number of runners")
+    parser.add_argument("--waiting", type=float, default=0.03, help="Share of WAITING jobs")
+    parser.add_argument("--running", type=float, default=0.01, help="Share of RUNNING jobs")
+    parser.add_argument("--days", type=float, default=90, help="Days over which jobs are received")
+    parser.add_argument("--logs-dir", help="Directory where logs are written, no logs if not set")
+    parser.add_argument("--logs", type=int, default=100, help="Number of jobs with a log")
+    parser.add_argument("--log-lines", type=int, default=2000, help="Number of lines of each log")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    args = parser.parse_args()
+
+    started = time()
+    if args.logs_dir:
+        os.makedirs(args.logs_dir, exist_ok=True)
+    make_db(
+        args.sqlite_file, args.jobs, n_users=args.users, n_runners=args.runners,
+        waiting=args.waiting, running=args.running, days=args.days,
+        logs=LogStorage(args.logs_dir) if args.logs_dir else None,
+        n_logs=args.logs, log_lines=args.log_lines, seed=args.seed,
+    )
+    print(f"Wrote {args.jobs} jobs to {args.sqlite_file} in {time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,16 @@ This is where the app is created.
 See: https://hackersandslackers.com/flask-application-factory
 """
 
-from flask import Flask
+from time import perf_counter
+
+from flask import Flask, g, request
 from flask_cors import CORS
 
+from broker.core.cache import ResponseCache
+from broker.core.database import DataBaseManager
+from broker.core.logs import LogStorage
+from broker.core.metrics import Metrics
+from broker.core.profiling import QueryProfiler
 from broker.core.scheduling import Scheduler
 
 
@@ -18,11 +25,74 @@ def create_app(config_class):
         instance_relative_config=False
     )
     app.config.from_object(config_class)
-    CORS(app)
-    schedule = Scheduler(config_class.DATABASE_URI)
+    CORS(app, expose_headers=[
+        "Link", "X-Log-Offset", "X-Last-Event-ID", "X-DB-Queries", "X-DB-Time"])
+    schedule = Scheduler(config_class.DATABASE_URI, config_class)
+    logs = LogStorage(config_class.STORAGE_URI)
+    archive_db = None
+    if config_class.ARCHIVE_URI:
+        archive_db = DataBaseManager(config_class.ARCHIVE_URI)
+    schedule.start_timer()
+    if config_class.REAPER_INTERVAL:
+        schedule.start_reaper(
+            config_class.REAPER_INTERVAL,
+            max_age=config_class.CHANGE_RETENTION_AGE,
+            max_count=config_class.CHANGE_RETENTION_COUNT,
+        )
+    if archive_db is not None and config_class.ARCHIVE_INTERVAL:
+        schedule.start_archiver(
+            archive_db,
+            config_class.ARCHIVE_INTERVAL,
+            max_age=config_class.RETENTION_AGE,
+            max_count=config_class.RETENTION_COUNT,
+            logs=logs if config_class.ARCHIVE_REMOVE_LOGS else None,
+            change_retention={
+                "max_age": config_class.CHANGE_RETENTION_AGE,
+                "max_count": config_class.CHANGE_RETENTION_COUNT,
+            },
+        )
+
+    profiler = None
+    if config_class.PROFILE_SQL:
+        profiler = QueryProfiler(config_class.SLOW_QUERY_THRESHOLD)
+        profiler.attach(schedule.db_manager.engine)
+        if archive_db is not None:
+            profiler.attach(archive_db.engine)
+
+    @app.before_request
+    def start_timer():
+        """Requests are timed from here to the end of `observe_request`"""
+        g.started = perf_counter()
+        if profiler is not None:
+            profiler.start_request()
+
+    @app.after_request
+    def observe_request(response):
+        """Requests are recorded by route, so that metrics have a bounded
+        number of series"""
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        if profiler is not None:
+            queries, seconds = profiler.end_request(f"{request.method} {route}")
+            response.headers["X-DB-Queries"] = queries
+            response.headers["X-DB-Time"] = f"{seconds:.6f}"
+        app.metrics.observe_request(
+            request.method, route, response.status_code, perf_counter() - g.started)
+        return response
+
+    @app.teardown_appcontext
+    def remove_sessions(_exc):
+        """Database sessions are per thread, and end with the request"""
+        schedule.db_manager.session.remove()
+        if archive_db is not None:
+            archive_db.session.remove()
 
     with app.app_context():
-        from broker.routes import jobs, runners # pylint: disable=C0415,W0611
+        from broker.routes import jobs, runners, events, archive, metrics, debug # pylint: disable=C0415,W0611
         app.schedule = schedule
+        app.logs = logs
+        app.archive = archive_db
+        app.metrics = Metrics(schedule, logs)
+        app.profiler = profiler
+        app.cache = ResponseCache(config_class.RESPONSE_CACHE_SIZE)
 
         return app
@@ -5,6 +5,44 @@
 
 class Config:
     """Config base class"""
+    # Number of database connections kept open
+    DATABASE_POOL_SIZE = 10
+    # Number of read responses cached until the schedule changes, 0 to
+    # disable the cache and ETags
+    RESPONSE_CACHE_SIZE = 128
+    # Seconds a runner holds a job without sending a heartbeat
+    LEASE_DURATION = 120
+    # Number of claims of a job before it's left UNKNOWN when runners are lost
+    MAX_ATTEMPTS = 3
+    # Seconds between two checks for expired leases and old changes, 0 to
+    # disable them
+    REAPER_INTERVAL = 10
+    # Seconds changes are kept for clients to resume their stream, None for
+    # no limit
+    CHANGE_RETENTION_AGE = 24 * 3600
+    # Number of changes kept, None for no limit
+    CHANGE_RETENTION_COUNT = 100000
+    # SQLite file where finished jobs are archived, "" to disable archiving
+    ARCHIVE_URI = ""
+    # Seconds finished jobs are kept before being archived, None for no limit
+    RETENTION_AGE = 30 * 24 * 3600
+    # Number of finished jobs kept, None for no limit
+    RETENTION_COUNT = None
+    # Seconds between two archiving runs, 0 to disable them
+    ARCHIVE_INTERVAL = 3600
+    # Remove the log files of archived jobs instead of keeping them
+    ARCHIVE_REMOVE_LOGS = False
+    # Seconds of waiting one priority level is worth
+    PRIORITY_STEP = 3600
+    # Seconds of waiting one second of runtime recently consumed by a user
+    # costs their jobs, 0 to disable fair-share
+    FAIR_SHARE_WEIGHT = 1.0
+    # Seconds after which the runtime consumed by a user counts half as much
+    FAIR_SHARE_HALF_LIFE = 24 * 3600
+    # Profile SQL statements, see GET /debug/queries
+    PROFILE_SQL = False
+    # Seconds after which a profiled statement is logged with its query plan
+    SLOW_QUERY_THRESHOLD = 0.1
 
 
 class ProdConfig(Config):
@@ -13,6 +51,7 @@ class ProdConfig(Config):
     TESTING = False
     DEBUG = False
     DATABASE_URI = ""
+    STORAGE_URI = ""
 
 
 class DevConfig(Config):
@@ -22,6 +61,7 @@ class DevConfig(Config):
     DEBUG = True
     DATABASE_URI = "/data/data.db"
     STORAGE_URI = "/data"
+    ARCHIVE_URI = "/data/archive.db"
     LOGFILE = "/data/out.log"
 
 
@@ -32,3 +72,7 @@ class TestConfig(Config):
     DEBUG = True
     DATABASE_URI = "tests/test_data/data.db"
     STORAGE_URI = "tests/test_data/data"
+    ARCHIVE_URI = "tests/test_data/archive.db"
+    REAPER_INTERVAL = 0
+    ARCHIVE_INTERVAL = 0
+    PROFILE_SQL = True
@@ -0,0 +1,79 @@
+"""Archiving of finished jobs to another database."""
+
+
+import logging
+
+from broker.core.utils import BackgroundTask
+
+
+logger = logging.getLogger(__name__)
+
+# Number of jobs archived per transaction
+ARCHIVE_BATCH_SIZE = 500
+# Seconds between two archive transactions, to let other writers in
+ARCHIVE_PAUSE = 0.1
+
+
+class ArchiveMixin:
+    """Archiving of the `Scheduler`."""
+
+    def __init__(self):
+        self._archiver = BackgroundTask("archiver")
+
+    def archive_jobs(self, archive, max_age=None, max_count=None,
+                     batch_size=ARCHIVE_BATCH_SIZE, logs=None):
+        """Moves a batch of finished jobs to an archive database.
+
+        Args:
+            archive (DataBaseManager): Archive database
+            max_age, max_count: Retention policy, see
+                `DataBaseManager.get_archivable_jobs`
+            batch_size (int): Maximum number of jobs to archive
+            logs (LogStorage): If given, the log files of the jobs are
+                removed from it instead of being archived
+
+        Returns:
+            (list) identifiers of the archived jobs
+        """
+        identifiers = self.db_manager.get_archivable_jobs(max_age, max_count, batch_size)
+        if not identifiers:
+            return []
+        rows = self.db_manager.export_jobs(identifiers)
+        logfiles = rows["logfiles"]
+        if logs is not None:
+            rows["logfiles"] = []
+        archive.import_jobs(rows)
+        archived = self.db_manager.delete_finished_jobs(identifiers)
+        for identifier in set(identifiers) - set(archived):
+            # Not finished anymore, it will be archived again later
+            archive.remove_job(identifier)
+        if logs is not None:
+            for logfile in logfiles:
+                if logfile["job_id"] in archived:
+                    logs.remove(logfile["filename"])
+        if archived:
+            self._notify_change()
+        return archived
+
+    def start_archiver(self, archive, interval, change_retention=None, **kwargs):
+        """Archives finished jobs (see `archive_jobs` for `kwargs`), then
+        prunes changes, every `interval` seconds in a background thread."""
+        def run():
+            total = 0
+            archived = self.archive_jobs(archive, **kwargs)
+            while archived and not self._archiver.stopped.is_set():
+                total += len(archived)
+                self._archiver.stopped.wait(ARCHIVE_PAUSE)
+                archived = self.archive_jobs(archive, **kwargs)
+            if total:
+                logger.info("Archived %i jobs", total)
+                self.prune_changes(**(change_retention or {}))
+
+        def cleanup():
+            self.release_session()
+            archive.session.remove()
+        self._archiver.start(run, interval, cleanup=cleanup)
+
+    def stop_archiver(self):
+        """Stops the background thread started by `start_archiver`."""
+        self._archiver.stop()
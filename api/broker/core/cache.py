@@ -0,0 +1,50 @@
+"""In-process cache of serialized responses.
+
+Used by read endpoints to answer repeated requests without reading the
+database, as long as the schedule didn't change.
+"""
+
+
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Least recently used cache of responses, for one schedule version.
+
+    Entries are keyed by the schedule version and the request. When the
+    version changes, every entry is outdated, so the cache is cleared.
+
+    Attributes:
+        size (int): Maximum number of entries
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        """Returns the entry cached for a request, None if there is none."""
+        with self._lock:
+            if version != self._version or key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, version, key, value):
+        """Caches an entry for a request, unless the version is outdated."""
+        with self._lock:
+            if self._version is not None and version < self._version:
+                return
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
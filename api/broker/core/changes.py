@@ -0,0 +1,126 @@
+"""Changes of the schedule, streamed to clients and synced between
+processes."""
+
+
+import logging
+import threading
+from time import monotonic
+
+from broker.core.utils import JobStatus
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which the in-memory indexes are synced with the changes made
+# by other processes serving the same database, see `ChangeMixin.sync`
+SYNC_INTERVAL = 1
+# Number of changes read per query when syncing
+SYNC_BATCH_SIZE = 1000
+
+
+class ChangeMixin:
+    """Change tracking of the `Scheduler`.
+
+    Attributes:
+        version: Integer, bumped every time the schedule changes
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._instance = self.db_manager.origin
+        self._changed = threading.Condition()
+        self._last_change = self.db_manager.get_change_bounds()[1] or 0
+        self._last_sync = monotonic()
+        self._sync_lock = threading.Lock()
+
+    def get_changes(self, after=0, limit=None):
+        """Returns the changes made after a given change."""
+        return self.db_manager.get_changes(after, limit)
+
+    def get_change_bounds(self):
+        """Returns the identifiers of the first and last recorded changes."""
+        return self.db_manager.get_change_bounds()
+
+    def prune_changes(self, max_age=None, max_count=None):
+        """Deletes old changes, see `DataBaseManager.prune_changes`."""
+        deleted = self.db_manager.prune_changes(max_age, max_count)
+        if deleted:
+            logger.info("Pruned %i changes", deleted)
+        return deleted
+
+    def wait_for_changes(self, after, timeout):
+        """Waits until a change more recent than `after` is recorded, and
+        returns whether there is one."""
+        deadline = monotonic() + timeout
+        while True:
+            version = self.version
+            try:
+                if (self.get_change_bounds()[1] or 0) > after:
+                    return True
+            finally:
+                self.release_session()
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            # The database is read without the lock, so writers don't wait
+            with self._changed:
+                self._changed.wait_for(lambda: self.version != version, remaining)
+
+    def release_session(self):
+        """Returns this thread's connection to the pool."""
+        self.db_manager.session.remove()
+
+    @property
+    def etag(self):
+        """Entity tag of the current version, unique to this process."""
+        return f"{self._instance}-{self.version}"
+
+    def sync(self, interval=0):
+        """Applies the changes made by other processes, unless the last sync
+        was less than `interval` seconds ago."""
+        if monotonic() - self._last_sync < interval:
+            return
+        with self._sync_lock:
+            if monotonic() - self._last_sync < interval:
+                return
+            self._last_sync = monotonic()
+            first, last = self.get_change_bounds()
+            if last is None or last <= self._last_change:
+                return
+            if first > self._last_change + 1:
+                self.rebuild_queue()
+                self.rebuild_timers()
+                self._last_change = last
+                self._notify_change()
+                return
+            synced = False
+            changes = self.get_changes(self._last_change, SYNC_BATCH_SIZE)
+            while changes:
+                identifiers = {
+                    change.job_id for change in changes if change.origin != self._instance
+                }
+                if identifiers:
+                    self._sync_jobs(identifiers)
+                    synced = True
+                self._last_change = changes[-1].identifier
+                changes = self.get_changes(self._last_change, SYNC_BATCH_SIZE)
+            if synced:
+                self._notify_change()
+
+    def _sync_jobs(self, identifiers):
+        jobs = self.db_manager.get_jobs_by_ids(identifiers)
+        for job in jobs:
+            self._push(job)
+            if job.status != JobStatus.RUNNING.value:
+                self.fair_share.stop(job.identifier, job.last_update)
+            elif job.identifier not in self.fair_share:
+                self.fair_share.start(job.identifier, job.user, job.last_update)
+        for identifier in identifiers - {job.identifier for job in jobs}:
+            self.queue.remove(identifier)
+            self.timers.remove(identifier)
+            self.fair_share.stop(identifier)
+
+    def _notify_change(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
@@ -0,0 +1,138 @@
+"""Cron expressions.
+
+Recurring jobs are given a standard 5-field cron expression, `minute hour
+day-of-month month day-of-week`, evaluated in the local time of the API.
+Fields accept `*`, values, ranges (`1-5`), steps (`*/15`, `0-30/10`), lists
+(`1,15`), and month and day names (`jan`, `mon`). Days of week go from 0
+(Sunday) to 7 (Sunday again). As in cron, when both the day of month and
+the day of week are restricted, a day matching either of them fires.
+"""
+
+
+from datetime import datetime, timedelta
+
+
+# Name, minimum and maximum of each field
+FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+)
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_NAMES = {
+    "month": {
+        name: i + 1 for i, name in enumerate((
+            "jan", "feb", "mar", "apr", "may", "jun",
+            "jul", "aug", "sep", "oct", "nov", "dec"))
+    },
+    "weekday": {
+        name: i for i, name in enumerate(("sun", "mon", "tue", "wed", "thu", "fri", "sat"))
+    },
+}
+# Years searched for the next occurrence before an expression is considered
+# to never fire (e.g. on February 30th)
+MAX_YEARS = 5
+
+
+class Cron:
+    """A parsed cron expression.
+
+    Attributes:
+        expression (str): Expression, as given
+        minutes, hours, days, months, weekdays: Sets of the values of each
+            field that fire
+    """
+
+    def __init__(self, expression):
+        """Parses an expression.
+
+        Raises:
+            ValueError: if the expression is not valid
+        """
+        self.expression = expression
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f"Invalid cron expression {expression}")
+        values = [_parse_field(field, *spec) for field, spec in zip(fields, FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = {day % 7 for day in weekdays}
+        # Whether the day of month and the day of week are unrestricted
+        self._wildcards = (fields[2] == "*", fields[4] == "*")
+
+    def next(self, after):
+        """Returns the first epoch strictly after another one at which the
+        expression fires.
+
+        Raises:
+            ValueError: if the expression doesn't fire in the next
+                `MAX_YEARS` years
+        """
+        moment = datetime.fromtimestamp(after).replace(second=0, microsecond=0)
+        moment += timedelta(minutes=1)
+        last_year = moment.year + MAX_YEARS
+        while moment.year <= last_year:
+            if moment.month not in self.months:
+                year, month = divmod(moment.month, 12)
+                moment = moment.replace(
+                    year=moment.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"Cron expression {self.expression} never fires")
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if any(self._wildcards):
+            return day and weekday
+        return day or weekday
+
+    def __repr__(self):
+        return f"Cron<{self.expression}>"
+
+
+def _parse_field(field, name, minimum, maximum):
+    """Returns the set of values of a field.
+
+    Raises:
+        ValueError: if the field is not valid
+    """
+    values = set()
+    for item in field.lower().split(","):
+        item, _, step = item.partition("/")
+        if item == "*":
+            start, end = minimum, maximum
+        elif "-" in item:
+            start, end = (_parse_value(v, name) for v in item.split("-", 1))
+        else:
+            start = end = _parse_value(item, name)
+            if step:
+                end = maximum
+        step = _parse_value(step, name) if step else 1
+        if not minimum <= start <= end <= maximum or step < 1:
+            raise ValueError(f"Invalid {name} field {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def _parse_value(value, name):
+    if value in _NAMES.get(name, {}):
+        return _NAMES[name][value]
+    if not value.isdigit():
+        raise ValueError(f"Invalid {name} value {value}")
+    return int(value)
@@ -1,44 +1,191 @@
 """Database module"""
 
 
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker, scoped_session
+from collections import defaultdict
+import json
+from time import time
+from uuid import uuid4
 
-from broker.core.models import Base, Job, Event, LogFile
-from broker.core.utils import JobStatus
+from sqlalchemy import create_engine, inspect, func
+from sqlalchemy.event import listen
+from sqlalchemy.orm import sessionmaker, scoped_session, load_only, selectinload
+from sqlalchemy.pool import QueuePool
+
+from broker.core import migrations
+from broker.core.models import Base, Job, Event, Change
+from broker.core.queries.archive import ArchiveQueriesMixin
+from broker.core.queries.changes import ChangeQueriesMixin
+from broker.core.queries.dependencies import DependencyQueriesMixin
+from broker.core.queries.events import EventQueriesMixin
+from broker.core.queries.logfiles import LogFileQueriesMixin
+from broker.core.queries.runners import RunnerQueriesMixin
+from broker.core.queries.timers import TimerQueriesMixin
+from broker.core.queries.usage import UsageQueriesMixin
+from broker.core.utils import JobStatus, RESOURCES
 
 
 # pylint: disable=no-member
 
+# Number of connections kept open, more can be opened under load
+POOL_SIZE = 10
+# Seconds a connection waits for another one to release the write lock
+BUSY_TIMEOUT = 30
+
 
-class DataBaseManager():
+# pylint: disable=too-many-ancestors
+class DataBaseManager(
+        ArchiveQueriesMixin, ChangeQueriesMixin, DependencyQueriesMixin, EventQueriesMixin,
+        LogFileQueriesMixin, RunnerQueriesMixin, TimerQueriesMixin, UsageQueriesMixin):
     """Wrapper for SQL database related operations
 
     Attributes:
         sqlite_file (string): Path of the SQLite database file
         engine (sqlalchemy.engine.Engine): Database engine
-        session (sqlalchemy.orm.session.Session): Session
+        session (sqlalchemy.orm.scoped_session): Thread-local session registry
+        origin (str): Tag of the changes written through this manager
     """
 
-    def __init__(self, sqlite_file="data.db"):
+    def __init__(self, sqlite_file="data.db", pool_size=POOL_SIZE):
         self.sqlite_file = sqlite_file
-        self.engine = create_engine(f"sqlite:///{self.sqlite_file}")
-        session = scoped_session(sessionmaker(bind=self.engine))
-        self.session = session()
+        self.origin = uuid4().hex[:8]
+        self.engine = create_engine(
+            f"sqlite:///{self.sqlite_file}",
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=2 * pool_size,
+            # Connections are used by one thread at a time, but not always
+            # the one that opened them
+            connect_args={"check_same_thread": False},
+        )
+        listen(self.engine, "connect", _set_pragmas)
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+        is_new = "jobs" not in inspect(self.engine).get_table_names()
         Base.metadata.create_all(self.engine)  # Create db if needed
+        if is_new:
+            migrations.stamp(self.engine)
+        else:
+            migrations.migrate(self.engine)
 
+    def close(self):
+        """Removes this thread's session and closes all connections."""
+        self.session.remove()
+        self.engine.dispose()
 
     # ------------------------------ Jobs ------------------------------ #
 
     def add_job(self, job):
-        """Adds a job to the database."""
+        """Adds a job to the database, see `Job.initial_status`.
+
+        Raises:
+            IndexError: if the job depends on a job that doesn't exist
+        """
         self.session.add(job)
-        job.events.append(Event(status=JobStatus.WAITING.value))
+        failed = set()
+        if job.dependencies:
+            self.session.flush()
+            failed = self._link_dependencies([job])
+        job.set_status(JobStatus.TERMINATED.value if failed else job.initial_status)
+        job.epoch_received = job.last_update
+        self.session.flush()
+        self._record_change(job.identifier, "created", job.to_dict())
         self.session.commit()
 
-    def get_jobs(self):
-        """Returns all jobs from the database"""
-        return self.session.query(Job).all()
+    def add_jobs(self, jobs):
+        """Adds jobs to the database in a single transaction.
+
+        Raises:
+            IndexError: if a job depends on a job that doesn't exist
+
+        Returns:
+            (list) identifiers of the jobs, in order
+        """
+        if not jobs:
+            return []
+        now = time()
+        columns = [c.name for c in Job.__table__.columns if c.name != "identifier"]
+        job_rows = []
+        for job in jobs:
+            job.status = job.initial_status
+            job.last_update = job.epoch_received = now
+            job.attempts = 0
+            job_rows.append({c: getattr(job, c) for c in columns})
+            for resource in RESOURCES:
+                job_rows[-1][resource] = job_rows[-1][resource] or 0
+        event_rows = [{"timestamp": now, "status": job.status} for job in jobs]
+
+        connection = self.session.connection()
+        job_ids = self._bulk_insert(connection, Job.__table__, job_rows)
+        for job, job_id in zip(jobs, job_ids):
+            job.identifier = job_id
+        if any(job.dependencies for job in jobs):
+            self._bulk_link_dependencies(connection, jobs, job_rows)
+        for event, job, job_id in zip(event_rows, jobs, job_ids):
+            event["job_id"] = job_id
+            event["status"] = job.status
+        self._bulk_insert(connection, Event.__table__, event_rows)
+        change_rows = []
+        for row, event in zip(job_rows, event_rows):
+            data = {f: row.get(f) for f in Job.FIELDS}
+            data["events"] = [{
+                "identifier": event["identifier"],
+                "timestamp": event["timestamp"],
+                "status": event["status"],
+            }]
+            change_rows.append({
+                "job_id": row["identifier"],
+                "kind": "created",
+                "timestamp": now,
+                "data": json.dumps(data),
+                "origin": self.origin,
+            })
+        connection.execute(Change.__table__.insert(), change_rows)
+        self.session.commit()
+        return job_ids
+
+    def get_jobs(self, after=None, limit=None, since=None, fields=Job.FIELDS, **kwargs):
+        """Returns jobs from the database, ordered by identifier.
+
+        Args:
+            after (int): Keyset cursor, only jobs with a greater identifier
+            limit (int): Maximum number of jobs to return
+            since (float): Only jobs received at or after this epoch
+            fields (iterable): Columns to load, see `Job.FIELDS`
+            kwargs: Equality filters on columns (e.g. status, user)
+        """
+        columns = [getattr(Job, f) for f in fields if f not in ("identifier", "events")]
+        query = self.session.query(Job).options(load_only(Job.identifier, *columns))
+        if "events" in fields:
+            query = query.options(selectinload(Job.events))
+        return self._select_jobs(query, after, limit, since, **kwargs).all()
+
+    def get_jobs_as_dicts(self, after=None, limit=None, since=None, fields=Job.FIELDS,
+                          **kwargs):
+        """Same as `get_jobs`, but returns jobs in Python dict format."""
+        columns = [getattr(Job, f) for f in fields if f not in ("identifier", "events")]
+        rows = self._select_jobs(
+            self.session.query(Job.identifier, *columns), after, limit, since, **kwargs
+        ).all()
+        events = defaultdict(list)
+        if "events" in fields and rows:
+            page = self._select_jobs(
+                self.session.query(Job.identifier), after, limit, since, **kwargs
+            )
+            query = (self.session)\
+                .query(Event.job_id, Event.identifier, Event.timestamp, Event.status)\
+                .filter(Event.job_id.in_(page.subquery()))\
+                .order_by(Event.job_id, Event.timestamp, Event.identifier)
+            for event in query:
+                events[event.job_id].append({
+                    "identifier": event.identifier,
+                    "timestamp": event.timestamp,
+                    "status": event.status,
+                })
+        res = []
+        for row in rows:
+            values = row._asdict()
+            values["events"] = events[row.identifier]
+            res.append({f: values[f] for f in fields})
+        return res
 
     def get_job_by_id(self, identifier):
         """Returns a job given an id."""
@@ -46,24 +193,130 @@ class DataBaseManager():
             return self.session.query(Job).filter_by(identifier=identifier).first()
         return None
 
+    def get_jobs_by_ids(self, identifiers):
+        """Returns the jobs with the given ids, in a single query."""
+        return self.session.query(Job).filter(Job.identifier.in_(identifiers)).all()
+
     def update_job(self, identifier, **kwargs):
         """Updates a job."""
         if self._job_exists(identifier):
             job = self.get_job_by_id(identifier)
             for key, value in kwargs.items():
                 if key == "status":
-                    job.events.append(Event(status=value))
+                    job.set_status(value)
                 else:
                     setattr(job, key, value)
+            if "status" in kwargs:
+                self.session.flush()
+                self._record_status_change(identifier, job.events[-1], job.runner)
             self.session.commit()
         else:
             raise IndexError(f"Job #{identifier} not found")
 
+    def update_jobs(self, updates, runner=None, lease_duration=None):
+        """Applies several job updates in a single transaction.
+
+        Args:
+            updates (list): dicts with a job's identifier, and optionally its
+                new status (value), progress, and usage samples
+            runner (str): Id of the runner sending the updates, which must
+                hold the jobs
+            lease_duration (float): Seconds a heartbeat renews a lease for
+
+        Returns:
+            (tuple) lists of the identifiers of the jobs that were not found,
+                and of the jobs that were lost
+        """
+        identifiers = {update["identifier"] for update in updates}
+        jobs = {
+            job.identifier: job for job in
+            self.session.query(Job).filter(Job.identifier.in_(identifiers))
+        }
+        now = time()
+        missing, lost, applied, events, usage = [], [], [], [], {}
+        for update in updates:
+            job = jobs.get(update["identifier"])
+            if job is None:
+                missing.append(update["identifier"])
+                continue
+            if runner is not None and (job.runner != runner or (
+                    "status" not in update and job.status != JobStatus.RUNNING.value)):
+                lost.append(update["identifier"])
+                continue
+            applied.append(job)
+            job.last_heartbeat = now
+            if "progress" in update:
+                job.progress = update["progress"]
+            if update.get("usage"):
+                usage.setdefault(job.identifier, []).extend(update["usage"])
+            if "status" in update:
+                job.status, job.last_update = update["status"], now
+                events.append({"job_id": job.identifier, "timestamp": now, "status": job.status})
+            if job.status != JobStatus.RUNNING.value:
+                job.lease_expiry = None
+            elif lease_duration is not None:
+                job.lease_expiry = now + lease_duration
+        if runner is not None:
+            self._touch_runner(runner, now)
+        self.session.flush()
+        connection = self.session.connection()
+        if events:
+            self._bulk_insert(connection, Event.__table__, events)
+        if applied:
+            self._record_updates(connection, applied, events, now)
+        if usage:
+            self._add_usage(usage)
+        self.session.commit()
+        return missing, lost
+
+    def expire_leases(self, max_attempts):
+        """Sets the RUNNING jobs whose lease expired to UNKNOWN, then back to
+        WAITING if they were claimed less than `max_attempts` times.
+
+        Returns:
+            (tuple) lists of the identifiers of the expired jobs, and of the
+                ones that were set back to WAITING
+        """
+        now = time()
+        rows = (self.session)\
+            .query(Job.identifier, Job.attempts, Job.runner)\
+            .filter(Job.status == JobStatus.RUNNING.value, Job.lease_expiry < now)\
+            .all()
+        expired, requeued = [], []
+        for row in rows:
+            requeue = (row.attempts or 0) < max_attempts
+            status = JobStatus.WAITING.value if requeue else JobStatus.UNKNOWN.value
+            updated = (self.session)\
+                .query(Job)\
+                .filter(
+                    Job.identifier == row.identifier,
+                    Job.status == JobStatus.RUNNING.value,
+                    Job.lease_expiry < now,
+                )\
+                .update(
+                    {"status": status, "last_update": now, "lease_expiry": None},
+                    synchronize_session=False
+                )
+            if not updated:
+                continue
+            events = [Event(job_id=row.identifier, status=JobStatus.UNKNOWN.value)]
+            if requeue:
+                events.append(Event(job_id=row.identifier, status=JobStatus.WAITING.value))
+                requeued.append(row.identifier)
+            self.session.add_all(events)
+            self.session.flush()
+            for event in events:
+                self._record_status_change(row.identifier, event, row.runner)
+            expired.append(row.identifier)
+        self.session.commit()
+        return expired, requeued
+
     def remove_job(self, identifier):
         """Removes a job the database given an identifier"""
         if self._job_exists(identifier):
             job = self.session.query(Job).filter(Job.identifier == identifier).first()
             self.session.delete(job)
+            self._record_change(identifier, "removed", {"identifier": identifier})
             self.session.commit()
         else:
             raise IndexError(f"Job #{identifier} not found")
@@ -72,65 +325,147 @@ class DataBaseManager():
         """Counts number of jobs in database"""
         return self.session.query(Job).count()
 
-    def select_jobs_by(self, **kwargs):
-        """Selects jobs based on given args."""
-        if len(kwargs) > 1:
-            raise NotImplementedError("Can't select based on 2 args.")
-        if "status" in kwargs:
-            sub = (self.session)\
-                .query(
-                    Event.job_id,
-                    Event.status,
-                    func.max(Event.timestamp)
-                )\
-                .group_by(Event.job_id)\
-                .subquery()
-            return (self.session)\
-                    .query(Job)\
-                    .join((sub, sub.c.job_id == Job.identifier))\
-                    .filter(sub.c.status == kwargs["status"])\
-                    .all()
-        return self.session.query(Job).filter_by(**kwargs).all()
+    def get_stats(self):
+        """Counts jobs by status, and users.
 
-    def get_job_status(self, identifier):
-        """Returns a job's current status"""
-        if self._job_exists(identifier):
-            return (self.session)\
-                .query(
-                    Event.job_id,
-                    Event.status,
-                    func.max(Event.timestamp)
-                )\
-                .filter(Event.job_id == identifier)\
-                .first()\
-                .status
-        raise IndexError(f"Job #{identifier} not found")
+        Returns:
+            (dict) number of jobs, of jobs by status name, and of users
+        """
+        n_jobs, by_status = self.count_jobs_by_status()
+        return {
+            "n_jobs": n_jobs,
+            "status": by_status,
+            "n_users": self.session.query(func.count(func.distinct(Job.user))).scalar(),
+        }
+
+    def count_jobs_by_status(self):
+        """Counts jobs by status.
 
-    # --------------------------- Log files ---------------------------- #
+        Returns:
+            (tuple) number of jobs, and dict of the number of jobs by status
+                name
+        """
+        n_jobs, by_status = 0, {status.name: 0 for status in JobStatus}
+        query = (self.session)\
+            .query(Job.status, func.count(Job.identifier))\
+            .group_by(Job.status)
+        for status, count in query:
+            n_jobs += count
+            if status is not None:
+                by_status[JobStatus(status).name] = count
+        return n_jobs, by_status
+
+    def select_jobs_by(self, **kwargs):
+        """Selects jobs based on given args, ordered by identifier."""
+        return (self.session)\
+            .query(Job)\
+            .filter_by(**kwargs)\
+            .order_by(Job.identifier)\
+            .all()
+
+    def select_first_job_by(self, **kwargs):
+        """Selects the job with the lowest identifier matching given args."""
+        return (self.session)\
+            .query(Job)\
+            .filter_by(**kwargs)\
+            .order_by(Job.identifier)\
+            .first()
 
-    def add_logfile(self, job_id):
-        """Assign a log file to a job given its identifier.
+    def get_queue_entries(self):
+        """Returns what the Scheduler's queue needs to know about WAITING jobs.
 
         Returns:
-            (str) logfile name in the server's file system
+            (list) rows with the identifier, user, priority, submission epoch
+                and required resources of each WAITING job, in order
         """
-        job = self.get_job_by_id(job_id)
-        if job is not None:
-            job.logfile = LogFile(job_id=job_id)
-            return job.logfile.filename
-        raise IndexError(f"Job #{job_id} not found.")
+        return (self.session)\
+            .query(
+                Job.identifier, Job.user, Job.priority, Job.epoch_received,
+                *[getattr(Job, r) for r in RESOURCES])\
+            .filter_by(status=JobStatus.WAITING.value)\
+            .order_by(Job.identifier)\
+            .all()
+
+    def claim_job(self, identifier, runner, lease_duration=None):
+        """Moves a WAITING job to RUNNING on behalf of a runner.
 
-    def get_logfile(self, job_id):
-        """Returns a logfile given its job identifier."""
-        if self._job_exists(job_id):
-            return self.session.query(LogFile).filter_by(job_id=job_id).first()
-        raise IndexError(f"Job #{job_id} not found.")
+        Args:
+            identifier (int): Id of the job to claim
+            runner (str): Id of the runner claiming the job
+            lease_duration (float): Seconds the runner holds the job without
+                sending a heartbeat. None for no lease.
 
+        Returns:
+            (broker.core.models.Job) claimed job, None if it wasn't WAITING
+        """
+        event = Event(job_id=identifier, status=JobStatus.RUNNING.value)
+        claimed = (self.session)\
+            .query(Job)\
+            .filter_by(identifier=identifier, status=JobStatus.WAITING.value)\
+            .update(
+                {
+                    "status": event.status,
+                    "last_update": event.timestamp,
+                    "runner": runner,
+                    "lease_expiry": None if lease_duration is None
+                                    else event.timestamp + lease_duration,
+                    "attempts": func.coalesce(Job.attempts, 0) + 1,
+                },
+                synchronize_session=False
+            )
+        if not claimed:
+            self.session.rollback()
+            return None
+        self.session.add(event)
+        self.session.flush()
+        self._record_status_change(identifier, event, runner)
+        self.session.commit()
+        return self.get_job_by_id(identifier)
+
+    def get_job_status(self, identifier):
+        """Returns a job's current status"""
+        row = (self.session)\
+            .query(Job.status)\
+            .filter_by(identifier=identifier)\
+            .first()
+        if row is None:
+            raise IndexError(f"Job #{identifier} not found")
+        return row.status
 
     # --------------------------- Utilities ---------------------------- #
 
+    @staticmethod
+    def _select_jobs(query, after=None, limit=None, since=None, **kwargs):
+        """Applies filters and keyset pagination to a query on jobs."""
+        query = query.filter_by(**kwargs)
+        if after is not None:
+            query = query.filter(Job.identifier > after)
+        if since is not None:
+            query = query.filter(Job.epoch_received >= since)
+        return query.order_by(Job.identifier).limit(limit)
+
+    @staticmethod
+    def _bulk_insert(connection, table, rows):
+        """Inserts rows in a table, and returns and sets their identifiers.
+        The transaction must hold the write lock, or take it here."""
+        first = connection.execute(table.insert(), rows[0]).inserted_primary_key[0]
+        for i, row in enumerate(rows):
+            row["identifier"] = first + i
+        if len(rows) > 1:
+            connection.execute(table.insert(), rows[1:])
+        return [row["identifier"] for row in rows]
+
     def _job_exists(self, identifier):
         return (self.session)\
             .query(Job.identifier)\
             .filter_by(identifier=identifier)\
             .scalar() is not None
+
+
+def _set_pragmas(connection, _record):
+    """Configures a new SQLite connection."""
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}")
+    cursor.close()
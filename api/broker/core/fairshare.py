@@ -0,0 +1,140 @@
+"""Fair-share accounting of the runtime recently consumed by each user."""
+
+
+import threading
+from time import time
+
+
+# Seconds after which the runtime consumed by a user counts half as much
+HALF_LIFE = 24 * 3600
+# Seconds of waiting one priority level is worth, see `FairShareMixin.queue_key`
+PRIORITY_STEP = 3600
+# Seconds of waiting one second of recently consumed runtime costs a user
+FAIR_SHARE_WEIGHT = 1.0
+# Submission epochs are rounded to that many seconds in queue keys, so that
+# jobs submitted together are served by fit (see
+# `broker.core.scheduling.fit_rank`) rather than strictly in order. It only
+# breaks ties, it doesn't keep large jobs from being starved by small ones
+AGE_RESOLUTION = 60
+
+
+class FairShare:
+    """Recent runtime consumed by each user.
+
+    Attributes:
+        half_life (float): Seconds after which consumed runtime counts half
+            as much
+        _usage: Dict, user -> (decayed runtime, epoch it was decayed to)
+        _running: Dict, job id -> (user, epoch the job started running)
+    """
+
+    def __init__(self, half_life=HALF_LIFE):
+        self.half_life = half_life
+        self._usage = {}
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forgets all consumed runtime."""
+        with self._lock:
+            self._usage = {}
+            self._running = {}
+
+    def add(self, user, seconds, epoch):
+        """Records that a user consumed runtime.
+
+        Args:
+            user (str): User id
+            seconds (float): Runtime consumed
+            epoch (float): Epoch when the runtime was consumed
+        """
+        with self._lock:
+            value, last = self._usage.get(user, (0.0, epoch))
+            if epoch >= last:
+                self._usage[user] = (self._decay(value, epoch - last) + seconds, epoch)
+            else:
+                self._usage[user] = (value + self._decay(seconds, last - epoch), last)
+
+    def start(self, identifier, user, epoch):
+        """Records that a job of a user started running."""
+        with self._lock:
+            self._running[identifier] = (user, epoch)
+
+    def stop(self, identifier, epoch=None):
+        """Records that a job stopped running, and adds its runtime to its
+        user. Does nothing if the job wasn't recorded as running."""
+        epoch = time() if epoch is None else epoch
+        with self._lock:
+            running = self._running.pop(identifier, None)
+        if running is not None:
+            user, started = running
+            self.add(user, max(epoch - started, 0), epoch)
+
+    def __contains__(self, identifier):
+        """Whether a job is recorded as running."""
+        with self._lock:
+            return identifier in self._running
+
+    def usage(self, now=None):
+        """Returns the runtime recently consumed by each user.
+
+        Returns:
+            (dict) user -> seconds, finished runs decayed to `now`, plus the
+                time running jobs have been running
+        """
+        now = time() if now is None else now
+        with self._lock:
+            usage = {
+                user: self._decay(value, now - last)
+                for user, (value, last) in self._usage.items()
+            }
+            for user, started in self._running.values():
+                usage[user] = usage.get(user, 0.0) + max(now - started, 0)
+        return usage
+
+    def _decay(self, value, seconds):
+        if self.half_life <= 0:
+            return 0.0
+        return value * 0.5 ** (max(seconds, 0) / self.half_life)
+
+
+class FairShareMixin:
+    """Ordering of the `Scheduler`'s queue by priority and fair-share.
+
+    Attributes:
+        fair_share: FairShare, runtime recently consumed by each user
+        priority_step: Seconds of waiting one priority level is worth
+        fair_share_weight: Seconds of waiting one second of recently
+            consumed runtime costs a user
+    """
+
+    def __init__(self, priority_step=PRIORITY_STEP, fair_share_weight=FAIR_SHARE_WEIGHT,
+                 half_life=HALF_LIFE):
+        self.fair_share = FairShare(half_life)
+        self.priority_step = priority_step
+        self.fair_share_weight = fair_share_weight
+
+    def queue_key(self, epoch_received, priority):
+        """Returns the key of a job in the queue, lowest first: its submission
+        epoch, minus `priority_step` seconds per priority level."""
+        age = (epoch_received or 0) // AGE_RESOLUTION * AGE_RESOLUTION
+        return age - (priority or 0) * self.priority_step
+
+    def offsets(self):
+        """Returns the offset of the queue keys of each user's jobs."""
+        if not self.fair_share_weight:
+            return {}
+        return {
+            user: seconds * self.fair_share_weight
+            for user, seconds in self.fair_share.usage().items()
+        }
+
+    def load_fair_share(self):
+        """Loads the runtime recently consumed by each user from the database."""
+        now = time()
+        runs, running = self.db_manager.get_runs(now - 10 * self.fair_share.half_life)
+        self.fair_share.clear()
+        for run in runs:
+            self.fair_share.add(run.user, max(run.end - run.start, 0), run.end)
+        for job in running:
+            self.fair_share.start(job.identifier, job.user, job.start)
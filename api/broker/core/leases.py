@@ -0,0 +1,64 @@
+"""Leases of the jobs handed to runners.
+
+A runner holds a RUNNING job for a limited time, and renews its lease with
+heartbeats. The jobs of the runners that stop sending them are taken back.
+"""
+
+
+import logging
+
+from broker.core.utils import BackgroundTask, JobStatus
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a runner holds a job without sending a heartbeat
+LEASE_DURATION = 120
+# Number of times a job is claimed before it is left UNKNOWN when its
+# runner is lost
+MAX_ATTEMPTS = 3
+
+
+class LeaseMixin:
+    """Lease expiration of the `Scheduler`.
+
+    Attributes:
+        lease_duration: Seconds a runner holds a job without sending a
+            heartbeat, see `expire_leases`
+        max_attempts: Number of times a job is claimed before it is left
+            UNKNOWN when its runner is lost
+    """
+
+    def __init__(self, lease_duration=LEASE_DURATION, max_attempts=MAX_ATTEMPTS):
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        self._reaper = BackgroundTask("reaper")
+
+    def expire_leases(self):
+        """Takes back the jobs of lost runners, and returns their identifiers.
+        See `DataBaseManager.expire_leases`."""
+        expired, requeued = self.db_manager.expire_leases(self.max_attempts)
+        for identifier in expired:
+            self.fair_share.stop(identifier)
+        for identifier in requeued:
+            self.requeue(identifier)
+        self.resolve_dependencies({
+            identifier: JobStatus.UNKNOWN.value
+            for identifier in set(expired) - set(requeued)
+        })
+        if expired:
+            logger.warning("Lease of jobs %s expired, requeued %s", expired, requeued)
+            self._notify_change()
+        return expired
+
+    def start_reaper(self, interval, **retention):
+        """Expires leases and prunes changes (see `prune_changes` for
+        `retention`) every `interval` seconds, in a background thread."""
+        def reap():
+            self.expire_leases()
+            self.prune_changes(**retention)
+        self._reaper.start(reap, interval, cleanup=self.release_session)
+
+    def stop_reaper(self):
+        """Stops the background thread started by `start_reaper`."""
+        self._reaper.stop()
@@ -0,0 +1,255 @@
+"""Log storage module.
+
+Job logs are stored compressed in independent blocks, so that any byte range
+of a log (e.g. its last lines) can be read by decompressing only the blocks
+that contain it.
+
+A log is made of 3 files:
+    - <name>.z: zlib compressed blocks, one after the other
+    - <name>.idx: one record per block, with the position of the block in
+        the uncompressed log, and its position and size in the .z file
+    - <name>.tail: the last part of the log, not compressed yet. Starts with
+        the position of its first byte in the uncompressed log.
+
+Logs stored by older versions of Broker are a single raw file, <name>. They
+are converted the first time they are accessed.
+"""
+
+
+import os
+import zlib
+import bisect
+import struct
+import threading
+
+
+BLOCK_SIZE = 256 * 1024
+# Uncompressed offset, compressed offset, compressed size
+_RECORD = struct.Struct("<QQI")
+# Uncompressed offset of the tail
+_HEADER = struct.Struct("<Q")
+
+
+class LogStorage:
+    """Block-compressed storage of job logs.
+
+    Appends can happen while the log is read: a block is first written to
+    the .z and .idx files, then the tail is atomically replaced, and readers
+    skip the part of the tail that is already in a block.
+
+    Attributes:
+        directory (str): Directory where logs are stored
+        block_size (int): Uncompressed size of a block
+    """
+
+    def __init__(self, directory, block_size=BLOCK_SIZE):
+        self.directory = directory
+        self.block_size = block_size
+        self._appended = threading.Condition()
+
+    def exists(self, name):
+        """Checks if a log was written."""
+        return os.path.exists(self._path(name, ".tail")) \
+            or os.path.exists(self._path(name))
+
+    def size(self, name):
+        """Returns the uncompressed size of a log, 0 if it doesn't exist."""
+        self._upgrade(name)
+        start, tail = self._read_tail(name)
+        return start + len(tail)
+
+    def append(self, name, chunk):
+        """Appends bytes to a log, creating it if needed.
+
+        Returns:
+            (int) size of the log after the append
+        """
+        self._upgrade(name)
+        with self._appended:
+            size = self._append(name, chunk)
+            self._appended.notify_all()
+        return size
+
+    def read(self, name, start=0, end=None):
+        """Reads a byte range of a log.
+
+        Only the blocks overlapping the range are decompressed.
+
+        Args:
+            name (str): Log name
+            start (int): Position of the first byte
+            end (int): Position after the last byte, defaults to the end
+
+        Yields:
+            (bytes) consecutive parts of the range
+        """
+        self._upgrade(name)
+        records, blocks_end, tail_start, tail = self._snapshot(name)
+        end = tail_start + len(tail) if end is None else end
+        if start < blocks_end:
+            with open(self._path(name, ".z"), "rb") as blocks:
+                i = bisect.bisect_right([r[0] for r in records], start) - 1
+                while i < len(records) and records[i][0] < end:
+                    offset = records[i][0]
+                    data = self._read_block(blocks, records[i])
+                    yield data[max(start - offset, 0):end - offset]
+                    i += 1
+        if end > tail_start:
+            yield tail[max(start - tail_start, 0):end - tail_start]
+
+    def tail_offset(self, name, lines):
+        """Returns the position where the last lines of a log start.
+
+        Blocks are decompressed backwards, only until enough lines are found.
+        A newline at the very end of the log doesn't start a new line.
+        """
+        self._upgrade(name)
+        records, blocks_end, _, tail = self._snapshot(name)
+        if lines <= 0:
+            return blocks_end + len(tail)
+        newlines = None
+        for start, data in self._segments_backwards(name, records, blocks_end, tail):
+            if newlines is None and data:
+                newlines = lines + 1 if data.endswith(b"\n") else lines
+            if newlines is None:
+                continue
+            position = len(data)
+            for _ in range(newlines):
+                position = data.rfind(b"\n", 0, position)
+                if position < 0:
+                    break
+                newlines -= 1
+            if newlines == 0:
+                return start + position + 1
+        return 0
+
+    def wait(self, name, offset, timeout):
+        """Waits until a log is longer than offset, or until timeout.
+
+        Only appends made by this process wake the wait up.
+
+        Returns:
+            (bool) whether the log is longer than offset
+        """
+        with self._appended:
+            return self._appended.wait_for(lambda: self.size(name) > offset, timeout)
+
+    def disk_usage(self):
+        """Returns the number of bytes taken by all logs on disk."""
+        with os.scandir(self.directory) as entries:
+            return sum(e.stat().st_size for e in entries if e.is_file())
+
+    def remove(self, name):
+        """Removes a log's files."""
+        for suffix in ("", ".z", ".idx", ".tail"):
+            if os.path.exists(self._path(name, suffix)):
+                os.remove(self._path(name, suffix))
+
+    # --------------------------- Utilities ---------------------------- #
+
+    def _path(self, name, suffix=""):
+        return os.path.join(self.directory, name + suffix)
+
+    def _snapshot(self, name):
+        """Returns a consistent view of a log: its block records, where
+        blocks end, and the part of the tail that comes after them."""
+        while True:
+            records = self._read_index(name)
+            blocks_end = records[-1][0] + self.block_size if records else 0
+            tail_start, tail = self._read_tail(name)
+            if tail_start <= blocks_end:
+                return records, blocks_end, blocks_end, tail[blocks_end - tail_start:]
+            # A block was written after the index was read
+
+    def _read_index(self, name):
+        path = self._path(name, ".idx")
+        if not os.path.exists(path):
+            return []
+        with open(path, "rb") as index:
+            data = index.read()
+        # Ignore a record that is being written
+        data = data[:len(data) - len(data) % _RECORD.size]
+        return list(_RECORD.iter_unpack(data))
+
+    @staticmethod
+    def _read_block(blocks, record):
+        blocks.seek(record[1])
+        return zlib.decompress(blocks.read(record[2]))
+
+    def _read_header(self, name):
+        with open(self._path(name, ".tail"), "rb") as tail_file:
+            return _HEADER.unpack(tail_file.read(_HEADER.size))[0]
+
+    def _read_tail(self, name):
+        path = self._path(name, ".tail")
+        if not os.path.exists(path):
+            return 0, b""
+        with open(path, "rb") as tail_file:
+            start = _HEADER.unpack(tail_file.read(_HEADER.size))[0]
+            return start, tail_file.read()
+
+    def _write_tail(self, name, start, data):
+        path = self._path(name, ".tail")
+        with open(path + ".tmp", "wb") as tail_file:
+            tail_file.write(_HEADER.pack(start))
+            tail_file.write(data)
+        os.replace(path + ".tmp", path)
+
+    def _append(self, name, chunk):
+        """Appends bytes to a log, the append lock must be held."""
+        tail_path = self._path(name, ".tail")
+        if not os.path.exists(tail_path):
+            self._write_tail(name, 0, b"")
+        tail_size = os.path.getsize(tail_path) - _HEADER.size
+        if tail_size + len(chunk) < self.block_size:
+            with open(tail_path, "ab") as tail_file:
+                tail_file.write(chunk)
+            size = self._read_header(name) + tail_size + len(chunk)
+        else:
+            start, tail = self._read_tail(name)
+            tail += chunk
+            with open(self._path(name, ".z"), "ab") as blocks, \
+                    open(self._path(name, ".idx"), "ab") as index:
+                while len(tail) >= self.block_size:
+                    block = zlib.compress(tail[:self.block_size])
+                    position = blocks.tell()
+                    blocks.write(block)
+                    blocks.flush()
+                    index.write(_RECORD.pack(start, position, len(block)))
+                    start += self.block_size
+                    tail = tail[self.block_size:]
+            self._write_tail(name, start, tail)
+            size = start + len(tail)
+        return size
+
+    def _upgrade(self, name):
+        """Converts a raw log written by an older version of Broker.
+
+        The conversion holds the append lock, so that concurrent first reads
+        convert the log once, and never see it half converted.
+        """
+        raw_path = self._path(name)
+        if not os.path.exists(raw_path):
+            return
+        with self._appended:
+            if not os.path.exists(raw_path):
+                return
+            # Start over if a previous conversion was interrupted
+            for suffix in (".z", ".idx", ".tail"):
+                if os.path.exists(self._path(name, suffix)):
+                    os.remove(self._path(name, suffix))
+            with open(raw_path, "rb") as raw:
+                self._write_tail(name, 0, b"")
+                chunk = raw.read(self.block_size)
+                while chunk:
+                    self._append(name, chunk)
+                    chunk = raw.read(self.block_size)
+            os.remove(raw_path)
+
+    def _segments_backwards(self, name, records, blocks_end, tail):
+        """Yields (start, data) for the tail then each block, from the end."""
+        yield blocks_end, tail
+        if records:
+            with open(self._path(name, ".z"), "rb") as blocks:
+                for record in reversed(records):
+                    yield record[0], self._read_block(blocks, record)
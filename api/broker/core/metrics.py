@@ -0,0 +1,214 @@
+"""Metrics in the Prometheus text exposition format.
+
+Requests are counted as they are handled, which only takes a lock and a
+few increments. Everything else is collected when the metrics are scraped:
+job counts, active runners and log storage come from the database and the
+disk, and wait and run times from the events recorded since the last
+scrape.
+
+Metrics are kept per process, like Prometheus' own client libraries do,
+and start from zero when the app starts.
+"""
+
+
+import bisect
+import threading
+from time import time
+
+from broker.core.utils import JobStatus
+
+
+# Upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the job wait and run time buckets, in seconds
+DURATION_BUCKETS = (1, 10, 60, 300, 900, 3600, 4 * 3600, 12 * 3600, 24 * 3600, 7 * 24 * 3600)
+# Number of events read from the database at once when scraped
+EVENT_BATCH_SIZE = 500
+
+
+class Counter:
+    """Counter of events, by labels.
+
+    Attributes:
+        name (str): Metric name
+        documentation (str): Help text
+        labels (tuple): Label names
+    """
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """Increments the counter of the given label values."""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        """Returns the metric in the text format."""
+        lines = _header(self.name, self.documentation, "counter")
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(_sample(self.name, zip(self.labels, label_values), value))
+        return lines
+
+
+class Histogram:
+    """Histogram of observations, by labels.
+
+    Only the bucket an observation falls in is incremented, cumulative
+    counts are computed when rendered.
+
+    Attributes:
+        name (str): Metric name
+        documentation (str): Help text
+        buckets (tuple): Increasing upper bounds of the buckets
+        labels (tuple): Label names
+    """
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Records an observation for the given label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        """Returns the metric in the text format."""
+        lines = _header(self.name, self.documentation, "histogram")
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for label_values, (counts, total) in series:
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(_sample(
+                    f"{self.name}_bucket", labels + [("le", _format(bound))], cumulative))
+            lines.append(_sample(f"{self.name}_sum", labels, total))
+            lines.append(_sample(f"{self.name}_count", labels, cumulative))
+        return lines
+
+
+# One attribute per metric family, on top of the sources they are collected from
+class Metrics:  # pylint: disable=too-many-instance-attributes
+    """Metrics of the scheduler and of the API.
+
+    Attributes:
+        schedule (broker.core.scheduling.Scheduler): Scheduler
+        logs (broker.core.logs.LogStorage): Log storage
+        requests: Counter of requests, by method, route and status
+        latency: Histogram of request latencies, by method and route
+        wait_time: Histogram of the seconds jobs waited before running
+        run_time: Histogram of the seconds jobs ran, by final status
+    """
+
+    def __init__(self, schedule, logs):
+        self.schedule = schedule
+        self.logs = logs
+        self.requests = Counter(
+            "broker_http_requests_total", "Requests handled, by route and status.",
+            ("method", "route", "status"))
+        self.latency = Histogram(
+            "broker_http_request_duration_seconds",
+            "Seconds spent handling requests, until the response is returned.",
+            LATENCY_BUCKETS, ("method", "route"))
+        self.wait_time = Histogram(
+            "broker_job_wait_seconds", "Seconds jobs waited before a runner claimed them.",
+            DURATION_BUCKETS)
+        self.run_time = Histogram(
+            "broker_job_run_seconds", "Seconds jobs ran, by final status.",
+            DURATION_BUCKETS, ("status",))
+        self._last_event = schedule.db_manager.get_last_event_id()
+        self._collect_lock = threading.Lock()
+
+    def observe_request(self, method, route, status, seconds):
+        """Records a handled request."""
+        self.requests.inc(method, route, str(status))
+        self.latency.observe(seconds, method, route)
+
+    def collect_transitions(self):
+        """Records the wait and run times of the status changes made since
+        the last collection."""
+        db_manager = self.schedule.db_manager
+        with self._collect_lock:
+            while True:
+                events = db_manager.get_transitions(self._last_event, EVENT_BATCH_SIZE)
+                for event in events:
+                    self._observe_transition(event)
+                if events:
+                    self._last_event = events[-1].identifier
+                if len(events) < EVENT_BATCH_SIZE:
+                    return
+
+    def _observe_transition(self, event):
+        if event.previous_timestamp is None:
+            return
+        seconds = max(event.timestamp - event.previous_timestamp, 0)
+        if event.status == JobStatus.RUNNING.value \
+                and event.previous_status == JobStatus.WAITING.value:
+            self.wait_time.observe(seconds)
+        elif event.status in (JobStatus.DONE.value, JobStatus.TERMINATED.value) \
+                and event.previous_status == JobStatus.RUNNING.value:
+            self.run_time.observe(seconds, JobStatus(event.status).name)
+
+    def render(self):
+        """Collects the scheduler metrics, and returns all metrics in the
+        text format."""
+        self.collect_transitions()
+        db_manager = self.schedule.db_manager
+        _, by_status = db_manager.count_jobs_by_status()
+        active_runners = db_manager.count_active_runners(time() - self.schedule.lease_duration)
+
+        lines = _header("broker_jobs", "Jobs in the schedule, by status.", "gauge")
+        for status, count in by_status.items():
+            lines.append(_sample("broker_jobs", [("status", status)], count))
+        lines += _header(
+            "broker_ready_queue_jobs", "Jobs in the in-memory ready queue.", "gauge")
+        lines.append(_sample("broker_ready_queue_jobs", [], len(self.schedule.queue)))
+        lines += _header(
+            "broker_active_runners",
+            "Runners seen during the last lease duration.", "gauge")
+        lines.append(_sample("broker_active_runners", [], active_runners))
+        lines += _header(
+            "broker_log_storage_bytes", "Bytes taken by job logs on disk.", "gauge")
+        lines.append(_sample("broker_log_storage_bytes", [], self.logs.disk_usage()))
+        for metric in (self.wait_time, self.run_time, self.requests, self.latency):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+def _header(name, documentation, kind):
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+
+
+def _sample(name, labels, value):
+    labels = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{name}{{{labels}}} {_format(value)}" if labels else f"{name} {_format(value)}"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
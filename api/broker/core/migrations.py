@@ -0,0 +1,174 @@
+"""Database migrations.
+
+Upgrades databases created by an older version of Broker. The schema version
+is stored in SQLite's `user_version` pragma, and each function in
+`MIGRATIONS` upgrades the schema by one version.
+"""
+
+
+def _denormalize_job_status(connection):
+    """Adds the current status and last update epoch to the jobs table."""
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_events_job_id_timestamp "
+        "ON events (job_id, timestamp)"
+    )
+    connection.execute("ALTER TABLE jobs ADD COLUMN status INTEGER")
+    connection.execute("ALTER TABLE jobs ADD COLUMN last_update FLOAT")
+    connection.execute(
+        "UPDATE jobs SET "
+        "status = ("
+        "   SELECT events.status FROM events"
+        "   WHERE events.job_id = jobs.identifier"
+        "   ORDER BY events.timestamp DESC, events.identifier DESC LIMIT 1"
+        "), "
+        "last_update = ("
+        "   SELECT max(events.timestamp) FROM events"
+        "   WHERE events.job_id = jobs.identifier"
+        ")"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status)")
+
+
+def _add_job_runner(connection):
+    """Adds the id of the runner that claimed a job."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN runner VARCHAR")
+
+
+def _add_job_epoch_received(connection):
+    """Adds the submission epoch of a job, and indexes the filtered columns."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN epoch_received FLOAT")
+    connection.execute(
+        "UPDATE jobs SET epoch_received = ("
+        "   SELECT min(events.timestamp) FROM events"
+        "   WHERE events.job_id = jobs.identifier"
+        ")"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_jobs_epoch_received ON jobs (epoch_received)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_user ON jobs (user)")
+
+
+def _add_job_resources(connection):
+    """Adds the resources required by a job."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN gpus INTEGER DEFAULT 0")
+    connection.execute("ALTER TABLE jobs ADD COLUMN gpu_memory INTEGER DEFAULT 0")
+    connection.execute("ALTER TABLE jobs ADD COLUMN cpus FLOAT DEFAULT 0")
+    connection.execute("ALTER TABLE jobs ADD COLUMN memory INTEGER DEFAULT 0")
+
+
+def _add_job_progress(connection):
+    """Adds the progress and last heartbeat reported by runners."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN progress FLOAT")
+    connection.execute("ALTER TABLE jobs ADD COLUMN last_heartbeat FLOAT")
+
+
+
+def _add_job_lease(connection):
+    """Adds the lease of running jobs, and the number of claims."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN lease_expiry FLOAT")
+    connection.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+
+
+
+_JOB_COLUMNS = (
+    "identifier, user, status, last_update, runner, progress, last_heartbeat, "
+    "lease_expiry, attempts, epoch_received, description, command, gpus, "
+    "gpu_memory, cpus, memory"
+)
+
+
+def _autoincrement_job_ids(connection):
+    """Rebuilds the jobs table with AUTOINCREMENT, so that the identifiers of
+    removed or archived jobs are never given to new ones, and indexes the
+    finished jobs by last update."""
+    connection.execute(
+        "CREATE TABLE jobs_new ("
+        "   identifier INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,"
+        "   user VARCHAR,"
+        "   status INTEGER,"
+        "   last_update FLOAT,"
+        "   runner VARCHAR,"
+        "   progress FLOAT,"
+        "   last_heartbeat FLOAT,"
+        "   lease_expiry FLOAT,"
+        "   attempts INTEGER,"
+        "   epoch_received FLOAT,"
+        "   description VARCHAR,"
+        "   command VARCHAR,"
+        "   gpus INTEGER,"
+        "   gpu_memory INTEGER,"
+        "   cpus FLOAT,"
+        "   memory INTEGER"
+        ")"
+    )
+    connection.execute(
+        f"INSERT INTO jobs_new ({_JOB_COLUMNS}) SELECT {_JOB_COLUMNS} FROM jobs"
+    )
+    connection.execute("DROP TABLE jobs")
+    connection.execute("ALTER TABLE jobs_new RENAME TO jobs")
+    connection.execute("CREATE INDEX ix_jobs_status ON jobs (status)")
+    connection.execute("CREATE INDEX ix_jobs_epoch_received ON jobs (epoch_received)")
+    connection.execute("CREATE INDEX ix_jobs_user ON jobs (user)")
+    connection.execute(
+        "CREATE INDEX ix_jobs_status_last_update ON jobs (status, last_update)"
+    )
+
+
+def _add_job_priority(connection):
+    """Adds the priority of a job."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER DEFAULT 0")
+
+
+def _add_job_schedule(connection):
+    """Adds the epoch a sleeping job is due, and the cron expression of
+    recurring jobs."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN run_at FLOAT")
+    connection.execute("ALTER TABLE jobs ADD COLUMN cron VARCHAR")
+
+
+def _add_job_dependencies(connection):
+    """Adds the number of pending dependencies of a job."""
+    connection.execute("ALTER TABLE jobs ADD COLUMN pending_dependencies INTEGER DEFAULT 0")
+
+
+def _add_change_origin(connection):
+    """Adds the process that made a change. The table is created with it if
+    the database predates changes."""
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(changes)")]
+    if "origin" not in columns:
+        connection.execute("ALTER TABLE changes ADD COLUMN origin VARCHAR")
+
+
+MIGRATIONS = [
+    _denormalize_job_status,
+    _add_job_runner,
+    _add_job_epoch_received,
+    _add_job_resources,
+    _add_job_progress,
+    _add_job_lease,
+    _autoincrement_job_ids,
+    _add_job_priority,
+    _add_job_schedule,
+    _add_job_dependencies,
+    _add_change_origin,
+]
+
+
+def get_version(engine):
+    """Returns the schema version of a database."""
+    return engine.execute("PRAGMA user_version").scalar()
+
+
+def stamp(engine):
+    """Marks a freshly created database as up to date."""
+    engine.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+
+def migrate(engine):
+    """Applies all pending migrations in a single transaction."""
+    with engine.begin() as connection:
+        version = connection.execute("PRAGMA user_version").scalar()
+        for migration in MIGRATIONS[version:]:
+            migration(connection)
+        connection.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
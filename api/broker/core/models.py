@@ -6,10 +6,13 @@ import logging
 from time import time
 from uuid import uuid4
 
-from sqlalchemy import Column, Integer, Float, String, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, Float, String, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from broker.core.utils import (
+    JobStatus, RESOURCES, get_dependencies, get_priority, get_resources, get_schedule)
+
 
 # pylint: disable=R0903
 Base = declarative_base()
@@ -24,61 +27,165 @@ class Job(Base):
         identifier: Integer, unique id
         user: String, user id
         events: List of updates to the job's status
+        status: Integer, current status (i.e. status of the last event)
+        last_update: Float, epoch of the last status update
+        runner: String, id of the runner that claimed the job
+        progress: Float, progress reported by the runner
+        last_heartbeat: Float, epoch of the last update from the runner
+        lease_expiry: Float, epoch when the runner's lease on the job ends,
+            unless renewed by a heartbeat. None if the job is not leased.
+        attempts: Integer, number of times the job was claimed
         description: String, a description of the job
-        epoch_received: Integer, epoch when the job was received
+        epoch_received: Float, epoch when the job was received
+        priority: Integer, jobs with a higher priority are served first,
+            see `broker.core.scheduling.Scheduler.queue_key`
+        run_at: Float, epoch when a SLEEPING job is due, None to run as
+            soon as possible
+        cron: String, cron expression of a recurring job. The job stays
+            SLEEPING, and a copy of it is submitted every time it is due.
+        dependencies: List of `Dependency` on other jobs
+        pending_dependencies: Integer, number of dependencies whose job
+            hasn't finished yet. The job stays SLEEPING until it is 0.
+        gpus, gpu_memory, cpus, memory: Resources required by the job, see
+            `broker.core.utils.RESOURCES`
     """
 
     __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_last_update", "status", "last_update"),
+        {"sqlite_autoincrement": True},
+    )
     identifier = Column(Integer, primary_key=True)
-    user = Column(String)
+    user = Column(String, index=True)
     events = relationship("Event", cascade="all, delete-orphan")
+    status = Column(Integer, index=True)
+    last_update = Column(Float)
+    runner = Column(String)
+    progress = Column(Float)
+    last_heartbeat = Column(Float)
+    lease_expiry = Column(Float)
+    attempts = Column(Integer, default=0)
+    epoch_received = Column(Float, index=True)
+    priority = Column(Integer, default=0)
+    run_at = Column(Float)
+    cron = Column(String)
+    dependencies = relationship("Dependency", cascade="all, delete-orphan")
+    pending_dependencies = Column(Integer, default=0)
     description = Column(String)
     command = Column(String)
+    gpus = Column(Integer, default=0)
+    gpu_memory = Column(Integer, default=0)
+    cpus = Column(Float, default=0)
+    memory = Column(Integer, default=0)
     logfile = relationship("LogFile", uselist=False, cascade="all, delete-orphan")
+    usage = relationship("Usage", uselist=False, cascade="all, delete-orphan")
+    usage_points = relationship("UsagePoint", cascade="all, delete-orphan")
+
+    # Fields of the dict representation, in order
+    FIELDS = (
+        "identifier", "user", "status", "last_update", "runner", "progress",
+        "last_heartbeat", "lease_expiry", "attempts", "epoch_received", "priority",
+        "run_at", "cron", "pending_dependencies", "events", "description", "command",
+    ) + RESOURCES
 
     @staticmethod
     def from_payload(payload):
         """Create a Job instance given a payload dict
 
         Args:
-            payload (dict): Job info dict
+            payload (dict): Job info dict, resource requirements, priority,
+                `run_at` epoch, `cron` expression and dependencies are
+                optional
 
         Returns:
             (broker.utils.Job) instance
         """
         try:
+            run_at, cron = get_schedule(payload)
             job = Job(
                 user=payload["user"],
                 description=payload["description"],
                 command=payload["command"],
+                priority=get_priority(payload),
+                run_at=run_at,
+                cron=cron,
+                dependencies=[
+                    Dependency(parent_id=parent, condition=condition)
+                    for parent, condition in get_dependencies(payload)
+                ],
+                **get_resources(payload)
             )
             return job
         except KeyError:
             logging.error("Incorrect payload. Can't create job instance")
+        except ValueError as err:
+            logging.error("Incorrect payload. %s", err)
+
+    @property
+    def initial_status(self):
+        """Status of the job when it is submitted: SLEEPING until `run_at`
+        if it is scheduled or while it has pending dependencies, WAITING
+        otherwise"""
+        if self.run_at is not None or self.pending_dependencies:
+            return JobStatus.SLEEPING.value
+        return JobStatus.WAITING.value
+
+    def occurrence(self):
+        """Returns a new job with the same user, command and requirements,
+        i.e. the next run of a recurring job"""
+        return Job(
+            user=self.user,
+            description=self.description,
+            command=self.command,
+            priority=self.priority,
+            **{resource: getattr(self, resource) for resource in RESOURCES}
+        )
+
+    @property
+    def shape(self):
+        """Tuple of the resources required by the job"""
+        return tuple(getattr(self, resource) or 0 for resource in RESOURCES)
+
+    def set_status(self, status):
+        """Records a status update.
+
+        Appends a new event and keeps the denormalized current status in
+        sync with it, so both are written in the same transaction.
+        """
+        event = Event(status=status)
+        self.events.append(event)
+        self.status = event.status
+        self.last_update = event.timestamp
 
     def __repr__(self):
-        return f"Job<id={self.identifier}, status={self.events[-1].status}>"
+        return f"Job<id={self.identifier}, status={self.status}>"
 
     def __str__(self):
         return (
             "---\n"
             f"Job #{self.identifier}\n"
             f"User: {self.user}\n"
-            f"Status: {self.events[-1].status}\n"
+            f"Status: {self.status}\n"
             f"Command: {self.command}\n"
             f"Description: {self.description}\n"
             "---"
         )
 
-    def to_dict(self):
-        "Returns a Job in Python dict format"
-        return {
-            "identifier": self.identifier,
-            "user": self.user,
-            "events": [e.to_dict() for e in self.events],
-            "description": self.description,
-            "command": self.command
-        }
+    def to_dict(self, fields=FIELDS):
+        """Returns a Job in Python dict format
+
+        Args:
+            fields (iterable): Fields to include, see `Job.FIELDS`. Only
+                these attributes are accessed, so unloaded columns and the
+                events relationship are not fetched unless requested.
+        """
+        res = {}
+        for field in fields:
+            if field == "events":
+                res["events"] = [e.to_dict() for e in self.events]
+            else:
+                res[field] = getattr(self, field)
+        return res
 
     def to_json(self):
         "Serializes a Job in JSON format"
@@ -99,6 +206,7 @@ class Event(Base):
     """
 
     __tablename__ = "events"
+    __table_args__ = (Index("ix_events_job_id_timestamp", "job_id", "timestamp"),)
     identifier = Column(Integer, primary_key=True)
     job_id = Column(Integer, ForeignKey("jobs.identifier"))
     timestamp = Column(Float)
@@ -120,6 +228,203 @@ class Event(Base):
         }
 
 
+class Change(Base):
+    """A change to the schedule, as streamed to clients.
+
+    Changes are written in the same transaction as the change itself, and
+    their identifiers are never reused, so a client can resume the feed
+    from the last change it received.
+
+    Attributes:
+        identifier: Unique id, increasing.
+        job_id: Id of the job that changed. Not a foreign key, since the
+            change of a removal outlives the job.
+        kind: String, one of `Change.KINDS`.
+        timestamp: Float, epoch of the change.
+        data: String, JSON payload sent to clients.
+        origin: String, tag of the process that made the change, see
+            `DataBaseManager.origin`.
+    """
+
+    __tablename__ = "changes"
+    __table_args__ = {"sqlite_autoincrement": True}
+    identifier = Column(Integer, primary_key=True)
+    job_id = Column(Integer)
+    kind = Column(String)
+    timestamp = Column(Float)
+    data = Column(String)
+    origin = Column(String)
+
+    KINDS = ("created", "updated", "removed")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.timestamp = time()
+
+    def __repr__(self):
+        return f"Change<id={self.identifier}, job={self.job_id}, kind={self.kind}>"
+
+
+class Runner(Base):
+    """A runner that claimed jobs or sent updates.
+
+    Attributes:
+        identifier: String, unique id given by the runner.
+        last_seen: Float, epoch of the last request from the runner.
+    """
+
+    __tablename__ = "runners"
+    identifier = Column(String, primary_key=True)
+    last_seen = Column(Float)
+
+    def __repr__(self):
+        return f"Runner<id={self.identifier}>"
+
+
+class Usage(Base):
+    """Summary of the resources used by a job, as sampled by its runner.
+
+    Samples are also kept as a time series of `UsagePoint`, with one point
+    every `resolution` seconds from `start`. When a job has too many
+    points, the resolution is doubled and consecutive points are merged.
+
+    Attributes:
+        job_id: Foreign key and primary key. Id of the job.
+        start: Float, epoch of the first sample.
+        last_sample: Float, epoch of the last sample.
+        resolution: Float, seconds between two points.
+        points: Integer, number of points.
+        samples: Integer, number of samples.
+        cpu_sum, cpu_peak: Float, sum and maximum of the CPU cores used.
+        rss_sum, rss_peak: Float, sum and maximum of the resident memory, in MB.
+        gpu_memory_peak: Float, maximum of the GPU memory used, in MB.
+        read_bytes, write_bytes: Integer, bytes read and written by the job.
+    """
+
+    __tablename__ = "usage"
+    job_id = Column(Integer, ForeignKey("jobs.identifier"), primary_key=True)
+    start = Column(Float)
+    last_sample = Column(Float)
+    resolution = Column(Float)
+    points = Column(Integer, default=0)
+    samples = Column(Integer, default=0)
+    cpu_sum = Column(Float, default=0)
+    cpu_peak = Column(Float, default=0)
+    rss_sum = Column(Float, default=0)
+    rss_peak = Column(Float, default=0)
+    gpu_memory_peak = Column(Float, default=0)
+    read_bytes = Column(Integer, default=0)
+    write_bytes = Column(Integer, default=0)
+
+    def __repr__(self):
+        return f"Usage<job={self.job_id}, samples={self.samples}>"
+
+    def to_dict(self):
+        """Returns the summary in a Python dict format."""
+        return {
+            "start": self.start,
+            "last_sample": self.last_sample,
+            "resolution": self.resolution,
+            "samples": self.samples,
+            "cpu": {"avg": self.cpu_sum / self.samples, "peak": self.cpu_peak},
+            "rss": {"avg": self.rss_sum / self.samples, "peak": self.rss_peak},
+            "gpu_memory": {"peak": self.gpu_memory_peak},
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+        }
+
+
+class UsagePoint(Base):
+    """A point of the time series of a job's resource usage.
+
+    Attributes:
+        identifier: Unique id.
+        job_id: Foreign key. Id of the job.
+        timestamp: Float, epoch when the point starts.
+        samples: Integer, number of samples merged in the point.
+        cpu: Float, average CPU cores used.
+        rss: Float, maximum resident memory, in MB.
+        gpu_memory: Float, maximum GPU memory, in MB.
+        read_bytes, write_bytes: Integer, bytes read and written by the job
+            at the end of the point.
+    """
+
+    __tablename__ = "usage_points"
+    __table_args__ = (Index("ix_usage_points_job_id_timestamp", "job_id", "timestamp"),)
+    identifier = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.identifier"))
+    timestamp = Column(Float)
+    samples = Column(Integer)
+    cpu = Column(Float)
+    rss = Column(Float)
+    gpu_memory = Column(Float)
+    read_bytes = Column(Integer)
+    write_bytes = Column(Integer)
+
+    def __repr__(self):
+        return f"UsagePoint<id={self.identifier}, job={self.job_id}>"
+
+    def merge(self, other):
+        """Merges a later point into this one."""
+        samples = self.samples + other.samples
+        self.cpu = (self.cpu * self.samples + other.cpu * other.samples) / samples
+        self.rss = max(self.rss, other.rss)
+        self.gpu_memory = max(self.gpu_memory, other.gpu_memory)
+        self.read_bytes, self.write_bytes = other.read_bytes, other.write_bytes
+        self.samples = samples
+
+    def to_dict(self):
+        """Returns a point in a Python dict format."""
+        return {
+            "timestamp": self.timestamp,
+            "samples": self.samples,
+            "cpu": self.cpu,
+            "rss": self.rss,
+            "gpu_memory": self.gpu_memory,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+        }
+
+
+class Dependency(Base):
+    """A job's dependency on another job.
+
+    Attributes:
+        identifier: Unique id.
+        job_id: Foreign key. Id of the job that depends on the other one.
+        parent_id: Integer, id of the job it depends on. Not a foreign key,
+            since the dependency outlives a removed job.
+        condition: String, one of `broker.core.utils.DEPENDENCY_CONDITIONS`.
+        resolved: Boolean, whether the job it depends on finished.
+    """
+
+    __tablename__ = "dependencies"
+    identifier = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.identifier"), index=True)
+    parent_id = Column(Integer, index=True)
+    condition = Column(String)
+    resolved = Column(Boolean, default=False)
+
+    def __repr__(self):
+        return f"Dependency<job={self.job_id}, parent={self.parent_id}>"
+
+    def satisfied_by(self, status):
+        """Returns whether a final status of the job it depends on satisfies
+        the dependency. Jobs that were removed (None) satisfy none."""
+        if self.condition == "completion":
+            return status in (JobStatus.DONE.value, JobStatus.TERMINATED.value)
+        return status == JobStatus.DONE.value
+
+    def to_dict(self):
+        """Returns a dependency in a Python dict format."""
+        return {
+            "job_id": self.job_id,
+            "parent_id": self.parent_id,
+            "on": self.condition,
+            "resolved": self.resolved,
+        }
+
+
 class LogFile(Base):
     """A job's logging file.
 
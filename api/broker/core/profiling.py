@@ -0,0 +1,161 @@
+"""Profiling of the SQL statements run by the app.
+
+Opt-in, see `PROFILE_SQL` in `broker.config`. When enabled, every statement
+run through a profiled engine is timed and aggregated by fingerprint (the
+statement with its literals and lists of parameters collapsed), and the
+statements of each request are counted and timed. Statements slower than a
+threshold are logged with their `EXPLAIN QUERY PLAN`.
+"""
+
+
+import logging
+import re
+import threading
+from time import perf_counter
+
+from sqlalchemy.event import listen
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a statement is logged as slow
+SLOW_QUERY_THRESHOLD = 0.1
+
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """Returns a statement with its literals replaced by `?` and its lists
+    of parameters collapsed, so that statements that only differ by their
+    values are aggregated together."""
+    statement = _SPACE.sub(" ", statement).strip()
+    statement = _LITERAL.sub("?", statement)
+    return _PARAMETER_LIST.sub("(?, ...)", statement)
+
+
+class QueryProfiler:
+    """Times the statements run through SQLAlchemy engines.
+
+    Attributes:
+        slow_query (float): Seconds after which a statement is logged with
+            its query plan, None to never log statements
+    """
+
+    def __init__(self, slow_query=SLOW_QUERY_THRESHOLD):
+        self.slow_query = slow_query
+        self._statements = {}
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach(self, engine):
+        """Profiles the statements run through an engine."""
+        listen(engine, "before_cursor_execute", self._before_execute)
+        listen(engine, "after_cursor_execute", self._after_execute)
+
+    def start_request(self):
+        """Starts counting the statements run by this thread."""
+        self._local.queries = 0
+        self._local.seconds = 0.0
+
+    def end_request(self, route):
+        """Stops counting the statements run by this thread, and records them
+        for a route.
+
+        Returns:
+            (tuple) number of statements run since `start_request`, and
+                seconds spent running them
+        """
+        queries = getattr(self._local, "queries", 0)
+        seconds = getattr(self._local, "seconds", 0.0)
+        self._local.queries = self._local.seconds = None
+        with self._lock:
+            stats = self._routes.setdefault(route, [0, 0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += queries
+            stats[2] += seconds
+            stats[3] = max(stats[3], queries)
+        return queries, seconds
+
+    def top(self, limit=10, order_by="total"):
+        """Returns the most expensive statements.
+
+        Args:
+            limit (int): Number of statements
+            order_by (str): `total` seconds, `count` of executions, `max` or
+                `mean` seconds
+
+        Returns:
+            (list) dicts with the fingerprint and statistics of each statement
+        """
+        with self._lock:
+            statements = [
+                {
+                    "statement": statement,
+                    "count": count,
+                    "total": total,
+                    "mean": total / count,
+                    "max": maximum,
+                }
+                for statement, (count, total, maximum) in self._statements.items()
+            ]
+        statements.sort(key=lambda s: s[order_by], reverse=True)
+        return statements[:limit]
+
+    def routes(self):
+        """Returns the statements run by requests, by route.
+
+        Returns:
+            (list) dicts with the route, number of requests, mean and maximum
+                number of statements per request and mean seconds spent
+                running them, ordered by total time
+        """
+        with self._lock:
+            routes = [
+                {
+                    "route": route,
+                    "requests": requests,
+                    "queries_mean": queries / requests,
+                    "queries_max": maximum,
+                    "seconds_mean": seconds / requests,
+                    "seconds_total": seconds,
+                }
+                for route, (requests, queries, seconds, maximum) in self._routes.items()
+            ]
+        return sorted(routes, key=lambda r: r["seconds_total"], reverse=True)
+
+    def reset(self):
+        """Forgets the statistics recorded so far."""
+        with self._lock:
+            self._statements = {}
+            self._routes = {}
+
+    def _before_execute(self, conn, *_args):
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+    # pylint: disable=too-many-arguments
+    def _after_execute(self, conn, cursor, statement, parameters, _context, executemany):
+        seconds = perf_counter() - conn.info["query_start"].pop()
+        key = fingerprint(statement)
+        with self._lock:
+            stats = self._statements.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        if getattr(self._local, "queries", None) is not None:
+            self._local.queries += 1
+            self._local.seconds += seconds
+        if self.slow_query is not None and seconds >= self.slow_query:
+            plan = "" if executemany else _query_plan(cursor, statement, parameters)
+            logger.warning("Slow statement (%.3fs): %s%s", seconds, key, plan)
+
+
+def _query_plan(cursor, statement, parameters):
+    """Returns the query plan of a statement, one step per line."""
+    try:
+        rows = cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return "".join(f"\n    {row[-1]}" for row in rows)
+    except Exception:  # pylint: disable=W0703
+        return ""
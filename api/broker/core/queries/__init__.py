@@ -0,0 +1 @@
+"""Queries of `DataBaseManager`, grouped by feature in mixins."""
@@ -0,0 +1,118 @@
+"""Queries that move finished jobs to an archive database."""
+
+
+from time import time
+
+from broker.core.models import Job, Event, LogFile, Usage, UsagePoint, Dependency
+from broker.core.utils import FINISHED
+
+
+# pylint: disable=no-member
+
+# Tables of the rows that belong to a job, moved with it to the archive
+_JOB_TABLES = (
+    Event.__table__, LogFile.__table__, Usage.__table__, UsagePoint.__table__,
+    Dependency.__table__,
+)
+
+
+class ArchiveQueriesMixin:
+    """Queries that move finished jobs to an archive database."""
+
+    def get_archivable_jobs(self, max_age=None, max_count=None, limit=None):
+        """Selects finished jobs older than `max_age`, or beyond the
+        `max_count` most recently updated ones.
+
+        Args:
+            max_age (float): Seconds finished jobs are kept, None to keep
+                them regardless of their age
+            max_count (int): Number of finished jobs kept, None to keep them
+                regardless of their number
+            limit (int): Maximum number of jobs to select
+
+        Returns:
+            (list) identifiers of the jobs, least recently updated first
+        """
+        query = (self.session)\
+            .query(Job.identifier, Job.last_update)\
+            .filter(Job.status.in_(FINISHED))\
+            .order_by(Job.last_update)
+        selected = []
+        if max_age is not None:
+            selected += query.filter(Job.last_update < time() - max_age).limit(limit).all()
+        if max_count is not None:
+            n_finished = self.session.query(Job).filter(Job.status.in_(FINISHED)).count()
+            excess = n_finished - max_count
+            if limit is not None:
+                excess = min(excess, limit)
+            if excess > 0:
+                selected += query.limit(excess).all()
+        selected = sorted(set(selected), key=lambda row: (row.last_update or 0, row.identifier))
+        return [row.identifier for row in selected][:limit]
+
+    def export_jobs(self, identifiers):
+        """Returns jobs with their events, log files, usage and dependencies,
+        as plain rows.
+
+        Returns:
+            (dict) lists of row dicts, for the "jobs" table and each table of
+                `_JOB_TABLES`
+        """
+        rows = {
+            table.name: [
+                dict(row) for row in self.session.execute(
+                    table.select().where(table.c.job_id.in_(identifiers))
+                )
+            ]
+            for table in _JOB_TABLES
+        }
+        rows["jobs"] = [
+            dict(row) for row in self.session.execute(
+                Job.__table__.select().where(Job.__table__.c.identifier.in_(identifiers))
+            )
+        ]
+        return rows
+
+    def import_jobs(self, rows):
+        """Adds or replaces jobs exported by `export_jobs`, keeping their
+        identifiers."""
+        identifiers = [row["identifier"] for row in rows["jobs"]]
+        connection = self.session.connection()
+        for table in _JOB_TABLES:
+            connection.execute(table.delete().where(table.c.job_id.in_(identifiers)))
+            # Identifiers are only unique in the database they come from
+            related = [
+                {k: v for k, v in row.items() if k != "identifier"}
+                for row in rows[table.name]
+            ]
+            if related:
+                connection.execute(table.insert(), related)
+        if rows["jobs"]:
+            connection.execute(Job.__table__.insert().prefix_with("OR REPLACE"), rows["jobs"])
+        self.session.commit()
+
+    def delete_finished_jobs(self, identifiers):
+        """Deletes jobs that are still finished, with their events, log
+        files, usage and dependencies, in a single transaction.
+
+        Returns:
+            (list) identifiers of the deleted jobs
+        """
+        finished = (self.session)\
+            .query(Job.identifier)\
+            .filter(Job.identifier.in_(identifiers), Job.status.in_(FINISHED))
+        # The first delete takes the write lock, so the jobs can't change
+        # status until the commit
+        for table in _JOB_TABLES:
+            self.session.execute(
+                table.delete().where(table.c.job_id.in_(finished.subquery()))
+            )
+        identifiers = [row.identifier for row in finished]
+        if identifiers:
+            self.session.execute(
+                Job.__table__.delete().where(Job.__table__.c.identifier.in_(identifiers))
+            )
+        for identifier in identifiers:
+            self._record_change(identifier, "removed", {"identifier": identifier})
+        self.session.commit()
+        return identifiers
@@ -0,0 +1,102 @@
+"""Queries on the changes streamed to clients."""
+
+
+import json
+from time import time
+
+from sqlalchemy import func, or_
+
+from broker.core.models import Change
+
+
+# Fields of a job sent with every update, see `ChangeQueriesMixin._record_updates`
+UPDATE_FIELDS = ("identifier", "progress", "last_heartbeat", "lease_expiry")
+
+# pylint: disable=no-member
+
+class ChangeQueriesMixin:
+    """Queries on the changes of the schedule, see `Change`."""
+
+    def get_changes(self, after=0, limit=None):
+        """Returns the changes made after a given change, in order.
+
+        Args:
+            after (int): Identifier of the last change already seen
+            limit (int): Maximum number of changes to return
+        """
+        return (self.session)\
+            .query(Change.identifier, Change.job_id, Change.kind, Change.data, Change.origin)\
+            .filter(Change.identifier > after)\
+            .order_by(Change.identifier)\
+            .limit(limit)\
+            .all()
+
+    def get_change_bounds(self):
+        """Returns the identifiers of the first and last changes still
+        recorded, (None, None) if there are none."""
+        return tuple(
+            self.session.query(func.min(Change.identifier), func.max(Change.identifier)).one()
+        )
+
+    def prune_changes(self, max_age=None, max_count=None):
+        """Deletes the changes older than `max_age`, or beyond the
+        `max_count` most recent ones, but never the last one. Returns the
+        number of deleted changes."""
+        last = self.get_change_bounds()[1]
+        if last is None:
+            return 0
+        conditions = []
+        if max_age is not None:
+            conditions.append(Change.timestamp < time() - max_age)
+        if max_count is not None:
+            conditions.append(Change.identifier <= last - max(max_count, 1))
+        if not conditions:
+            return 0
+        deleted = (self.session)\
+            .query(Change)\
+            .filter(Change.identifier < last, or_(*conditions))\
+            .delete(synchronize_session=False)
+        self.session.commit()
+        return deleted
+
+    def _record_change(self, job_id, kind, data):
+        self.session.add(
+            Change(job_id=job_id, kind=kind, data=json.dumps(data), origin=self.origin))
+
+    def _record_status_change(self, identifier, event, runner):
+        self._record_change(
+            identifier, "updated", self._status_change(identifier, event.to_dict(), runner)
+        )
+
+    def _record_updates(self, connection, jobs, events, timestamp):
+        """Records a change for each updated job, with its new progress and
+        heartbeat, and its status change if it has an event, in one insert."""
+        changes = {job.identifier: job.to_dict(UPDATE_FIELDS) for job in jobs}
+        runners = {job.identifier: job.runner for job in jobs}
+        for event in events:
+            changes[event["job_id"]].update(self._status_change(
+                event["job_id"],
+                {f: event[f] for f in ("identifier", "timestamp", "status")},
+                runners[event["job_id"]],
+            ))
+        connection.execute(Change.__table__.insert(), [
+            {
+                "job_id": identifier,
+                "kind": "updated",
+                "timestamp": timestamp,
+                "origin": self.origin,
+                "data": json.dumps(data),
+            }
+            for identifier, data in changes.items()
+        ])
+
+    @staticmethod
+    def _status_change(identifier, event, runner):
+        """Returns the payload of a status change, given the event dict."""
+        return {
+            "identifier": identifier,
+            "status": event["status"],
+            "last_update": event["timestamp"],
+            "runner": runner,
+            "event": event,
+        }
@@ -0,0 +1,176 @@
+"""Queries on the dependencies between jobs."""
+
+
+from time import time
+
+from sqlalchemy import bindparam
+
+from broker.core.models import Job, Event, Dependency
+from broker.core.utils import RESOLVING, JobStatus
+
+
+# pylint: disable=no-member
+
+class DependencyQueriesMixin:
+    """Queries on the dependencies between jobs, see `Dependency`."""
+
+    def resolve_dependencies(self, finished, now=None):
+        """Releases the jobs whose last pending dependency is resolved, and
+        terminates the ones with a dependency that can't be satisfied.
+
+        Args:
+            finished (dict): identifier -> final status (value) of the jobs,
+                None for removed jobs
+            now (float): Epoch of the status changes
+
+        Returns:
+            (tuple) list of the jobs that were set to WAITING, and list of the
+                identifiers of the jobs that were set to TERMINATED
+        """
+        now = time() if now is None else now
+        released, terminated = [], []
+        while finished:
+            dependencies = (self.session)\
+                .query(Dependency)\
+                .filter(
+                    Dependency.parent_id.in_(finished),
+                    Dependency.resolved.is_(False),
+                )\
+                .all()
+            satisfied = {}
+            for dependency in dependencies:
+                dependency.resolved = True
+                satisfied.setdefault(dependency.job_id, []).append(
+                    dependency.satisfied_by(finished[dependency.parent_id]))
+            children = (self.session)\
+                .query(Job)\
+                .filter(
+                    Job.identifier.in_(satisfied),
+                    Job.status == JobStatus.SLEEPING.value,
+                )\
+                .all() if satisfied else []
+            finished, events = {}, []
+            for job in children:
+                resolved = satisfied[job.identifier]
+                job.pending_dependencies = max((job.pending_dependencies or 0) - len(resolved), 0)
+                if not all(resolved):
+                    status = JobStatus.TERMINATED.value
+                    finished[job.identifier] = status
+                    terminated.append(job.identifier)
+                elif not job.pending_dependencies and (job.run_at is None or job.run_at <= now):
+                    status = JobStatus.WAITING.value
+                    released.append(job)
+                else:
+                    continue
+                job.status, job.last_update = status, now
+                event = Event(job_id=job.identifier, status=status)
+                event.timestamp = now
+                events.append((job, event))
+            self.session.add_all([event for _, event in events])
+            self.session.flush()
+            for job, event in events:
+                self._record_status_change(job.identifier, event, job.runner)
+        self.session.commit()
+        return released, terminated
+
+    def get_unresolved_parents(self):
+        """Returns the jobs whose dependents were not updated after they
+        finished, see `resolve_dependencies`."""
+        rows = (self.session)\
+            .query(Dependency.parent_id, Job.status)\
+            .outerjoin(Job, Job.identifier == Dependency.parent_id)\
+            .filter(Dependency.resolved.is_(False))\
+            .distinct()\
+            .all()
+        return {
+            row.parent_id: row.status for row in rows
+            if row.status is None or row.status in RESOLVING
+        }
+
+    def get_dependencies(self, job_id):
+        """Returns the dependencies of a job, and on a job.
+
+        Raises:
+            IndexError: if the job doesn't exist
+
+        Returns:
+            (tuple) lists of the `Dependency` of the job on other jobs, and of
+                other jobs on it
+        """
+        if not self._job_exists(job_id):
+            raise IndexError(f"Job #{job_id} not found")
+        parents = (self.session)\
+            .query(Dependency)\
+            .filter_by(job_id=job_id)\
+            .order_by(Dependency.parent_id)\
+            .all()
+        children = (self.session)\
+            .query(Dependency)\
+            .filter_by(parent_id=job_id)\
+            .order_by(Dependency.job_id)\
+            .all()
+        return parents, children
+
+    def _link_dependencies(self, jobs):
+        """Resolves the dependencies of new jobs on jobs that already
+        finished, and counts the pending ones. The new jobs must be inserted.
+
+        Raises:
+            IndexError: if a job depends on a job that doesn't exist, or that
+                was submitted after it. The transaction is rolled back.
+
+        Returns:
+            (set) identifiers of the jobs with a dependency that can't be
+                satisfied anymore
+        """
+        parents = {d.parent_id for job in jobs for d in job.dependencies}
+        statuses = dict(
+            self.session.query(Job.identifier, Job.status).filter(Job.identifier.in_(parents))
+        )
+        failed = set()
+        for job in jobs:
+            job.pending_dependencies = 0
+            for dependency in job.dependencies:
+                if dependency.parent_id not in statuses or dependency.parent_id >= job.identifier:
+                    self.session.rollback()
+                    raise IndexError(f"Job #{dependency.parent_id} not found")
+                status = statuses[dependency.parent_id]
+                dependency.resolved = status in RESOLVING
+                if not dependency.resolved:
+                    job.pending_dependencies += 1
+                elif not dependency.satisfied_by(status):
+                    failed.add(job.identifier)
+        return failed
+
+    def _bulk_link_dependencies(self, connection, jobs, job_rows):
+        """Inserts the dependencies of jobs added by `add_jobs`, and updates
+        their status and pending dependencies, see `_link_dependencies`."""
+        failed = self._link_dependencies(jobs)
+        connection.execute(Dependency.__table__.insert(), [
+            {
+                "job_id": job.identifier,
+                "parent_id": dependency.parent_id,
+                "condition": dependency.condition,
+                "resolved": dependency.resolved,
+            }
+            for job in jobs for dependency in job.dependencies
+        ])
+        updates = []
+        for job, row in zip(jobs, job_rows):
+            if not job.dependencies:
+                continue
+            job.status = row["status"] = JobStatus.TERMINATED.value \
+                if job.identifier in failed else job.initial_status
+            row["pending_dependencies"] = job.pending_dependencies
+            updates.append({
+                "job_id": job.identifier,
+                "new_status": job.status,
+                "pending": job.pending_dependencies,
+            })
+        table = Job.__table__
+        connection.execute(
+            table.update()
+            .where(table.c.identifier == bindparam("job_id"))
+            .values(status=bindparam("new_status"), pending_dependencies=bindparam("pending")),
+            updates,
+        )
@@ -0,0 +1,72 @@
+"""Queries on the history of job statuses."""
+
+
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+
+from broker.core.models import Job, Event
+from broker.core.utils import JobStatus
+
+
+def _previous(session, field):
+    """Returns a subquery of a field of the event before `Event` in its job."""
+    previous = aliased(Event)
+    return session.query(getattr(previous, field))\
+        .filter(previous.job_id == Event.job_id, previous.identifier < Event.identifier)\
+        .order_by(previous.identifier.desc())\
+        .limit(1)\
+        .correlate(Event)\
+        .as_scalar()
+
+
+class EventQueriesMixin:
+    """Queries on the events of the jobs, see `Event`."""
+
+    def get_last_event_id(self):
+        """Returns the identifier of the last event, 0 if there are none."""
+        return self.session.query(func.max(Event.identifier)).scalar() or 0
+
+    def get_transitions(self, after=0, limit=None):
+        """Returns the events recorded after a given one, each with the
+        status and timestamp of the previous event of its job.
+
+        Args:
+            after (int): Identifier of the last event already seen
+            limit (int): Maximum number of events to return
+
+        Returns:
+            (list) rows with the identifier, status and timestamp of each
+                event, and its `previous_status` and `previous_timestamp`
+                (None for the first event of a job), ordered by identifier
+        """
+        return (self.session)\
+            .query(
+                Event.identifier, Event.status, Event.timestamp,
+                _previous(self.session, "status").label("previous_status"),
+                _previous(self.session, "timestamp").label("previous_timestamp"),
+            )\
+            .filter(Event.identifier > after)\
+            .order_by(Event.identifier)\
+            .limit(limit)\
+            .all()
+
+    def get_runs(self, since):
+        """Returns the runs of jobs that ended after the epoch `since`, and
+        the jobs that are still running.
+
+        Returns:
+            (tuple) rows with the user, start and end of each run, and rows
+                with the identifier, user and start of each RUNNING job
+        """
+        started = _previous(self.session, "timestamp")
+        runs = (self.session)\
+            .query(Job.user, started.label("start"), Event.timestamp.label("end"))\
+            .join(Job, Job.identifier == Event.job_id)\
+            .filter(Event.timestamp >= since)\
+            .filter(_previous(self.session, "status") == JobStatus.RUNNING.value)\
+            .all()
+        running = (self.session)\
+            .query(Job.identifier, Job.user, Job.last_update.label("start"))\
+            .filter_by(status=JobStatus.RUNNING.value)\
+            .all()
+        return runs, running
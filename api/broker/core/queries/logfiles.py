@@ -0,0 +1,38 @@
+"""Queries on the log files of jobs."""
+
+
+from broker.core.models import LogFile
+
+
+class LogFileQueriesMixin:
+    """Queries on the log files of the jobs, see `LogFile`."""
+
+    def add_logfile(self, job_id):
+        """Assign a log file to a job given its identifier.
+
+        Returns:
+            (str) logfile name in the server's file system
+        """
+        job = self.get_job_by_id(job_id)
+        if job is not None:
+            job.logfile = LogFile(job_id=job_id)
+            self.session.commit()
+            return job.logfile.filename
+        raise IndexError(f"Job #{job_id} not found.")
+
+    def get_logfile(self, job_id):
+        """Returns a logfile given its job identifier."""
+        if self._job_exists(job_id):
+            return self.session.query(LogFile).filter_by(job_id=job_id).first()
+        raise IndexError(f"Job #{job_id} not found.")
+
+    def get_or_add_logfile(self, job_id):
+        """Returns a job's log file name, assigning one if needed.
+
+        Returns:
+            (str) logfile name in the server's file system
+        """
+        logfile = self.get_logfile(job_id)
+        if logfile is not None:
+            return logfile.filename
+        return self.add_logfile(job_id)
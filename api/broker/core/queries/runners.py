@@ -0,0 +1,47 @@
+"""Queries on the runners."""
+
+
+from collections import defaultdict
+from time import time
+
+from sqlalchemy import func
+
+from broker.core.models import Job, Runner
+from broker.core.utils import JobStatus
+
+
+class RunnerQueriesMixin:
+    """Queries on the runners that were seen."""
+
+    def touch_runner(self, runner):
+        """Records that a runner was seen."""
+        self._touch_runner(runner, time())
+        self.session.commit()
+
+    def get_runners(self):
+        """Returns the runners that were seen, with the jobs they are running.
+
+        Returns:
+            (list) dicts with the identifier, last seen epoch and RUNNING
+                job identifiers of each runner, ordered by identifier
+        """
+        jobs = defaultdict(list)
+        query = (self.session)\
+            .query(Job.runner, Job.identifier)\
+            .filter_by(status=JobStatus.RUNNING.value)\
+            .order_by(Job.identifier)
+        for row in query:
+            jobs[row.runner].append(row.identifier)
+        return [
+            {"identifier": r.identifier, "last_seen": r.last_seen, "jobs": jobs[r.identifier]}
+            for r in self.session.query(Runner).order_by(Runner.identifier)
+        ]
+
+    def count_active_runners(self, since):
+        """Counts the runners seen at or after an epoch."""
+        return self.session.query(func.count(Runner.identifier))\
+            .filter(Runner.last_seen >= since)\
+            .scalar()
+
+    def _touch_runner(self, runner, now):
+        self.session.merge(Runner(identifier=runner, last_seen=now))
@@ -0,0 +1,81 @@
+"""Queries on the jobs that sleep until a given epoch."""
+
+
+from time import time
+
+from sqlalchemy import func
+
+from broker.core.cron import Cron
+from broker.core.models import Job, Event
+from broker.core.utils import JobStatus
+
+
+class TimerQueriesMixin:
+    """Queries on the SLEEPING jobs that are due at a given epoch."""
+
+    def get_timer_entries(self):
+        """Returns what the Scheduler's timers need to know about SLEEPING
+        jobs.
+
+        Returns:
+            (list) rows with the identifier and due epoch of each SLEEPING
+                job that has one
+        """
+        return (self.session)\
+            .query(Job.identifier, Job.run_at)\
+            .filter(Job.status == JobStatus.SLEEPING.value, Job.run_at.isnot(None))\
+            .all()
+
+    def wake_jobs(self, identifiers, now=None):
+        """Sets the SLEEPING jobs that are due to WAITING, or adds a WAITING
+        copy of the recurring ones.
+
+        Args:
+            identifiers (list): Ids of the jobs to wake
+            now (float): Epoch, jobs due after it are not woken
+
+        Returns:
+            (tuple) list of the jobs that are now WAITING, woken or added,
+                and list of (identifier, next due epoch) of the recurring
+                jobs
+        """
+        now = time() if now is None else now
+        sleeping = (self.session)\
+            .query(Job)\
+            .filter(
+                Job.identifier.in_(identifiers),
+                Job.status == JobStatus.SLEEPING.value,
+                Job.run_at <= now,
+                func.coalesce(Job.pending_dependencies, 0) == 0,
+            )\
+            .all()
+        waiting, recurring = [], []
+        for job in sleeping:
+            if job.cron:
+                changes = {"run_at": Cron(job.cron).next(now)}
+            else:
+                changes = {"status": JobStatus.WAITING.value, "last_update": now}
+            updated = (self.session)\
+                .query(Job)\
+                .filter_by(identifier=job.identifier, status=job.status, run_at=job.run_at)\
+                .update(changes, synchronize_session=False)
+            if not updated:
+                continue
+            if job.cron:
+                occurrence = job.occurrence()
+                self.session.add(occurrence)
+                occurrence.set_status(JobStatus.WAITING.value)
+                occurrence.epoch_received = occurrence.last_update
+                self.session.flush()
+                self._record_change(occurrence.identifier, "created", occurrence.to_dict())
+                waiting.append(occurrence)
+                recurring.append((job.identifier, changes["run_at"]))
+            else:
+                event = Event(job_id=job.identifier, status=JobStatus.WAITING.value)
+                event.timestamp = now
+                self.session.add(event)
+                self.session.flush()
+                self._record_status_change(job.identifier, event, job.runner)
+                waiting.append(job)
+        self.session.commit()
+        return waiting, recurring
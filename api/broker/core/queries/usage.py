@@ -0,0 +1,112 @@
+"""Queries on the resource usage of jobs."""
+
+
+from broker.core.models import Usage, UsagePoint
+from broker.core.utils import USAGE_FIELDS
+
+
+# Seconds between two points of a job's usage time series, until it has
+# more than MAX_USAGE_POINTS points and the resolution is doubled
+USAGE_RESOLUTION = 10
+MAX_USAGE_POINTS = 500
+
+
+class UsageQueriesMixin:  # pylint: disable=too-few-public-methods
+    """Queries on the resource usage of the jobs, see `Usage`."""
+
+    def get_usage(self, job_id):
+        """Returns the resource usage of a job.
+
+        Returns:
+            (tuple) `Usage` summary, None if the job has no samples, and list
+                of `UsagePoint`, in order
+
+        Raises:
+            IndexError: if the job doesn't exist
+        """
+        if not self._job_exists(job_id):
+            raise IndexError(f"Job #{job_id} not found")
+        summary = self.session.query(Usage).get(job_id)
+        points = (self.session)\
+            .query(UsagePoint)\
+            .filter_by(job_id=job_id)\
+            .order_by(UsagePoint.timestamp)\
+            .all()
+        return summary, points
+
+    def _add_usage(self, samples_by_job):
+        """Adds usage samples to the summaries and time series of jobs,
+        ignoring the ones older than the last sample of their job."""
+        summaries = {
+            summary.job_id: summary for summary in
+            self.session.query(Usage).filter(Usage.job_id.in_(list(samples_by_job)))
+        }
+        for job_id, samples in samples_by_job.items():
+            samples = sorted(samples, key=lambda sample: sample["timestamp"])
+            summary = summaries.get(job_id)
+            last = None
+            if summary is None:
+                summary = Usage(
+                    job_id=job_id, start=samples[0]["timestamp"], resolution=USAGE_RESOLUTION,
+                    points=0, samples=0, cpu_sum=0, cpu_peak=0, rss_sum=0, rss_peak=0,
+                    gpu_memory_peak=0,
+                )
+                self.session.add(summary)
+            else:
+                last = (self.session)\
+                    .query(UsagePoint)\
+                    .filter_by(job_id=job_id)\
+                    .order_by(UsagePoint.timestamp.desc())\
+                    .first()
+            for sample in samples:
+                if summary.last_sample is not None and sample["timestamp"] <= summary.last_sample:
+                    continue
+                summary.last_sample = sample["timestamp"]
+                summary.samples += 1
+                summary.cpu_sum += sample["cpu"]
+                summary.cpu_peak = max(summary.cpu_peak, sample["cpu"])
+                summary.rss_sum += sample["rss"]
+                summary.rss_peak = max(summary.rss_peak, sample["rss"])
+                summary.gpu_memory_peak = max(summary.gpu_memory_peak, sample["gpu_memory"])
+                summary.read_bytes = sample["read_bytes"]
+                summary.write_bytes = sample["write_bytes"]
+                point = UsagePoint(job_id=job_id, samples=1, **{f: sample[f] for f in USAGE_FIELDS})
+                point.timestamp = _usage_bucket(summary, point.timestamp)
+                if last is not None and last.timestamp == point.timestamp:
+                    last.merge(point)
+                else:
+                    self.session.add(point)
+                    summary.points += 1
+                    last = point
+                if summary.points > MAX_USAGE_POINTS:
+                    last = self._downsample_usage(summary)
+
+    def _downsample_usage(self, summary):
+        """Doubles the resolution of a job's usage time series, merging
+        consecutive points.
+
+        Returns:
+            (UsagePoint) last point of the series
+        """
+        summary.resolution *= 2
+        points = (self.session)\
+            .query(UsagePoint)\
+            .filter_by(job_id=summary.job_id)\
+            .order_by(UsagePoint.timestamp)\
+            .all()
+        merged = []
+        for point in points:
+            point.timestamp = _usage_bucket(summary, point.timestamp)
+            if merged and merged[-1].timestamp == point.timestamp:
+                merged[-1].merge(point)
+                self.session.delete(point)
+            else:
+                merged.append(point)
+        summary.points = len(merged)
+        return merged[-1]
+
+
+def _usage_bucket(summary, timestamp):
+    """Returns the start of the point of a usage time series that an epoch
+    belongs to."""
+    return summary.start + (timestamp - summary.start) // summary.resolution * summary.resolution
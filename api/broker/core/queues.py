@@ -0,0 +1,240 @@
+"""In-memory job queues.
+
+Used by the Scheduler to keep track of dispatchable jobs without reading the
+database on every runner request, and of sleeping jobs without scanning the
+database for the ones that are due.
+"""
+
+
+import heapq
+import threading
+from time import time
+
+
+class ReadyQueue:
+    """Ordered index of dispatchable jobs, with a heap per group (e.g. user)
+    and shape (resources required). Thread-safe.
+
+    Attributes:
+        _heaps: Dict, (group, shape) -> list of (key, identifier), possibly
+            outdated
+        _entries: Dict, identifier -> current (key, (group, shape)) of queued
+            jobs
+    """
+
+    def __init__(self):
+        self._heaps = {}
+        self._entries = {}
+        self._size = 0
+        self._lock = threading.Condition()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, identifier):
+        return identifier in self._entries
+
+    def push(self, identifier, key=None, shape=(), group=None):
+        """Adds a job to the queue, or updates it if already queued.
+
+        Args:
+            identifier (int): Job identifier
+            key: Sort key, jobs with the lowest key are served first.
+                Defaults to the identifier (FIFO).
+            shape (tuple): Resources required by the job
+            group: Group of the job, see `peek`
+        """
+        key = identifier if key is None else key
+        heap = (group, shape)
+        with self._lock:
+            self._entries[identifier] = (key, heap)
+            heapq.heappush(self._heaps.setdefault(heap, []), (key, identifier))
+            self._size += 1
+            if self._size > 2 * len(self._entries) + 64:
+                self._compact()
+            self._lock.notify_all()
+
+    def remove(self, identifier):
+        """Removes a job from the queue if it is queued."""
+        with self._lock:
+            self._entries.pop(identifier, None)
+
+    def peek(self, timeout=0, rank=None, offsets=None):
+        """Returns the identifier of the next job.
+
+        Jobs are served by key plus the offset of their group, then from the
+        shape with the lowest rank, then by identifier.
+
+        Args:
+            timeout (float): Seconds to wait for a job if none is available
+            rank: Callable returning the rank of a shape, or None if jobs of
+                this shape can't be served. By default every shape has the
+                same rank.
+            offsets (dict): Offset added to the keys of the jobs of each
+                group, 0 for missing groups
+
+        Returns:
+            (int) identifier, None if no job is available after timeout
+        """
+        with self._lock:
+            if timeout > 0:
+                self._lock.wait_for(
+                    lambda: self._next_heap(rank, offsets) is not None, timeout)
+            heap = self._next_heap(rank, offsets)
+            return None if heap is None else self._heaps[heap][0][1]
+
+    def pop(self, timeout=0, rank=None, offsets=None):
+        """Removes and returns the identifier of the next job.
+
+        See `peek` for arguments.
+        """
+        with self._lock:
+            if timeout > 0:
+                self._lock.wait_for(
+                    lambda: self._next_heap(rank, offsets) is not None, timeout)
+            heap = self._next_heap(rank, offsets)
+            if heap is None:
+                return None
+            _, identifier = heapq.heappop(self._heaps[heap])
+            self._size -= 1
+            del self._entries[identifier]
+            return identifier
+
+    def clear(self):
+        """Removes all jobs from the queue."""
+        with self._lock:
+            self._heaps = {}
+            self._entries = {}
+            self._size = 0
+
+    def identifiers(self):
+        """Returns the set of queued job identifiers."""
+        with self._lock:
+            return set(self._entries)
+
+    def _next_heap(self, rank, offsets):
+        """Returns the (group, shape) heap the next job is served from, None
+        if there are no jobs to serve. Must be called with the lock held."""
+        best, best_heap = None, None
+        for heap in list(self._heaps):
+            if not self._clean(heap):
+                continue
+            group, shape = heap
+            shape_rank = 0 if rank is None else rank(shape)
+            if shape_rank is None:
+                continue
+            key, identifier = self._heaps[heap][0]
+            offset = offsets.get(group, 0) if offsets else 0
+            candidate = (key + offset, shape_rank, identifier)
+            if best is None or candidate < best:
+                best, best_heap = candidate, heap
+        return best_heap
+
+    def _clean(self, heap):
+        """Drops outdated entries from the top of a heap, then returns
+        whether it has a job. Empty heaps are deleted."""
+        entries = self._heaps[heap]
+        while entries:
+            key, identifier = entries[0]
+            if self._entries.get(identifier) == (key, heap):
+                return True
+            heapq.heappop(entries)
+            self._size -= 1
+        del self._heaps[heap]
+        return False
+
+    def _compact(self):
+        self._heaps = {}
+        for identifier, (key, heap) in self._entries.items():
+            self._heaps.setdefault(heap, []).append((key, identifier))
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+        self._size = len(self._entries)
+
+
+class TimerHeap:
+    """Index of sleeping jobs, by the epoch they are due.
+
+    A binary heap of `(epoch, identifier)` entries with lazy deletion, like
+    `ReadyQueue`. `wait` blocks until the earliest job is due, and is woken
+    up early when an earlier job is pushed.
+
+    Attributes:
+        _heap: List of (epoch, identifier), possibly outdated
+        _entries: Dict, identifier -> current epoch of sleeping jobs
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._lock = threading.Condition()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, identifier):
+        return identifier in self._entries
+
+    def push(self, identifier, epoch):
+        """Adds a job, or updates the epoch it is due."""
+        with self._lock:
+            self._entries[identifier] = epoch
+            heapq.heappush(self._heap, (epoch, identifier))
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [(e, i) for i, e in self._entries.items()]
+                heapq.heapify(self._heap)
+            self._lock.notify_all()
+
+    def remove(self, identifier):
+        """Removes a job if it is sleeping."""
+        with self._lock:
+            self._entries.pop(identifier, None)
+
+    def clear(self):
+        """Removes all jobs."""
+        with self._lock:
+            self._heap = []
+            self._entries = {}
+
+    def next_due(self):
+        """Returns the epoch the earliest job is due, None if there are no
+        jobs."""
+        with self._lock:
+            return self._next_due()
+
+    def pop_due(self, now=None):
+        """Removes and returns the identifiers of the jobs that are due."""
+        now = time() if now is None else now
+        due = []
+        with self._lock:
+            while self._next_due() is not None and self._heap[0][0] <= now:
+                _, identifier = heapq.heappop(self._heap)
+                del self._entries[identifier]
+                due.append(identifier)
+        return due
+
+    def wait(self, stop):
+        """Blocks until a job is due, or `stop` (a `threading.Event`) is set
+        and `interrupt` is called."""
+        with self._lock:
+            while not stop.is_set():
+                epoch = self._next_due()
+                now = time()
+                if epoch is not None and epoch <= now:
+                    return
+                self._lock.wait(None if epoch is None else epoch - now)
+
+    def interrupt(self):
+        """Wakes up the threads blocked in `wait`."""
+        with self._lock:
+            self._lock.notify_all()
+
+    def _next_due(self):
+        """Drops outdated entries from the top of the heap, then returns the
+        epoch of the earliest job. Must be called with the lock held."""
+        while self._heap:
+            epoch, identifier = self._heap[0]
+            if self._entries.get(identifier) == epoch:
+                return epoch
+            heapq.heappop(self._heap)
+        return None
@@ -4,29 +4,83 @@ Controls the order in which the jobs are executed.
 """
 
 
+from time import monotonic
+
+from broker.config import Config
+from broker.core.archiving import ArchiveMixin
+from broker.core.changes import ChangeMixin, SYNC_INTERVAL
 from broker.core.database import DataBaseManager
-from broker.core.utils import JobStatus
+from broker.core.fairshare import FairShareMixin
+from broker.core.leases import LeaseMixin
+from broker.core.queues import ReadyQueue
+from broker.core.timers import TimerMixin
+from broker.core.utils import (
+    RESOLVING, JobStatus, RESOURCES, get_status_value, get_usage_samples)
 
 
-class Scheduler:
+class Scheduler(ArchiveMixin, ChangeMixin, FairShareMixin, LeaseMixin, TimerMixin):
     """Scheduling agent.
 
     Manages the order in which the jobs are executed and is the main interface
-    between users and runners
+    between users and runners. Settings are read from a `broker.config.Config`.
 
     Attributes:
         db_manager: DataBaseManager, wrapper for SQLite3 related methods
+        queue: ReadyQueue, in-memory index of WAITING jobs
     """
-    def __init__(self, sqlite_file="data.db"):
-        self.db_manager = DataBaseManager(sqlite_file)
+    def __init__(self, sqlite_file="data.db", config=Config):
+        self.db_manager = DataBaseManager(sqlite_file, config.DATABASE_POOL_SIZE)
+        self.queue = ReadyQueue()
+        TimerMixin.__init__(self)
+        FairShareMixin.__init__(
+            self, config.PRIORITY_STEP, config.FAIR_SHARE_WEIGHT, config.FAIR_SHARE_HALF_LIFE)
+        ChangeMixin.__init__(self)
+        self.rebuild_queue()
+        self.rebuild_timers()
+        self.resolve_dependencies(self.db_manager.get_unresolved_parents())
+        self.load_fair_share()
+        LeaseMixin.__init__(self, config.LEASE_DURATION, config.MAX_ATTEMPTS)
+        ArchiveMixin.__init__(self)
+        self.release_session()
 
     def add_job(self, job):
-        """Adds a new job to the schedule."""
+        """Adds a new job to the schedule.
+
+        Raises:
+            IndexError: if the job depends on a job that doesn't exist
+        """
         self.db_manager.add_job(job)
+        self._push(job)
+        self._notify_change()
+
+    def add_jobs(self, jobs):
+        """Adds new jobs to the schedule in a single transaction.
+
+        Raises:
+            IndexError: if a job depends on a job that doesn't exist
+
+        Returns:
+            (list) identifiers of the jobs
+        """
+        identifiers = self.db_manager.add_jobs(jobs)
+        for job in jobs:
+            self._push(job)
+        self._notify_change()
+        return identifiers
 
-    def get_jobs(self):
-        """Gets all jobs in schedule."""
-        return self.db_manager.get_jobs()
+    def get_jobs(self, **kwargs):
+        """Gets jobs in schedule.
+
+        See `DataBaseManager.get_jobs` for pagination and filtering args.
+        """
+        return self.db_manager.get_jobs(**kwargs)
+
+    def get_jobs_as_dicts(self, **kwargs):
+        """Gets jobs in schedule, serialized in Python dict format.
+
+        See `DataBaseManager.get_jobs_as_dicts`.
+        """
+        return self.db_manager.get_jobs_as_dicts(**kwargs)
 
     def get_job_by_id(self, identifier):
         """Gets a job given an identifier"""
@@ -36,10 +90,64 @@ class Scheduler:
         """Updates a job's status."""
         status = getattr(JobStatus, status).value
         self.db_manager.update_job(identifier, status=status)
+        if status != JobStatus.RUNNING.value:
+            self.fair_share.stop(identifier)
+        if status in (JobStatus.WAITING.value, JobStatus.SLEEPING.value):
+            self.requeue(identifier)
+        else:
+            self.queue.remove(identifier)
+            self.timers.remove(identifier)
+        if status in RESOLVING:
+            self.resolve_dependencies({identifier: status})
+        self._notify_change()
+
+    def update_jobs(self, updates, runner=None):
+        """Applies several job updates in a single transaction, see
+        `DataBaseManager.update_jobs`.
+
+        Raises:
+            ValueError: if a status or usage sample is not valid
+
+        Returns:
+            (tuple) identifiers of the jobs that were not found, and of the
+                jobs that were lost by the runner
+        """
+        updates = [_convert_update(update) for update in updates]
+        missing, lost = self.db_manager.update_jobs(updates, runner, self.lease_duration)
+        skipped = set(missing) | set(lost)
+        finished = {}
+        for update in updates:
+            if "status" not in update or update["identifier"] in skipped:
+                continue
+            if update["status"] != JobStatus.RUNNING.value:
+                self.fair_share.stop(update["identifier"])
+            if update["status"] in (JobStatus.WAITING.value, JobStatus.SLEEPING.value):
+                self.requeue(update["identifier"])
+            else:
+                self.queue.remove(update["identifier"])
+                self.timers.remove(update["identifier"])
+            if update["status"] in RESOLVING:
+                finished[update["identifier"]] = update["status"]
+        self.resolve_dependencies(finished)
+        self._notify_change()
+        return sorted(missing), sorted(lost)
+
+    def get_usage(self, identifier):
+        """Returns the resource usage of a job, see `DataBaseManager.get_usage`."""
+        return self.db_manager.get_usage(identifier)
 
     def remove_job(self, identifier):
         """Removes an existing job from the schedule."""
         self.db_manager.remove_job(identifier)
+        self.queue.remove(identifier)
+        self.timers.remove(identifier)
+        self.fair_share.stop(identifier)
+        self.resolve_dependencies({identifier: None})
+        self._notify_change()
+
+    def get_stats(self):
+        """Returns the number of jobs, by status, and of users."""
+        return self.db_manager.get_stats()
 
     @property
     def n_jobs(self):
@@ -50,9 +158,148 @@ class Scheduler:
         """Returns a job's current status."""
         return self.db_manager.get_job_status(identifier)
 
-    def get_next(self):
-        """Returns the next job on the queue."""
-        queue = self.db_manager.select_jobs_by(status=2)
-        if len(queue) != 0:
-            return queue[0]
+    def get_next(self, timeout=0):
+        """Returns the next job on the queue, waiting up to `timeout` seconds
+        for one."""
+        for wait in self._waits(timeout):
+            identifier = self.queue.peek(wait, offsets=self.offsets())
+            if identifier is not None:
+                return self.db_manager.get_job_by_id(identifier)
         return None
+
+    def claim_next(self, runner, timeout=0, capacity=None):
+        """Sets the next job on the queue to RUNNING, and leases it to a runner.
+
+        Args:
+            runner (str): Id of the runner
+            timeout (float): Seconds to wait for a job if none is available
+            capacity (dict): Free resources of the runner, see
+                `broker.core.utils.RESOURCES`. Missing resources are 0.
+        """
+        rank = None if capacity is None else fit_rank(capacity)
+        self.db_manager.touch_runner(runner)
+        offsets = self.offsets()
+        for wait in self._waits(timeout):
+            identifier = self.queue.pop(wait, rank, offsets)
+            while identifier is not None:
+                try:
+                    job = self.db_manager.claim_job(identifier, runner, self.lease_duration)
+                except Exception:
+                    self.requeue(identifier)
+                    raise
+                if job is not None:
+                    self.fair_share.start(job.identifier, job.user, job.last_update)
+                    self._notify_change()
+                    return job
+                # Job is not WAITING anymore (e.g. updated by another process)
+                identifier = self.queue.pop(0, rank, offsets)
+        return None
+
+    def _waits(self, timeout):
+        """Yields the timeouts of successive waits on the queue, syncing the
+        scheduler before each one."""
+        deadline = monotonic() + timeout
+        while True:
+            self.sync(SYNC_INTERVAL)
+            remaining = deadline - monotonic()
+            wait = min(max(remaining, 0), SYNC_INTERVAL)
+            if wait > 0:
+                # Don't hold a pooled connection while blocked on the queue
+                self.release_session()
+            yield wait
+            if remaining <= SYNC_INTERVAL:
+                return
+
+    # ----------------------------- Runners ---------------------------- #
+
+    def get_runners(self):
+        """Returns the runners that were seen, with their RUNNING jobs."""
+        return self.db_manager.get_runners()
+
+    # -------------------------- Dependencies -------------------------- #
+
+    def resolve_dependencies(self, finished):
+        """Releases or terminates the jobs that depend on jobs that finished
+        or were removed, see `DataBaseManager.resolve_dependencies`."""
+        if not finished:
+            return
+        released, terminated = self.db_manager.resolve_dependencies(finished)
+        for identifier in terminated:
+            self.timers.remove(identifier)
+        for job in released:
+            self._push(job)
+
+    def get_dependencies(self, identifier):
+        """Returns the dependencies of a job, and on a job, see
+        `DataBaseManager.get_dependencies`."""
+        return self.db_manager.get_dependencies(identifier)
+
+    # ------------------------------ Queue ----------------------------- #
+
+    def requeue(self, identifier):
+        """Pushes a job back in the queue, or in the timers if it is
+        SLEEPING, see `_push`."""
+        self._push(self.get_job_by_id(identifier))
+
+    def _push(self, job):
+        """Queues a WAITING job, or times a SLEEPING one. Jobs with any other
+        status are dropped from both."""
+        self.queue.remove(job.identifier)
+        self.timers.remove(job.identifier)
+        if job.status == JobStatus.WAITING.value:
+            self.queue.push(
+                job.identifier, key=self.queue_key(job.epoch_received, job.priority),
+                shape=job.shape, group=job.user)
+        elif job.status == JobStatus.SLEEPING.value and job.run_at is not None:
+            self.timers.push(job.identifier, job.run_at)
+
+    def rebuild_queue(self):
+        """Rebuilds the queue from the jobs that are WAITING in the database."""
+        self.queue.clear()
+        for entry in self.db_manager.get_queue_entries():
+            self.queue.push(
+                entry.identifier, key=self.queue_key(entry.epoch_received, entry.priority),
+                shape=tuple(v or 0 for v in entry[4:]), group=entry.user)
+
+    def check_queue(self):
+        """Verifies the queue against the database.
+
+        Returns:
+            (tuple) sets of identifiers that are WAITING but missing from the
+                queue, and that are queued but not WAITING anymore. Both are
+                empty if the queue is consistent.
+        """
+        waiting = {entry.identifier for entry in self.db_manager.get_queue_entries()}
+        queued = self.queue.identifiers()
+        return waiting - queued, queued - waiting
+
+
+def _convert_update(update):
+    """Converts the status and usage samples of an update sent by a runner.
+
+    Raises:
+        ValueError: if the status or a usage sample is not valid
+    """
+    update = dict(update)
+    if "status" in update:
+        update["status"] = get_status_value(update["status"])
+    if "usage" in update:
+        update["usage"] = get_usage_samples(update["usage"])
+    return update
+
+
+def fit_rank(capacity):
+    """Returns a best-fit ranking of job shapes for a runner's free capacity:
+    the share of the capacity a shape would leave unused, None if it doesn't
+    fit. It only breaks ties, no capacity is reserved for large jobs."""
+    capacity = tuple(capacity.get(resource, 0) for resource in RESOURCES)
+
+    def rank(shape):
+        leftover = 0
+        for required, available in zip(shape, capacity):
+            if required > available:
+                return None
+            if available > 0:
+                leftover += (available - required) / available
+        return leftover
+    return rank
@@ -0,0 +1,52 @@
+"""Timers of the SLEEPING jobs.
+
+Jobs that run at a given epoch, or on a cron schedule, sleep until they
+are due, and a background thread wakes them.
+"""
+
+
+from broker.core.queues import TimerHeap
+from broker.core.utils import BackgroundTask
+
+
+class TimerMixin:
+    """Timers of the `Scheduler`.
+
+    Attributes:
+        timers: TimerHeap, in-memory index of SLEEPING jobs, by due epoch
+    """
+
+    def __init__(self):
+        self.timers = TimerHeap()
+        self._timer = BackgroundTask("timer")
+
+    def wake_jobs(self, now=None):
+        """Queues the SLEEPING jobs that are due, and returns their
+        identifiers. See `DataBaseManager.wake_jobs`."""
+        due = self.timers.pop_due(now)
+        if not due:
+            return []
+        waiting, recurring = self.db_manager.wake_jobs(due, now)
+        for identifier, run_at in recurring:
+            self.timers.push(identifier, run_at)
+        for job in waiting:
+            self._push(job)
+        if waiting:
+            self._notify_change()
+        return [job.identifier for job in waiting]
+
+    def start_timer(self):
+        """Wakes the jobs whenever one is due, in a background thread."""
+        self._timer.start(
+            self.wake_jobs, wait=self.timers.wait, retry=1, cleanup=self.release_session)
+
+    def stop_timer(self):
+        """Stops the background thread started by `start_timer`."""
+        self._timer.stop()
+        self.timers.interrupt()
+
+    def rebuild_timers(self):
+        """Rebuilds the timers from the SLEEPING jobs of the database."""
+        self.timers.clear()
+        for entry in self.db_manager.get_timer_entries():
+            self.timers.push(entry.identifier, entry.run_at)
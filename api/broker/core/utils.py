@@ -1,8 +1,34 @@
 """Utility functions and objects."""
 
 
+import logging
+import threading
 from enum import Enum
+from time import time
 
+from broker.core.cron import Cron
+
+
+logger = logging.getLogger(__name__)
+
+# Resources a job can require and a runner can offer:
+#   - gpus: number of GPUs
+#   - gpu_memory: GPU memory, in MB
+#   - cpus: number of CPU cores
+#   - memory: RAM, in MB
+RESOURCES = ("gpus", "gpu_memory", "cpus", "memory")
+# Fields of a resource usage sample sent by runners, in order:
+#   - timestamp: epoch of the sample
+#   - cpu: CPU cores used on average since the previous sample
+#   - rss: resident memory, in MB
+#   - gpu_memory: GPU memory, in MB
+#   - read_bytes, write_bytes: bytes read from and written to disk since
+#       the job started
+USAGE_FIELDS = ("timestamp", "cpu", "rss", "gpu_memory", "read_bytes", "write_bytes")
+# Conditions of a job's dependency on another job:
+#   - success: the other job must be DONE
+#   - completion: the other job must be DONE or TERMINATED
+DEPENDENCY_CONDITIONS = ("success", "completion")
 
 class JobStatus(Enum):
     """Represent the status of a job
@@ -10,7 +36,8 @@ class JobStatus(Enum):
         - UNKNOWN: Given that a runner can run on a different network,
             a job has an unknown status if the connection between the Scheduler
             and the Runner can't be established'.
-        - SLEEPING: Waiting for a scheduled epoch to run
+        - SLEEPING: Waiting for a scheduled epoch to run, or for the jobs
+            it depends on to finish
         - WAITING: Ready to run and waiting for a runner
         - RUNNING: Currently running
         - TERMINATED: Terminated by itself or by a runner after an error
@@ -23,6 +50,12 @@ class JobStatus(Enum):
     TERMINATED = 4
     DONE = 5
 
+# Statuses of the jobs that finished, and can be archived
+FINISHED = (JobStatus.DONE.value, JobStatus.TERMINATED.value)
+# Statuses that resolve the dependencies on a job: UNKNOWN jobs were given up
+# on (see `broker.core.leases.MAX_ATTEMPTS`) and satisfy no dependency
+RESOLVING = FINISHED + (JobStatus.UNKNOWN.value,)
+
 
 def is_status_valid(status):
     """Checks if the status value is valid"""
@@ -33,3 +66,157 @@ def is_status_valid(status):
     else:
         return False
     return res
+
+
+def get_status_value(status):
+    """Returns the integer value of a status given by name or value
+
+    Raises:
+        ValueError: if the status is not valid
+    """
+    if isinstance(status, str) and status.isdigit():
+        status = int(status)
+    if not is_status_valid(status):
+        raise ValueError(f"Invalid value for status {status}")
+    if isinstance(status, str):
+        return JobStatus[status].value
+    return status
+
+
+def get_resources(payload):
+    """Returns the resources given in a payload, missing ones are set to 0
+
+    Raises:
+        ValueError: if a resource is not a positive number
+    """
+    resources = {}
+    for resource in RESOURCES:
+        value = payload.get(resource, 0)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"Invalid value for {resource} {value}")
+        resources[resource] = value
+    return resources
+
+
+def get_priority(payload):
+    """Returns the priority given in a payload, 0 if missing
+
+    Raises:
+        ValueError: if the priority is not an integer
+    """
+    priority = payload.get("priority", 0)
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        raise ValueError(f"Invalid value for priority {priority}")
+    return priority
+
+
+def get_schedule(payload):
+    """Returns when the job given in a payload runs: the epoch it is due,
+    and its cron expression if it is recurring. Recurring jobs are first
+    due at the first occurrence from `run_at`, or from now.
+
+    Raises:
+        ValueError: if `run_at` is not an epoch, or `cron` not a valid cron
+            expression (see `broker.core.cron`)
+    """
+    run_at, cron = payload.get("run_at"), payload.get("cron")
+    if run_at is not None and (
+            isinstance(run_at, bool) or not isinstance(run_at, (int, float)) or run_at < 0):
+        raise ValueError(f"Invalid value for run_at {run_at}")
+    if cron is not None:
+        if not isinstance(cron, str):
+            raise ValueError(f"Invalid value for cron {cron}")
+        run_at = Cron(cron).next((time() if run_at is None else run_at) - 1)
+    return run_at, cron
+
+
+def get_dependencies(payload):
+    """Returns the dependencies given in a payload, as (job id, condition)
+    tuples. Each dependency is a job id, for a dependency on its success, or
+    a dict with the `job` id and the condition it is `on` (see
+    `DEPENDENCY_CONDITIONS`).
+
+    Raises:
+        ValueError: if a dependency is not valid, or the job is recurring
+    """
+    dependencies = payload.get("dependencies", [])
+    if not isinstance(dependencies, list):
+        raise ValueError(f"Invalid value for dependencies {dependencies}")
+    if dependencies and payload.get("cron") is not None:
+        raise ValueError("Recurring jobs can't have dependencies")
+    converted = {}
+    for dependency in dependencies:
+        if isinstance(dependency, dict):
+            job, condition = dependency.get("job"), dependency.get("on", "success")
+        else:
+            job, condition = dependency, "success"
+        if isinstance(job, bool) or not isinstance(job, int) \
+                or condition not in DEPENDENCY_CONDITIONS:
+            raise ValueError(f"Invalid dependency {dependency}")
+        converted[job] = condition
+    return list(converted.items())
+
+
+def get_usage_samples(samples):
+    """Converts usage samples sent by a runner, lists of values in the order
+    of `USAGE_FIELDS`, to dicts
+
+    Raises:
+        ValueError: if a sample is not valid
+    """
+    if not isinstance(samples, list):
+        raise ValueError(f"Invalid usage samples {samples}")
+    converted = []
+    for sample in samples:
+        if not isinstance(sample, list) or len(sample) != len(USAGE_FIELDS) or any(
+                isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0
+                for v in sample):
+            raise ValueError(f"Invalid usage sample {sample}")
+        converted.append(dict(zip(USAGE_FIELDS, sample)))
+    return converted
+
+
+class BackgroundTask:
+    """Daemon thread that calls a function until it is stopped.
+
+    Attributes:
+        name (str): Name of the thread
+        stopped: threading.Event, set when the task is stopped
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stopped = threading.Event()
+
+    def start(self, callback, interval=None, wait=None, retry=0, cleanup=None):
+        """Starts a thread that calls `callback` every `interval` seconds.
+
+        Args:
+            wait: Function blocking until the next call, given `stopped`,
+                instead of waiting `interval` seconds
+            retry (float): Seconds to wait after a failed call, which is logged
+            cleanup: Function called after every call, e.g. to release the
+                thread's database session
+        """
+        def run():
+            while not self.stopped.is_set():
+                if wait is None:
+                    self.stopped.wait(interval)
+                else:
+                    wait(self.stopped)
+                if self.stopped.is_set():
+                    return
+                try:
+                    callback()
+                except Exception:  # pylint: disable=W0703
+                    logger.exception("Background task %s failed", self.name)
+                    self.stopped.wait(retry)
+                finally:
+                    if cleanup is not None:
+                        cleanup()
+        self.stopped.clear()
+        threading.Thread(target=run, name=self.name, daemon=True).start()
+
+    def stop(self):
+        """Stops the thread after its current call."""
+        self.stopped.set()
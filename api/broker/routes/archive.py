@@ -0,0 +1,38 @@
+"""Routes related to archived jobs"""
+
+import logging
+
+from flask import current_app as app
+from flask import jsonify
+
+from broker.routes.jobs import _jobs_page
+
+
+logger = logging.getLogger(__name__)
+
+
+@app.route("/archive/jobs", methods=["GET"])
+def get_archived_jobs():
+    """Fetchs a page of archived jobs, ordered by identifier.
+
+    Finished jobs are moved to the archive by the retention policy (see
+    `Scheduler.archive_jobs`). Takes the same query parameters as
+    `GET /jobs`.
+    """
+    logger.info("REQUEST: Fetch archived jobs")
+    if app.archive is None:
+        logger.error("Archive is disabled")
+        return jsonify(error="Archive is disabled"), 404
+    return _jobs_page(app.archive.get_jobs_as_dicts, "get_archived_jobs")
+
+
+@app.route("/archive/jobs/<int:job_id>", methods=["GET"])
+def get_archived_job(job_id):
+    """Fetchs an archived job."""
+    logger.info("REQUEST: Fetch archived job %i", job_id)
+    job = None if app.archive is None else app.archive.get_job_by_id(job_id)
+    if job is None:
+        logger.error("Archived job #%i not found", job_id)
+        return jsonify(error=f"Resource Job #{job_id} not found"), 404
+    logger.info("RESPONSE: Found archived job %i", job_id)
+    return jsonify(job.to_dict()), 200
@@ -0,0 +1,37 @@
+"""Routes that help debugging the app."""
+
+import logging
+
+from flask import current_app as app
+from flask import request, jsonify
+
+
+logger = logging.getLogger(__name__)
+
+ORDERS = ("total", "count", "mean", "max")
+
+
+@app.route("/debug/queries", methods=["GET"])
+def get_queries():
+    """Returns the most expensive SQL statements, and the statements run by
+    requests of each route. Only available if `PROFILE_SQL` is set.
+
+    Query parameters:
+        limit: Number of statements, 10 by default
+        order_by: Statistic the statements are ordered by, one of `ORDERS`
+        reset: If set, the statistics are reset after being returned
+    """
+    logger.info("REQUEST: Fetch profiled statements")
+    if app.profiler is None:
+        logger.error("SQL profiling is disabled")
+        return jsonify(error="SQL profiling is disabled"), 404
+    order_by = request.args.get("order_by", "total")
+    if order_by not in ORDERS:
+        logger.error("Can't order statements by %s", order_by)
+        return jsonify(error=f"Invalid value for order_by {order_by}"), 400
+    statements = app.profiler.top(request.args.get("limit", 10, type=int), order_by)
+    routes = app.profiler.routes()
+    if "reset" in request.args:
+        app.profiler.reset()
+    logger.info("RESPONSE: Found %i statements", len(statements))
+    return jsonify(statements=statements, routes=routes), 200
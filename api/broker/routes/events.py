@@ -0,0 +1,71 @@
+"""Routes that stream changes of the schedule to clients."""
+
+import logging
+from time import monotonic
+
+from flask import current_app as app
+from flask import request, Response, stream_with_context
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of changes read from the database at once
+BATCH_SIZE = 500
+# Seconds between two keep-alive comments, and between two checks for
+# changes made by other processes
+KEEPALIVE = 15
+# Seconds after which a stream is closed. Clients reconnect automatically,
+# from the last change they received.
+MAX_STREAM = 300
+# Milliseconds clients wait before reconnecting
+RETRY = 1000
+
+
+@app.route("/events/stream", methods=["GET"])
+def stream_events():
+    """Streams changes of the schedule as Server-Sent Events.
+
+    Each event has the identifier of the change, its kind (`created`,
+    `updated` or `removed`, see `Change.KINDS`) and a JSON payload: the job
+    for a creation, its new progress and heartbeat for an update (with its
+    new status and event if the status changed), its identifier for a
+    removal.
+
+    The stream starts after the change given by the `Last-Event-ID` header
+    (sent by browsers when they reconnect) or the `after` query parameter,
+    and after the last recorded change otherwise. `GET /jobs` returns the
+    last change in its `X-Last-Event-ID` header, so a client can load the
+    jobs, then apply the changes that follow. If changes the client hasn't
+    seen were deleted, a `reset` event tells it to load the jobs again.
+    """
+    after = request.headers.get("Last-Event-ID", type=int)
+    if after is None:
+        after = request.args.get("after", type=int)
+    first, last = app.schedule.get_change_bounds()
+    reset = after is not None and first is not None and after < first - 1
+    if after is None or reset:
+        after = last or 0
+    logger.info("REQUEST: Stream changes after %i", after)
+    return Response(
+        stream_with_context(_stream_changes(after, reset)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _stream_changes(after, reset):
+    """Yields changes after a given one, as Server-Sent Events."""
+    deadline = monotonic() + MAX_STREAM
+    yield f"retry: {RETRY}\n\n"
+    if reset:
+        yield f"id: {after}\nevent: reset\ndata: {{}}\n\n"
+    while monotonic() < deadline:
+        changes = app.schedule.get_changes(after, BATCH_SIZE)
+        for change in changes:
+            yield f"id: {change.identifier}\nevent: {change.kind}\ndata: {change.data}\n\n"
+            after = change.identifier
+        if len(changes) < BATCH_SIZE:
+            timeout = min(KEEPALIVE, max(deadline - monotonic(), 0))
+            if not app.schedule.wait_for_changes(after, timeout):
+                yield ": keep-alive\n\n"
+    logger.info("RESPONSE: Closed stream after change %i", after)
@@ -2,17 +2,64 @@
 
 # pylint: disable=W0703
 
-import os
+import json
 import logging
+from functools import wraps
 
 from flask import current_app as app
-from flask import request, jsonify, send_from_directory
+from flask import request, jsonify, url_for, Response
 
 from broker.core.models import Job
+from broker.core.changes import SYNC_INTERVAL
+from broker.core.utils import get_status_value
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 100000
+# Size of the chunks in which log uploads are written to disk
+CHUNK_SIZE = 64 * 1024
+# Maximum number of seconds a request following a log can wait
+MAX_FOLLOW = 60
+
+
+def versioned(view):
+    """Caches the responses of a read endpoint by schedule version.
+
+    Responses get the schedule's ETag. A request whose `If-None-Match`
+    header has the current tag gets a 304 without reading the database, and
+    successful responses are kept in `app.cache` until the schedule changes.
+
+    Changes made by other worker processes, including progress and usage
+    updates, change the version when the schedule is synced (see
+    `Scheduler.sync`), so a response may be stale for up to `SYNC_INTERVAL`
+    seconds.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.cache.size:
+            return view(*args, **kwargs)
+        app.schedule.sync(SYNC_INTERVAL)
+        version, etag = app.schedule.version, app.schedule.etag
+        if request.if_none_match.contains(etag):
+            logger.info("RESPONSE: Not modified since version %i", version)
+            response = Response(status=304)
+        else:
+            key = request.full_path
+            cached = app.cache.get(version, key)
+            if cached is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    app.cache.put(version, key, (response.get_data(), list(response.headers)))
+            else:
+                response = Response(cached[0], 200, cached[1])
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    return wrapper
+
 
 @app.route("/jobs", methods=["POST"])
 def append_job():
@@ -24,11 +71,65 @@ def append_job():
         app.schedule.add_job(job)
         logger.info("RESPONSE: Job %i added to schedule", job.identifier)
         return jsonify(job.to_dict()), 201
+    except IndexError as err:
+        logger.error(err)
+        return jsonify(error=f"Resource {err}"), 404
     except Exception as err:
         logger.error(err)
         return jsonify(error="Internal Server Error"), 500
 
 
+@app.route("/jobs/batch", methods=["POST"])
+def append_jobs():
+    """Appends several jobs to the schedule at once.
+
+    The body is either a JSON array of jobs, or one JSON job per line
+    (NDJSON). Every job is validated before any is added, then all are
+    added in a single transaction.
+
+    Returns:
+        identifiers: Identifiers of the jobs, in order
+    """
+    logger.info("REQUEST: Add jobs to schedule")
+    try:
+        payloads = _parse_jobs_body(request)
+    except ValueError as err:
+        logger.error(err)
+        return jsonify(error=str(err)), 400
+    if len(payloads) > MAX_BATCH_SIZE:
+        logger.error("Batch of %i jobs is too large", len(payloads))
+        return jsonify(error=f"Batches are limited to {MAX_BATCH_SIZE} jobs"), 413
+    jobs = []
+    for i, payload in enumerate(payloads):
+        job = Job.from_payload(payload) if isinstance(payload, dict) else None
+        if job is None:
+            logger.error("Job %i of the batch is not valid", i)
+            return jsonify(error=f"Invalid job at index {i}"), 400
+        jobs.append(job)
+    try:
+        identifiers = app.schedule.add_jobs(jobs)
+    except IndexError as err:
+        logger.error(err)
+        return jsonify(error=f"Resource {err}"), 404
+    logger.info("RESPONSE: %i jobs added to schedule", len(identifiers))
+    return jsonify(identifiers=identifiers), 201
+
+
+def _parse_jobs_body(req):
+    """Returns the list of job payloads of a batch request.
+
+    Raises:
+        ValueError: if the body is neither a JSON array nor NDJSON
+    """
+    body = req.get_data(cache=False)
+    try:
+        if body.lstrip().startswith(b"["):
+            return json.loads(body)
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    except ValueError as err:
+        raise ValueError(f"Invalid JSON in request: {err}") from err
+
+
 @app.route("/jobs/<job_id>", methods=["DELETE"])
 def remove_job(job_id):
     """Removes a job from the schedule."""
@@ -44,18 +145,160 @@ def remove_job(job_id):
 
 
 @app.route("/jobs", methods=["GET"])
+@versioned
 def get_jobs():
-    """Fetchs all jobs."""
-    logger.info("REQUEST: Fetch all jobs")
-    jobs = app.schedule.get_jobs()
-    res = []
-    for job in jobs:
-        res.append(job.to_dict())
+    """Fetchs a page of jobs, ordered by identifier.
+
+    Query parameters:
+        after: Identifier of the last job of the previous page
+        limit: Page size, up to `MAX_PAGE_SIZE`
+        status: Only jobs with this status (name or value)
+        user: Only jobs submitted by this user
+        since: Only jobs received at or after this epoch
+        fields: Comma separated list of fields to return (see `Job.FIELDS`),
+            the identifier is always returned
+
+    If the page is full, a `Link` header points to the next one. The
+    `X-Last-Event-ID` header gives the last change of the schedule made
+    before the page was read, to follow the changes from there (see
+    `GET /events/stream`).
+    """
+    logger.info("REQUEST: Fetch jobs")
+    last_change = app.schedule.get_change_bounds()[1] or 0
+    response, status = _jobs_page(app.schedule.get_jobs_as_dicts, "get_jobs")
+    response.headers["X-Last-Event-ID"] = last_change
+    return response, status
+
+
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+@versioned
+def get_job(job_id):
+    """Fetchs a job."""
+    logger.info("REQUEST: Fetch job %i", job_id)
+    job = app.schedule.get_job_by_id(job_id)
+    if job is None:
+        logger.error("Job #%i not found", job_id)
+        return jsonify(error=f"Resource Job #{job_id} not found"), 404
+    logger.info("RESPONSE: Found job %i", job_id)
+    return jsonify(job.to_dict()), 200
+
+
+@app.route("/jobs/stats", methods=["GET"])
+@versioned
+def get_stats():
+    """Counts jobs, by status, and users."""
+    logger.info("REQUEST: Fetch stats")
+    stats = app.schedule.get_stats()
+    logger.info("RESPONSE: Found %i jobs", stats["n_jobs"])
+    return jsonify(stats), 200
+
+
+@app.route("/jobs/<int:job_id>/usage", methods=["GET"])
+@versioned
+def get_usage(job_id):
+    """Fetchs the resource usage of a job, as sampled by its runner.
+
+    Returns:
+        summary: Average and peak CPU cores, resident memory and GPU memory
+            (in MB), and bytes read and written. None if there are no
+            samples.
+        points: Time series of the usage, downsampled so that long jobs
+            have a bounded number of points
+    """
+    logger.info("REQUEST: Fetch usage of job %i", job_id)
+    try:
+        summary, points = app.schedule.get_usage(job_id)
+    except IndexError as err:
+        logger.error(err)
+        return jsonify(error=f"Resource Job #{job_id} not found"), 404
+    logger.info("RESPONSE: Found %i usage points", len(points))
+    return jsonify(
+        summary=summary.to_dict() if summary is not None else None,
+        points=[point.to_dict() for point in points],
+    ), 200
+
+
+@app.route("/jobs/<int:job_id>/dependencies", methods=["GET"])
+@versioned
+def get_dependencies(job_id):
+    """Fetchs the dependencies of a job on other jobs, and of other jobs on
+    it.
+
+    Returns:
+        parents: Dependencies of the job, with the id of the job it depends
+            on, the condition (`success` or `completion`) and whether it
+            finished
+        children: Dependencies of other jobs on the job
+    """
+    logger.info("REQUEST: Fetch dependencies of job %i", job_id)
+    try:
+        parents, children = app.schedule.get_dependencies(job_id)
+    except IndexError as err:
+        logger.error(err)
+        return jsonify(error=f"Resource Job #{job_id} not found"), 404
+    logger.info(
+        "RESPONSE: Found %i parents and %i children", len(parents), len(children))
+    return jsonify(
+        parents=[dependency.to_dict() for dependency in parents],
+        children=[dependency.to_dict() for dependency in children],
+    ), 200
+
+
+def _jobs_page(get_page, endpoint):
+    """Answers a request for a page of jobs, given with the query parameters
+    of GET /jobs.
+
+    Args:
+        get_page: Function returning the page as dicts, given the kwargs of
+            `Scheduler.get_jobs`
+        endpoint (str): Endpoint of the route, that the `Link` header of a
+            full page points to
+    """
+    try:
+        kwargs = _parse_jobs_query(request.args)
+    except ValueError as err:
+        logger.error(err)
+        return jsonify(error=str(err)), 400
+    jobs = get_page(**kwargs)
     logger.info("RESPONSE: Found %i jobs", len(jobs))
-    return jsonify(res), 200
+    response = jsonify(jobs)
+    if len(jobs) == kwargs["limit"]:
+        args = request.args.to_dict()
+        args["after"] = jobs[-1]["identifier"]
+        response.headers["Link"] = f'<{url_for(endpoint, **args)}>; rel="next"'
+    return response, 200
+
 
+def _parse_jobs_query(args):
+    """Converts GET /jobs query parameters to `Scheduler.get_jobs` kwargs.
 
-@app.route("/jobs/<job_id>/logs", methods=["POST"])
+    Raises:
+        ValueError: if a parameter is not valid
+    """
+    kwargs = {
+        "limit": min(args.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE),
+        "after": args.get("after", type=int),
+        "since": args.get("since", type=float),
+        "fields": Job.FIELDS,
+    }
+    if kwargs["limit"] <= 0:
+        raise ValueError("Invalid value for limit")
+    if "status" in args:
+        kwargs["status"] = get_status_value(args["status"])
+    if "user" in args:
+        kwargs["user"] = args["user"]
+    if "fields" in args:
+        fields = args["fields"].split(",")
+        unknown = set(fields) - set(Job.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields {', '.join(sorted(unknown))}")
+        if "identifier" not in fields:
+            fields.insert(0, "identifier")
+        kwargs["fields"] = fields
+    return kwargs
+
+
+@app.route("/jobs/<int:job_id>/logs", methods=["POST"])
 def add_logfile(job_id):
     """Adds a logfile to its corresponding job."""
     if "logfile" not in request.files:
@@ -65,7 +308,10 @@ def add_logfile(job_id):
     logfile = request.files["logfile"]
     try:
         filename = app.schedule.db_manager.add_logfile(job_id)
-        logfile.save(os.path.join(app.config["STORAGE_URI"], filename))
+        chunk = logfile.stream.read(CHUNK_SIZE)
+        while chunk:
+            app.logs.append(filename, chunk)
+            chunk = logfile.stream.read(CHUNK_SIZE)
         logger.info("RESPONSE: Added logfile to job %i", job_id)
         return jsonify(), 204
     except IndexError as err:
@@ -73,19 +319,103 @@ def add_logfile(job_id):
         return jsonify(error=f"Resource Job #{job_id} not found"), 404
 
 
-@app.route("/jobs/<job_id>/logs", methods=["GET"])
-def get_logfile(job_id):
-    """Returns a log file given a job id."""
+@app.route("/jobs/<int:job_id>/logs/append", methods=["POST"])
+def append_logfile(job_id):
+    """Appends a chunk of output to a job's log file.
+
+    Used by runners to stream logs while the job runs. The request body is
+    the raw chunk, written to the log storage as it is received so that the
+    whole body is never held in memory.
+
+    Query parameters:
+        offset: Position of the chunk in the log. Bytes that were already
+            received are skipped, so a chunk can safely be sent again.
+
+    Returns:
+        size: Size of the log file after the append. If the chunk starts
+            after the end of the file (a previous chunk was lost), nothing
+            is written and a 409 is returned, so the runner can resend
+            from there.
+    """
+    offset = request.args.get("offset", type=int)
+    logger.info("REQUEST: Append to logfile of job %i", job_id)
     try:
-        logfile = app.schedule.db_manager.get_logfile(job_id)
-        logger.info("REQUEST: Get logfile for %i", job_id)
-        if logfile is None:
-            return jsonify(error="Log file not found"), 404
-        logger.info("RESPONSE: Logfile sent")
-        return send_from_directory(
-            directory=app.config["STORAGE_URI"],
-            filename=logfile.filename
-        ), 200
+        filename = app.schedule.db_manager.get_or_add_logfile(job_id)
     except IndexError as err:
         logger.error(err)
         return jsonify(error=f"Resource Job #{job_id} not found"), 404
+    size = app.logs.size(filename)
+    offset = size if offset is None else offset
+    if offset > size:
+        logger.error("Chunk starts at %i, but logfile has %i bytes", offset, size)
+        return jsonify(error="Chunk starts after the end of the log", size=size), 409
+    skip = size - offset
+    chunk = request.stream.read(CHUNK_SIZE)
+    while chunk:
+        if skip < len(chunk):
+            size = app.logs.append(filename, chunk[skip:])
+        skip = max(skip - len(chunk), 0)
+        chunk = request.stream.read(CHUNK_SIZE)
+    logger.info("RESPONSE: Logfile of job %i has %i bytes", job_id, size)
+    return jsonify(size=size), 200
+
+
+@app.route("/jobs/<int:job_id>/logs", methods=["GET"])
+def get_logfile(job_id):
+    """Returns a job's log file, or part of it.
+
+    Logs are stored compressed, and only the blocks needed to serve the
+    requested part are decompressed.
+
+    Query parameters:
+        offset: Only bytes from this position
+        tail: Only the last N lines
+        follow: If there are no bytes after offset yet, wait up to
+            `MAX_FOLLOW` seconds for the job to write some
+
+    The `Range` header is supported too. The `X-Log-Offset` header gives the
+    position after the last byte sent, i.e. the offset to follow the log.
+    Logs of archived jobs are served too, if they were kept.
+    """
+    logger.info("REQUEST: Get logfile for %i", job_id)
+    try:
+        logfile = app.schedule.db_manager.get_logfile(job_id)
+    except IndexError as err:
+        logfile = _get_archived_logfile(job_id)
+        if logfile is None:
+            logger.error(err)
+            return jsonify(error=f"Resource Job #{job_id} not found"), 404
+    if logfile is None or not app.logs.exists(logfile.filename):
+        return jsonify(error="Log file not found"), 404
+    filename = logfile.filename
+    offset = request.args.get("offset", 0, type=int)
+    if "follow" in request.args and app.logs.size(filename) <= offset:
+        app.schedule.release_session()
+        app.logs.wait(filename, offset, MAX_FOLLOW)
+    size = app.logs.size(filename)
+    start, end, status = min(offset, size), size, 200
+    if "tail" in request.args:
+        start = max(start, app.logs.tail_offset(filename, request.args.get("tail", 0, type=int)))
+    if request.range is not None:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+        (start, end), status = byte_range, 206
+    response = Response(app.logs.read(filename, start, end), status, mimetype="text/plain")
+    response.headers["Content-Length"] = end - start
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["X-Log-Offset"] = end
+    if status == 206:
+        response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    logger.info("RESPONSE: Sent bytes %i to %i of logfile", start, end)
+    return response
+
+
+def _get_archived_logfile(job_id):
+    """Returns the log file of an archived job, None if there is none."""
+    if app.archive is None:
+        return None
+    try:
+        return app.archive.get_logfile(job_id)
+    except IndexError:
+        return None
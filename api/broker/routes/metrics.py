@@ -0,0 +1,17 @@
+"""Route that exposes metrics to Prometheus."""
+
+from flask import current_app as app
+from flask import Response
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Returns the metrics in the Prometheus text exposition format.
+
+    See `broker.core.metrics.Metrics` for the exposed metrics. Scheduler
+    metrics are collected here rather than while handling other requests.
+    """
+    return Response(
+        app.metrics.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
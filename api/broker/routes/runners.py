@@ -5,17 +5,24 @@ import logging
 from flask import current_app as app
 from flask import request, jsonify
 
-from broker.core.utils import is_status_valid
+from broker.core.utils import is_status_valid, get_resources
 
 
 logger = logging.getLogger(__name__)
 
+MAX_WAIT = 60
+
 
 @app.route("/runners/available-job", methods=["GET"])
 def get_available_job():
-    """Gets an available job"""
+    """Gets an available job
+
+    Query parameters:
+        wait: Seconds to wait for a job if none is available (long polling),
+            up to `MAX_WAIT`
+    """
     logger.info("REQUEST: Runner asked for an available job")
-    job = app.schedule.get_next()
+    job = app.schedule.get_next(timeout=_get_wait())
     if job is None:
         logger.info("RESPONSE: No more jobs available.")
         return jsonify(None), 204
@@ -23,6 +30,43 @@ def get_available_job():
     return jsonify(job.to_dict()), 200
 
 
+@app.route("/runners/claim-job", methods=["POST"])
+def claim_job():
+    """Claims an available job.
+
+    The job is set to RUNNING and leased to the runner in one transaction,
+    so concurrent runners never receive the same job.
+
+    Payload:
+        runner: Id of the runner
+        capacity: Optional, free resources of the runner (see
+            `broker.core.utils.RESOURCES`). If given, the best fitting job is
+            claimed, otherwise the first one in the queue.
+
+    Query parameters:
+        wait: Seconds to wait for a job if none is available (long polling),
+            up to `MAX_WAIT`
+    """
+    payload = request.json or {}
+    if "runner" not in payload:
+        logger.error("Runner wanted to claim a job, but its id is missing")
+        return jsonify(error="Missing runner id in request"), 400
+    logger.info("REQUEST: Runner %s wants to claim a job", payload["runner"])
+    capacity = payload.get("capacity")
+    if capacity is not None:
+        try:
+            capacity = get_resources(capacity)
+        except (ValueError, AttributeError) as err:
+            logger.error(err)
+            return jsonify(error=f"Invalid capacity {capacity}"), 400
+    job = app.schedule.claim_next(payload["runner"], timeout=_get_wait(), capacity=capacity)
+    if job is None:
+        logger.info("RESPONSE: No more jobs available.")
+        return jsonify(None), 204
+    logger.info("RESPONSE: Job %i leased to runner %s", job.identifier, payload["runner"])
+    return jsonify(job.to_dict()), 200
+
+
 @app.route("/runners/update-job", methods=["PUT"])
 def update_job_status():
     """Updates a job's status"""
@@ -44,3 +88,69 @@ def update_job_status():
         return jsonify(
             error=f"Resource Job #{payload['identifier']} not found"
         ), 404
+
+
+@app.route("/runners/update-jobs", methods=["POST"])
+def update_jobs():
+    """Applies a batch of updates from a runner in one transaction.
+
+    Payload:
+        runner: Id of the runner
+        updates: List of updates, each with a job's `identifier`, and
+            optionally its new `status` (name or value), `progress`, and
+            `usage` samples (lists of values, see
+            `broker.core.utils.USAGE_FIELDS`).
+            Every update is also a heartbeat for its job, so a runner sends
+            `{"identifier": ...}` for each job it holds that has no other
+            update.
+
+    Updates are only applied to the jobs the runner holds. Heartbeats
+    renew the runner's leases.
+
+    Returns:
+        missing: Identifiers of the jobs that were not found (e.g. removed
+            by their user)
+        lost: Identifiers of the jobs the runner doesn't hold anymore (e.g.
+            its lease expired), the runner should stop them
+    """
+    payload = request.json or {}
+    updates = payload.get("updates")
+    if "runner" not in payload or not isinstance(updates, list):
+        logger.error("Runner sent updates, but its id or the updates are missing")
+        return jsonify(error="Missing runner id or updates in request"), 400
+    logger.info("REQUEST: Runner %s sent %i updates", payload["runner"], len(updates))
+    for update in updates:
+        if not isinstance(update, dict) or not isinstance(update.get("identifier"), int):
+            logger.error("Update %s has no job identifier", update)
+            return jsonify(error=f"Invalid update {update}"), 400
+        progress = update.get("progress", 0)
+        if isinstance(progress, bool) or not isinstance(progress, (int, float)):
+            logger.error("Update %s has an invalid progress", update)
+            return jsonify(error=f"Invalid value for progress {progress}"), 400
+    try:
+        missing, lost = app.schedule.update_jobs(updates, runner=payload["runner"])
+    except ValueError as err:
+        logger.error(err)
+        return jsonify(error=str(err)), 400
+    logger.info(
+        "RESPONSE: Applied updates, %i jobs not found, %i jobs lost", len(missing), len(lost))
+    return jsonify(missing=missing, lost=lost), 200
+
+
+@app.route("/runners", methods=["GET"])
+def get_runners():
+    """Lists the runners that were seen, with the jobs they are running.
+
+    Returns:
+        List of runners, with their `identifier`, `last_seen` epoch and the
+        identifiers of their RUNNING `jobs`
+    """
+    logger.info("REQUEST: Fetch runners")
+    runners = app.schedule.get_runners()
+    logger.info("RESPONSE: Found %i runners", len(runners))
+    return jsonify(runners), 200
+
+
+def _get_wait():
+    """Returns the long polling timeout requested by the runner."""
+    return min(max(request.args.get("wait", 0, type=float), 0), MAX_WAIT)
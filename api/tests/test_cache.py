@@ -0,0 +1,29 @@
+from broker.core.cache import ResponseCache
+
+
+def test_get_put():
+    cache = ResponseCache(size=2)
+    assert cache.get(1, "/jobs") is None
+    cache.put(1, "/jobs", "a")
+    assert cache.get(1, "/jobs") == "a"
+    assert cache.get(2, "/jobs") is None
+
+def test_lru():
+    cache = ResponseCache(size=2)
+    cache.put(1, "/jobs", "a")
+    cache.put(1, "/jobs/1", "b")
+    cache.get(1, "/jobs")
+    cache.put(1, "/jobs/2", "c")
+    assert len(cache) == 2
+    assert cache.get(1, "/jobs/1") is None
+    assert cache.get(1, "/jobs") == "a"
+
+def test_versions():
+    cache = ResponseCache()
+    cache.put(1, "/jobs", "a")
+    cache.put(2, "/jobs/1", "b")
+    assert len(cache) == 1
+    # responses computed for an older version are not cached
+    cache.put(1, "/jobs", "a")
+    assert cache.get(1, "/jobs") is None
+    assert cache.get(2, "/jobs/1") == "b"
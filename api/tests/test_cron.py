@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import pytest
+
+from broker.core.cron import Cron
+
+
+def epoch(*args):
+    return datetime(*args).timestamp()
+
+def test_parse():
+    cron = Cron("*/15 9-17 * jan,jul 1-5")
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == set(range(9, 18))
+    assert cron.months == {1, 7}
+    assert cron.weekdays == {1, 2, 3, 4, 5}
+    assert Cron("0 0 * * 7").weekdays == {0}
+    assert Cron("5/20 * * * *").minutes == {5, 25, 45}
+    assert Cron("@daily").hours == {0}
+    for expression in ("* * * *", "60 * * * *", "* * * * mon-", "*/0 * * * *", "a b c d e"):
+        with pytest.raises(ValueError):
+            Cron(expression)
+
+def test_next():
+    # Thursday, 1 October 2026
+    now = epoch(2026, 10, 1, 12, 30, 20)
+    assert Cron("* * * * *").next(now) == epoch(2026, 10, 1, 12, 31)
+    assert Cron("30 12 * * *").next(now) == epoch(2026, 10, 2, 12, 30)
+    assert Cron("0 3 * * mon").next(now) == epoch(2026, 10, 5, 3, 0)
+    assert Cron("0 0 1 * *").next(now) == epoch(2026, 11, 1)
+    assert Cron("0 0 29 2 *").next(now) == epoch(2028, 2, 29)
+    # day of month or day of week
+    assert Cron("0 0 15 * sat").next(now) == epoch(2026, 10, 3)
+    with pytest.raises(ValueError):
+        Cron("0 0 30 2 *").next(now)
@@ -3,7 +3,7 @@ from pathlib import Path
 import sqlite3
 
 from broker.core.database import DataBaseManager
-from broker.core.models import Job, Event
+from broker.core.models import Job
 
 if __name__ == "__main__":
     empty_db = DataBaseManager("tests/test_data/empty.db")
@@ -16,11 +16,11 @@ if __name__ == "__main__":
     }))
     job1 = db.session.query(Job).filter_by(identifier=1).first()
     sleep(1)
-    job1.events.append(Event(status=2))
+    job1.set_status(2)
     sleep(1)
-    job1.events.append(Event(status=3))
+    job1.set_status(3)
     sleep(1)
-    job1.events.append(Event(status=5))
+    job1.set_status(5)
 
     db.session.add(Job.from_payload({
         "user": "boy@mail.com",
@@ -28,11 +28,11 @@ if __name__ == "__main__":
         "command": "echo 'I speak giberish'",
     }))
     job2 = db.session.query(Job).filter_by(identifier=2).first()
-    job2.events.append(Event(status=2))
+    job2.set_status(2)
     sleep(1)
-    job2.events.append(Event(status=3))
+    job2.set_status(3)
     sleep(1)
-    job2.events.append(Event(status=4))
+    job2.set_status(4)
 
     db.session.add(Job.from_payload({
         "user": "scott@mail.com",
@@ -40,9 +40,9 @@ if __name__ == "__main__":
         "command": "df -h",
     }))
     job3 = db.session.query(Job).filter_by(identifier=3).first()
-    job3.events.append(Event(status=2))
+    job3.set_status(2)
     sleep(1)
-    job3.events.append(Event(status=3))
+    job3.set_status(3)
 
     db.session.add(Job.from_payload({
         "user": "jim@mail.com",
@@ -50,7 +50,7 @@ if __name__ == "__main__":
         "command": "echo 'He done'",
     }))
     job4 = db.session.query(Job).filter_by(identifier=4).first()
-    job4.events.append(Event(status=2))
+    job4.set_status(2)
 
     db.session.add(Job.from_payload({
         "user": "creator@mail.com",
@@ -58,7 +58,7 @@ if __name__ == "__main__":
         "command": "docker ps",
     }))
     job5 = db.session.query(Job).filter_by(identifier=5).first()
-    job5.events.append(Event(status=2))
+    job5.set_status(2)
 
     db.session.add(Job.from_payload({
         "user": "good@mail.com",
@@ -66,5 +66,5 @@ if __name__ == "__main__":
         "command": "sleep 15",
     }))
     job6 = db.session.query(Job).filter_by(identifier=6).first()
-    job6.events.append(Event(status=2))
+    job6.set_status(2)
     db.session.commit()
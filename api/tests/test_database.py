@@ -1,9 +1,14 @@
 import os
+import json
+import threading
 import logging
 from shutil import copyfile
 import pytest
+from sqlalchemy import inspect, event
+from broker.core import migrations
 from broker.core.database import DataBaseManager
-from broker.core.models import Job, Event
+from broker.core.queries import usage
+from broker.core.models import Job, Event, UsagePoint
 from broker.core.utils import JobStatus
 
 
@@ -16,20 +21,26 @@ logging.basicConfig(level=logging.ERROR)
 @pytest.fixture
 def warm_db(scope="module"):
     copyfile("tests/test_data/data.db", "tests/test_data/backup")
-    yield DataBaseManager("tests/test_data/data.db")
+    db = DataBaseManager("tests/test_data/data.db")
+    yield db
+    db.close()
     os.remove("tests/test_data/data.db")
     os.rename("tests/test_data/backup", "tests/test_data/data.db")
 
 @pytest.fixture
 def warm_empty_db(scope="module"):
     copyfile("tests/test_data/empty.db", "tests/test_data/empty_backup")
-    yield DataBaseManager("tests/test_data/empty.db")
+    db = DataBaseManager("tests/test_data/empty.db")
+    yield db
+    db.close()
     os.remove("tests/test_data/empty.db")
     os.rename("tests/test_data/empty_backup", "tests/test_data/empty.db")   
 
 @pytest.fixture
 def cold_db(scope="module"):
-    yield DataBaseManager("/tmp/no.db")
+    db = DataBaseManager("/tmp/no.db")
+    yield db
+    db.close()
     os.remove("/tmp/no.db")
 
 @pytest.fixture
@@ -93,3 +104,223 @@ def test_remove_job(warm_db, warm_empty_db):
 def test_select_job_by(warm_db):
     assert len(warm_db.select_jobs_by(status=2)) == 3
     assert len(warm_db.select_jobs_by(status=8)) == 0
+
+def test_select_first_job_by(warm_db):
+    assert warm_db.select_first_job_by(status=2).identifier == 4
+    assert warm_db.select_first_job_by(status=8) is None
+
+def test_job_status(warm_db, warm_empty_db, dummy_job_1):
+    assert warm_db.get_job_status(1) == JobStatus.DONE.value
+    assert warm_db.get_job_status(3) == JobStatus.RUNNING.value
+    with pytest.raises(IndexError):
+        warm_db.get_job_status(162)
+
+    warm_db.update_job(4, status=JobStatus.RUNNING.value)
+    job = warm_db.get_job_by_id(4)
+    assert job.status == JobStatus.RUNNING.value
+    assert job.last_update == job.events[-1].timestamp
+    assert len(warm_db.select_jobs_by(status=2)) == 2
+
+    warm_empty_db.add_job(dummy_job_1)
+    assert dummy_job_1.status == JobStatus.WAITING.value
+
+def test_migration(warm_db, cold_db):
+    assert migrations.get_version(warm_db.engine) == len(migrations.MIGRATIONS)
+    assert migrations.get_version(cold_db.engine) == len(migrations.MIGRATIONS)
+    indexes = [i["name"] for i in inspect(warm_db.engine).get_indexes("jobs")]
+    assert "ix_jobs_status" in indexes
+    indexes = [i["name"] for i in inspect(warm_db.engine).get_indexes("events")]
+    assert "ix_events_job_id_timestamp" in indexes
+    last_update = warm_db.get_job_by_id(2).last_update
+    assert last_update == max(e.timestamp for e in warm_db.get_job_by_id(2).events)
+
+def test_get_jobs(warm_db):
+    assert len(warm_db.get_jobs()) == 6
+    assert [j.identifier for j in warm_db.get_jobs(after=2, limit=2)] == [3, 4]
+    assert [j.identifier for j in warm_db.get_jobs(status=2, after=4)] == [5, 6]
+    assert [j.identifier for j in warm_db.get_jobs(since=1599418816.465)] == [5, 6]
+    assert [j.identifier for j in warm_db.get_jobs(user="jim@mail.com")] == [4]
+
+def test_get_jobs_as_dicts(warm_db):
+    jobs = warm_db.get_jobs_as_dicts()
+    assert jobs == [job.to_dict() for job in warm_db.get_jobs()]
+    jobs = warm_db.get_jobs_as_dicts(status=2, limit=2, fields=("status", "events"))
+    assert jobs == [
+        {"status": 2, "events": [e.to_dict() for e in warm_db.get_job_by_id(4).events]},
+        {"status": 2, "events": [e.to_dict() for e in warm_db.get_job_by_id(5).events]},
+    ]
+
+def test_get_jobs_as_dicts_n_queries(cold_db):
+    statements = []
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(cold_db.engine, "before_cursor_execute", count)
+
+    n_queries = []
+    for n_jobs in (10, 100, 1000):
+        for _ in range(n_jobs - cold_db.get_n_jobs()):
+            job = Job(user="Brian", description="Deadlift", command="Lift")
+            job.set_status(JobStatus.WAITING.value)
+            job.set_status(JobStatus.RUNNING.value)
+            cold_db.session.add(job)
+        cold_db.session.commit()
+        statements.clear()
+        assert len(cold_db.get_jobs_as_dicts()) == n_jobs
+        n_queries.append(len(statements))
+    assert n_queries == [2, 2, 2]
+
+def test_changes(cold_db, dummy_job_1):
+    assert cold_db.get_change_bounds() == (None, None)
+    cold_db.add_job(dummy_job_1)
+    cold_db.claim_job(1, "runner-0")
+    cold_db.update_job(1, status=JobStatus.DONE.value)
+    cold_db.update_job(1, user="Brian")
+    cold_db.remove_job(1)
+    changes = cold_db.get_changes()
+    assert [(c.identifier, c.job_id, c.kind) for c in changes] == [
+        (1, 1, "created"), (2, 1, "updated"), (3, 1, "updated"), (4, 1, "removed"),
+    ]
+    assert json.loads(changes[0].data)["events"][0]["status"] == JobStatus.WAITING.value
+    assert json.loads(changes[1].data)["runner"] == "runner-0"
+    assert json.loads(changes[2].data)["event"]["status"] == JobStatus.DONE.value
+    assert [c.identifier for c in cold_db.get_changes(after=2, limit=1)] == [3]
+    assert cold_db.get_change_bounds() == (1, 4)
+    assert cold_db.prune_changes() == 0
+    assert cold_db.prune_changes(max_count=2) == 2
+    assert cold_db.get_change_bounds() == (3, 4)
+    # the last change is always kept
+    assert cold_db.prune_changes(max_age=-1) == 1
+    assert cold_db.get_change_bounds() == (4, 4)
+
+def test_add_jobs(warm_db, dummy_job_1, dummy_job_2):
+    assert warm_db.add_jobs([]) == []
+    assert warm_db.add_jobs([dummy_job_1, dummy_job_2]) == [7, 8]
+    assert [job.identifier for job in (dummy_job_1, dummy_job_2)] == [7, 8]
+    job = warm_db.get_job_by_id(8)
+    assert job.user == "Brian"
+    assert job.status == JobStatus.WAITING.value
+    assert job.epoch_received == job.last_update == job.events[0].timestamp
+    assert job.gpus == 0
+    assert [e.status for e in job.events] == [JobStatus.WAITING.value]
+    change = warm_db.get_changes()[-1]
+    assert (change.job_id, change.kind) == (8, "created")
+    assert json.loads(change.data) == job.to_dict()
+
+def test_update_jobs_n_queries(cold_db):
+    for _ in range(100):
+        cold_db.add_job(Job(user="Brian", description="Deadlift", command="Lift"))
+    statements = []
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(cold_db.engine, "before_cursor_execute", count)
+
+    missing, lost = cold_db.update_jobs(
+        [{"identifier": i, "status": JobStatus.RUNNING.value} for i in range(1, 101)]
+        + [{"identifier": 1000}]
+    )
+    assert (missing, lost) == ([1000], [])
+    # select, update, first event, other events, changes
+    assert len(statements) == 5
+    assert all(j.status == JobStatus.RUNNING.value for j in cold_db.get_jobs())
+    assert all(len(j.events) == 2 for j in cold_db.get_jobs())
+
+def test_connections(cold_db):
+    with cold_db.engine.connect() as connection:
+        assert connection.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.execute("PRAGMA synchronous").scalar() == 1
+        assert connection.execute("PRAGMA busy_timeout").scalar() == 30000
+
+def test_concurrent_reads_and_writes(cold_db):
+    errors = []
+    def work(write):
+        try:
+            for _ in range(50):
+                if write:
+                    cold_db.add_job(Job(user="Brian", description="Deadlift", command="Lift"))
+                else:
+                    cold_db.get_jobs_as_dicts(limit=100)
+                    cold_db.session.remove()
+        except Exception as err:
+            errors.append(err)
+        finally:
+            cold_db.session.remove()
+
+    threads = [threading.Thread(target=work, args=(i % 2 == 0,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert cold_db.get_n_jobs() == 200
+
+def test_archive(warm_db, cold_db):
+    assert warm_db.get_archivable_jobs(max_age=10 ** 10) == []
+    assert warm_db.get_archivable_jobs(max_count=1) == [1]
+    assert warm_db.get_archivable_jobs(max_age=0, max_count=1, limit=1) == [1]
+    assert warm_db.get_archivable_jobs(max_count=0) == [1, 2]
+
+    rows = warm_db.export_jobs([1, 2, 4])
+    cold_db.import_jobs(rows)
+    cold_db.import_jobs(rows)
+    assert [j.identifier for j in cold_db.get_jobs()] == [1, 2, 4]
+    assert len(cold_db.get_job_by_id(1).events) == 3
+    expected = warm_db.get_job_by_id(2).to_dict()
+    archived = cold_db.get_job_by_id(2).to_dict()
+    # events get new identifiers in the archive
+    assert [e["status"] for e in archived.pop("events")] \
+        == [e["status"] for e in expected.pop("events")]
+    assert archived == expected
+
+    assert warm_db.delete_finished_jobs([1, 2, 4]) == [1, 2]
+    assert [j.identifier for j in warm_db.get_jobs()] == [3, 4, 5, 6]
+    assert warm_db.session.query(Event).filter(Event.job_id.in_([1, 2])).count() == 0
+
+def test_archive_usage(warm_db, cold_db):
+    warm_db.update_jobs([{"identifier": 1, "usage": [
+        {"timestamp": 100, "cpu": 1, "rss": 10, "gpu_memory": 0, "read_bytes": 0, "write_bytes": 0},
+    ]}])
+    cold_db.import_jobs(warm_db.export_jobs([1]))
+    assert cold_db.get_usage(1)[0].samples == 1
+    assert len(cold_db.get_usage(1)[1]) == 1
+    warm_db.delete_finished_jobs([1])
+    assert warm_db.session.query(UsagePoint).count() == 0
+
+def test_job_ids_not_reused(warm_db, dummy_job_1):
+    indexes = [i["name"] for i in inspect(warm_db.engine).get_indexes("jobs")]
+    assert "ix_jobs_status_last_update" in indexes
+    warm_db.remove_job(6)
+    warm_db.add_job(dummy_job_1)
+    assert dummy_job_1.identifier == 7
+
+def test_usage(cold_db, dummy_job_1, monkeypatch):
+    monkeypatch.setattr(usage, "MAX_USAGE_POINTS", 4)
+    cold_db.add_job(dummy_job_1)
+    with pytest.raises(IndexError):
+        cold_db.get_usage(2)
+    assert cold_db.get_usage(1) == (None, [])
+
+    def sample(timestamp, cpu, rss):
+        return {
+            "timestamp": timestamp, "cpu": cpu, "rss": rss, "gpu_memory": 0,
+            "read_bytes": timestamp, "write_bytes": 0,
+        }
+    # samples of the same 10 seconds are merged in a point
+    cold_db.update_jobs([{"identifier": 1, "usage": [sample(100, 1, 10), sample(105, 3, 30)]}])
+    cold_db.update_jobs([{"identifier": 1, "usage": [sample(112, 2, 20)]}])
+    # samples sent again are ignored
+    cold_db.update_jobs([{"identifier": 1, "usage": [sample(112, 2, 20)]}])
+    summary, points = cold_db.get_usage(1)
+    assert summary.to_dict() == {
+        "start": 100, "last_sample": 112, "resolution": 10, "samples": 3,
+        "cpu": {"avg": 2, "peak": 3}, "rss": {"avg": 20, "peak": 30},
+        "gpu_memory": {"peak": 0}, "read_bytes": 112, "write_bytes": 0,
+    }
+    assert [(p.timestamp, p.samples, p.cpu, p.rss, p.read_bytes) for p in points] \
+        == [(100, 2, 2, 30, 105), (110, 1, 2, 20, 112)]
+
+    # the resolution doubles when there are too many points
+    cold_db.update_jobs([{"identifier": 1, "usage": [sample(t, 1, 10) for t in (120, 130, 140)]}])
+    summary, points = cold_db.get_usage(1)
+    assert summary.resolution == 20
+    assert [(p.timestamp, p.samples) for p in points] == [(100, 3), (120, 2), (140, 1)]
+    assert [p.cpu for p in points] == [2, 1, 1]
@@ -0,0 +1,26 @@
+import pytest
+
+from broker.core.fairshare import FairShare
+
+
+def test_decay():
+    fair_share = FairShare(half_life=100)
+    fair_share.add("a", 40, 1000)
+    fair_share.add("b", 10, 1100)
+    assert fair_share.usage(now=1100) == pytest.approx({"a": 20, "b": 10})
+    assert fair_share.usage(now=1200) == pytest.approx({"a": 10, "b": 5})
+    # runs recorded out of order are decayed the same way
+    fair_share.add("b", 40, 1000)
+    assert fair_share.usage(now=1200)["b"] == pytest.approx(15)
+
+def test_running():
+    fair_share = FairShare(half_life=100)
+    fair_share.start(1, "a", 1000)
+    fair_share.start(2, "a", 1050)
+    assert fair_share.usage(now=1100) == pytest.approx({"a": 150})
+    fair_share.stop(1, 1100)
+    fair_share.stop(1, 1100)
+    fair_share.stop(42, 1100)
+    assert fair_share.usage(now=1200) == pytest.approx({"a": 200})
+    fair_share.clear()
+    assert fair_share.usage() == {}
@@ -0,0 +1,83 @@
+import os
+import threading
+from shutil import rmtree
+
+import pytest
+from broker.core.logs import LogStorage
+
+
+@pytest.fixture
+def storage():
+    os.makedirs("/tmp/logs")
+    yield LogStorage("/tmp/logs", block_size=16)
+    rmtree("/tmp/logs")
+
+
+def read(storage, name, start=0, end=None):
+    return b"".join(storage.read(name, start, end))
+
+
+def test_append(storage):
+    assert not storage.exists("log")
+    assert storage.size("log") == 0
+    assert storage.append("log", b"line 1\n") == 7
+    assert storage.append("log", b"line 2\nline 3\nline 4\n") == 28
+    assert storage.exists("log")
+    assert storage.size("log") == 28
+    # full blocks are compressed
+    assert os.path.getsize("/tmp/logs/log.idx") > 0
+    assert read(storage, "log") == b"line 1\nline 2\nline 3\nline 4\n"
+
+def test_read_range(storage):
+    data = b"".join(f"line {i}\n".encode() for i in range(100))
+    for i in range(0, len(data), 10):
+        storage.append("log", data[i:i + 10])
+    assert read(storage, "log") == data
+    for start, end in [(0, 1), (5, 40), (16, 32), (100, 700), (695, 700), (3, None)]:
+        assert read(storage, "log", start, end) == data[start:end]
+
+def test_tail_offset(storage):
+    data = b"".join(f"line {i}\n".encode() for i in range(100))
+    storage.append("log", data)
+    assert data[storage.tail_offset("log", 1):] == b"line 99\n"
+    assert data[storage.tail_offset("log", 3):] == b"line 97\nline 98\nline 99\n"
+    assert storage.tail_offset("log", 1000) == 0
+    assert storage.tail_offset("log", 0) == len(data)
+    storage.append("log", b"no newline")
+    assert read(storage, "log", storage.tail_offset("log", 2)) == b"line 99\nno newline"
+
+def test_upgrade(storage):
+    with open("/tmp/logs/raw", "wb") as raw:
+        raw.write(b"a" * 40)
+    assert storage.size("raw") == 40
+    assert read(storage, "raw") == b"a" * 40
+    assert not os.path.exists("/tmp/logs/raw")
+
+def test_upgrade_concurrent(storage):
+    content = b"".join(b"line %i\n" % i for i in range(1000))
+    with open("/tmp/logs/raw", "wb") as raw:
+        raw.write(content)
+    barrier = threading.Barrier(8)
+
+    def first_read():
+        barrier.wait()
+        storage.size("raw")
+    threads = [threading.Thread(target=first_read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert read(storage, "raw") == content
+
+    # a conversion that was interrupted is done again
+    storage.remove("raw")
+    storage.append("raw", content[:100])
+    with open("/tmp/logs/raw", "wb") as raw:
+        raw.write(content)
+    assert storage.size("raw") == len(content)
+    assert read(storage, "raw") == content
+
+def test_remove(storage):
+    storage.append("log", b"a" * 40)
+    storage.remove("log")
+    assert os.listdir("/tmp/logs") == []
@@ -0,0 +1,65 @@
+import os
+from shutil import copyfile
+
+import pytest
+
+from broker.core.logs import LogStorage
+from broker.core.metrics import Counter, Histogram, Metrics
+from broker.core.models import Job
+from broker.core.scheduling import Scheduler
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    copyfile("tests/test_data/data.db", "tests/test_data/backup")
+    scheduler = Scheduler("tests/test_data/data.db")
+    yield Metrics(scheduler, LogStorage(str(tmp_path)))
+    scheduler.db_manager.close()
+    os.remove("tests/test_data/data.db")
+    os.rename("tests/test_data/backup", "tests/test_data/data.db")
+
+
+def test_counter():
+    counter = Counter("requests_total", "Requests.", ("route",))
+    counter.inc("/jobs")
+    counter.inc("/jobs")
+    counter.inc('/a"b')
+    assert counter.render() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 1',
+        'requests_total{route="/jobs"} 2',
+    ]
+
+def test_histogram():
+    histogram = Histogram("latency_seconds", "Latency.", (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+def test_transitions(metrics):
+    scheduler = metrics.schedule
+    # only transitions made after the metrics were created are recorded
+    metrics.collect_transitions()
+    assert "broker_job_wait_seconds_count" not in metrics.render()
+
+    scheduler.add_job(Job.from_payload({"user": "a", "description": "b", "command": "c"}))
+    assert scheduler.claim_next("gpu-box").identifier == 4
+    assert scheduler.claim_next("gpu-box").identifier == 5
+    scheduler.update_job_status(4, "DONE")
+    text = metrics.render()
+    assert "broker_job_wait_seconds_count 2" in text
+    assert 'broker_job_run_seconds_count{status="DONE"} 1' in text
+    assert 'broker_jobs{status="RUNNING"} 2' in text
+    assert 'broker_jobs{status="WAITING"} 2' in text
+    assert "broker_ready_queue_jobs 2" in text
+    assert "broker_active_runners 1" in text
+
+    # transitions are recorded once
+    assert "broker_job_wait_seconds_count 2" in metrics.render()
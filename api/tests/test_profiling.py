@@ -0,0 +1,59 @@
+import logging
+
+import pytest
+
+from broker.core.database import DataBaseManager
+from broker.core.profiling import QueryProfiler, fingerprint
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    db_manager = DataBaseManager(str(tmp_path / "data.db"))
+    yield db_manager
+    db_manager.close()
+
+
+def test_fingerprint():
+    assert fingerprint(
+        "SELECT jobs.identifier\nFROM jobs\nWHERE jobs.status IN (?, ?, ?) LIMIT 10"
+    ) == "SELECT jobs.identifier FROM jobs WHERE jobs.status IN (?, ...) LIMIT ?"
+    assert fingerprint("PRAGMA user_version = 7") == "PRAGMA user_version = ?"
+    assert fingerprint("SELECT * FROM jobs WHERE user = 'a''b'") \
+        == "SELECT * FROM jobs WHERE user = ?"
+
+def test_profiler(db_manager):
+    profiler = QueryProfiler(slow_query=None)
+    profiler.attach(db_manager.engine)
+    profiler.start_request()
+    db_manager.get_job_by_id(1)
+    db_manager.get_job_by_id(2)
+    queries, seconds = profiler.end_request("GET /jobs/<int:job_id>")
+    assert queries == 2
+    assert seconds > 0
+
+    # statements that only differ by their parameters are aggregated
+    top = profiler.top(order_by="count")
+    assert top[0]["count"] == 2
+    assert "jobs.identifier = ?" in top[0]["statement"]
+    assert profiler.routes() == [{
+        "route": "GET /jobs/<int:job_id>",
+        "requests": 1,
+        "queries_mean": 2,
+        "queries_max": 2,
+        "seconds_mean": seconds,
+        "seconds_total": seconds,
+    }]
+
+    # statements outside of requests are not counted for a route
+    db_manager.get_n_jobs()
+    assert profiler.routes()[0]["queries_max"] == 2
+    profiler.reset()
+    assert profiler.top() == []
+
+def test_slow_queries(db_manager, caplog):
+    profiler = QueryProfiler(slow_query=0)
+    profiler.attach(db_manager.engine)
+    with caplog.at_level(logging.WARNING, logger="broker.core.profiling"):
+        db_manager.select_jobs_by(status=2)
+    assert "Slow statement" in caplog.text
+    assert "ix_jobs_status" in caplog.text
@@ -0,0 +1,114 @@
+import threading
+from time import time
+
+from broker.core.queues import ReadyQueue, TimerHeap
+
+
+def test_fifo():
+    queue = ReadyQueue()
+    for identifier in (3, 1, 2):
+        queue.push(identifier)
+    assert len(queue) == 3
+    assert queue.peek() == 1
+    assert [queue.pop() for _ in range(4)] == [1, 2, 3, None]
+
+def test_remove():
+    queue = ReadyQueue()
+    for identifier in range(5):
+        queue.push(identifier)
+    queue.remove(0)
+    queue.remove(3)
+    queue.remove(42)
+    assert 3 not in queue
+    assert queue.identifiers() == {1, 2, 4}
+    assert [queue.pop() for _ in range(3)] == [1, 2, 4]
+
+def test_rekey():
+    queue = ReadyQueue()
+    queue.push(1)
+    queue.push(2)
+    queue.push(2, key=0)
+    assert queue.peek() == 2
+    queue.push(2, key=5)
+    assert [queue.pop() for _ in range(3)] == [1, 2, None]
+
+def test_compact():
+    queue = ReadyQueue()
+    for _ in range(1000):
+        queue.push(1)
+        queue.push(2)
+    assert queue._size < 100
+    assert [queue.pop() for _ in range(3)] == [1, 2, None]
+
+def test_pop_timeout():
+    queue = ReadyQueue()
+    start = time()
+    assert queue.pop(timeout=0.1) is None
+    assert time() - start >= 0.1
+
+    timer = threading.Timer(0.1, queue.push, args=(1,))
+    timer.start()
+    start = time()
+    assert queue.pop(timeout=5) == 1
+    assert time() - start < 1
+    timer.join()
+
+def test_shapes():
+    queue = ReadyQueue()
+    queue.push(1, shape=(2,))
+    queue.push(2, shape=(1,))
+    queue.push(3, shape=(1,))
+    # FIFO by default
+    assert queue.peek() == 1
+    # shapes that can't be served are skipped
+    assert queue.peek(rank=lambda shape: None if shape[0] > 1 else 0) == 2
+    # lowest rank first, then by key
+    assert queue.pop(rank=lambda shape: -shape[0]) == 1
+    assert queue.pop(rank=lambda shape: -shape[0]) == 2
+    queue.remove(3)
+    assert queue.pop() is None
+    assert queue._heaps == {}
+
+def test_groups():
+    queue = ReadyQueue()
+    queue.push(1, group="a")
+    queue.push(2, group="a")
+    queue.push(3, group="b")
+    assert queue.peek() == 1
+    assert queue.peek(offsets={"a": 5}) == 3
+    assert queue.peek(offsets={"a": 1.5}) == 1
+    assert [queue.pop(offsets={"a": 2.5}) for _ in range(4)] == [3, 1, 2, None]
+
+def test_timers():
+    timers = TimerHeap()
+    timers.push(1, 30)
+    timers.push(2, 10)
+    timers.push(3, 20)
+    timers.push(2, 40)
+    timers.remove(3)
+    assert len(timers) == 2
+    assert timers.next_due() == 30
+    assert timers.pop_due(now=35) == [1]
+    assert timers.pop_due(now=35) == []
+    assert timers.pop_due(now=40) == [2]
+    assert timers.next_due() is None
+
+def test_timers_wait():
+    timers = TimerHeap()
+    stop = threading.Event()
+    thread = threading.Thread(target=timers.wait, args=(stop,))
+    thread.start()
+    start = time()
+    timers.push(1, start + 60)
+    timers.push(2, start + 0.2)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert 0.2 <= time() - start < 2
+    assert timers.pop_due() == [2]
+
+    thread = threading.Thread(target=timers.wait, args=(stop,))
+    thread.start()
+    stop.set()
+    timers.interrupt()
+    thread.join(5)
+    assert not thread.is_alive()
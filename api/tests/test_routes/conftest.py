@@ -0,0 +1,27 @@
+import os
+from shutil import copyfile, rmtree
+
+import pytest
+
+from broker import create_app
+from broker.config import TestConfig
+
+
+@pytest.fixture(autouse=True, scope="package")
+def backup():
+    # before
+    copyfile("tests/test_data/data.db", "tests/test_data/routes_backup")
+    os.makedirs(TestConfig.STORAGE_URI)
+    yield
+    # after
+    os.rename("tests/test_data/routes_backup", "tests/test_data/data.db")
+    rmtree(TestConfig.STORAGE_URI)
+
+@pytest.fixture(scope="package")
+def client(backup):
+    _app = create_app(TestConfig)
+    client = _app.test_client()
+    yield client
+    _app.schedule.db_manager.close()
+    _app.archive.close()
+    os.remove(TestConfig.ARCHIVE_URI)
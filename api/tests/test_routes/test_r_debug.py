@@ -0,0 +1,24 @@
+import logging
+
+
+logging.basicConfig(level=logging.ERROR)
+
+
+def test_get_queries(client):
+    response = client.get("/jobs/1")
+    assert int(response.headers["X-DB-Queries"]) > 0
+    assert float(response.headers["X-DB-Time"]) > 0
+
+    response = client.get("/debug/queries?order_by=unknown")
+    assert response.status_code == 400
+    response = client.get("/debug/queries?limit=1&order_by=count")
+    assert response.status_code == 200
+    assert len(response.get_json()["statements"]) == 1
+    routes = {r["route"]: r for r in response.get_json()["routes"]}
+    assert routes["GET /jobs/<int:job_id>"]["requests"] == 1
+
+    response = client.get("/debug/queries?reset")
+    assert response.status_code == 200
+    response = client.get("/debug/queries")
+    # only the reset request was recorded since
+    assert [r["route"] for r in response.get_json()["routes"]] == ["GET /debug/queries"]
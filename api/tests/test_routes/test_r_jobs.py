@@ -1,23 +1,12 @@
-import os
-import io
+import json
 import logging
-from shutil import copyfile
 
-import pytest
+from sqlalchemy import event
 
 
 logging.basicConfig(level=logging.ERROR)
 
 
-@pytest.fixture(autouse=True, scope="session")
-def backup():
-    # before
-    copyfile("tests/test_data/data.db", "tests/test_data/backup")
-    yield
-    # after
-    os.rename("tests/test_data/backup", "tests/test_data/data.db")
-        
-
 def test_append_job(client):
     response = client.post(
         "/jobs",
@@ -45,6 +34,111 @@ def test_get_jobs(client):
     assert response.status_code == 200
     assert len(response.get_json()) == 6
 
+def test_get_jobs_paginated(client):
+    response = client.get("/jobs?limit=4")
+    assert [job["identifier"] for job in response.get_json()] == [1, 2, 4, 5]
+    assert response.headers["Link"] == '</jobs?limit=4&after=5>; rel="next"'
+    response = client.get("/jobs?limit=4&after=5")
+    assert [job["identifier"] for job in response.get_json()] == [6, 7]
+    assert "Link" not in response.headers
+
+def test_get_jobs_filtered(client):
+    response = client.get("/jobs?status=WAITING")
+    assert [job["identifier"] for job in response.get_json()] == [4, 5, 6, 7]
+    response = client.get("/jobs?status=2&user=CocaCola")
+    assert [job["identifier"] for job in response.get_json()] == [7]
+    response = client.get("/jobs?since=1599418816.465")
+    assert [job["identifier"] for job in response.get_json()] == [5, 6, 7]
+    response = client.get("/jobs?status=nothing")
+    assert response.status_code == 400
+    response = client.get("/jobs?limit=0")
+    assert response.status_code == 400
+
+def test_get_jobs_projected(client):
+    response = client.get("/jobs?fields=identifier,status")
+    assert response.get_json()[0] == {"identifier": 1, "status": 5}
+    response = client.get("/jobs?fields=identifier,password")
+    assert response.status_code == 400
+
+def test_append_jobs(client):
+    jobs = [
+        {"user": "Fanta", "description": f"Sweep {i}", "command": f"train --lr {i}"}
+        for i in range(3)
+    ]
+    response = client.post("/jobs/batch", json=jobs)
+    assert response.status_code == 201
+    identifiers = response.get_json()["identifiers"]
+    assert identifiers == [8, 9, 10]
+    response = client.post(
+        "/jobs/batch",
+        data="\n".join(json.dumps(job) for job in jobs) + "\n",
+        content_type="application/x-ndjson",
+    )
+    assert response.status_code == 201
+    identifiers += response.get_json()["identifiers"]
+    assert identifiers == [8, 9, 10, 11, 12, 13]
+    response = client.get("/jobs?user=Fanta&status=WAITING&fields=description")
+    assert [job["description"] for job in response.get_json()] == ["Sweep 0", "Sweep 1", "Sweep 2"] * 2
+
+    response = client.post("/jobs/batch", json=[jobs[0], {"user": "Fanta"}])
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid job at index 1"
+    response = client.post("/jobs/batch", data="{not json")
+    assert response.status_code == 400
+    response = client.post("/jobs/batch", json=[dict(jobs[0], cron="every day")])
+    assert response.status_code == 400
+    response = client.post("/jobs/batch", json=[dict(jobs[0], cron="0 3 * * *")])
+    recurring = response.get_json()["identifiers"][0]
+    data = client.get(f"/jobs/{recurring}").get_json()
+    assert data["status"] == 1 and data["cron"] == "0 3 * * *"
+    assert data["run_at"] > data["epoch_received"]
+    identifiers.append(recurring)
+    for identifier in identifiers:
+        client.delete(f"/jobs/{identifier}")
+
+def test_get_job(client):
+    response = client.get("/jobs/4")
+    assert response.status_code == 200
+    assert response.get_json()["user"] == "jim@mail.com"
+    response = client.get("/jobs/1000")
+    assert response.status_code == 404
+
+def test_get_stats(client):
+    response = client.get("/jobs/stats")
+    assert response.status_code == 200
+    stats = response.get_json()
+    assert stats["n_jobs"] == 6
+    assert stats["n_users"] == 6
+    assert stats["status"]["WAITING"] == 4
+    assert stats["status"]["DONE"] == 1
+
+def test_etags(client):
+    statements = []
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+    engine = client.application.schedule.db_manager.engine
+    event.listen(engine, "before_cursor_execute", count)
+
+    response = client.get("/jobs?limit=2")
+    etag = response.headers["ETag"]
+    n_statements = len(statements)
+    assert client.get("/jobs/stats").headers["ETag"] == etag
+    # not modified, the database is not read
+    response = client.get("/jobs?limit=2", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    # served from the cache
+    response = client.get("/jobs?limit=2")
+    assert response.get_json()[0]["identifier"] == 1
+    assert "X-Last-Event-ID" in response.headers
+    assert len(statements) == n_statements
+
+    client.put("/runners/update-job", json={"identifier": 4, "status": "WAITING"})
+    response = client.get("/jobs?limit=2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    event.remove(engine, "before_cursor_execute", count)
+
 def test_add_logfile(client):
     response = client.post("/jobs/1/logs")
     assert response.status_code == 400
@@ -55,3 +149,69 @@ def test_get_logfile(client):
 
     response = client.get("/jobs/1000/logs")
     assert response.status_code == 404
+
+def test_append_logfile(client):
+    response = client.post("/jobs/1000/logs/append?offset=0", data=b"hello ")
+    assert response.status_code == 404
+    response = client.post("/jobs/2/logs/append?offset=0", data=b"hello ")
+    assert response.status_code == 200
+    assert response.get_json()["size"] == 6
+    # chunks that were already received are skipped
+    response = client.post("/jobs/2/logs/append?offset=0", data=b"hello ")
+    assert response.get_json()["size"] == 6
+    response = client.post("/jobs/2/logs/append?offset=3", data=b"lo world")
+    assert response.get_json()["size"] == 11
+    # chunks can't leave holes in the log
+    response = client.post("/jobs/2/logs/append?offset=20", data=b"!")
+    assert response.status_code == 409
+    assert response.get_json()["size"] == 11
+    response = client.post("/jobs/2/logs/append", data=b"!")
+    assert response.get_json()["size"] == 12
+
+    response = client.get("/jobs/2/logs")
+    assert response.status_code == 200
+    assert response.data == b"hello world!"
+
+def test_get_logfile_parts(client, monkeypatch):
+    response = client.get("/jobs/2/logs?offset=6")
+    assert response.data == b"world!"
+    assert response.headers["X-Log-Offset"] == "12"
+
+    client.post("/jobs/2/logs/append", data=b"\nline 2\nline 3\n")
+    response = client.get("/jobs/2/logs?tail=2")
+    assert response.data == b"line 2\nline 3\n"
+
+    response = client.get("/jobs/2/logs", headers={"Range": "bytes=0-4"})
+    assert response.status_code == 206
+    assert response.data == b"hello"
+    assert response.headers["Content-Range"] == "bytes 0-4/27"
+    response = client.get("/jobs/2/logs", headers={"Range": "bytes=-7"})
+    assert response.data == b"line 3\n"
+    response = client.get("/jobs/2/logs", headers={"Range": "bytes=100-"})
+    assert response.status_code == 416
+
+    response = client.get("/jobs/2/logs?offset=20&follow")
+    assert response.data == b"line 3\n"
+    monkeypatch.setattr("broker.routes.jobs.MAX_FOLLOW", 0.1)
+    response = client.get("/jobs/2/logs?offset=27&follow")
+    assert response.data == b""
+    assert response.headers["X-Log-Offset"] == "27"
+
+def test_dependencies(client):
+    payload = {"user": "Fanta", "description": "Evaluate", "command": "evaluate"}
+    response = client.post("/jobs", json=dict(payload, dependencies=[1000]))
+    assert response.status_code == 404
+    response = client.post("/jobs/batch", json=[dict(payload, dependencies=[1000])])
+    assert response.status_code == 404
+    response = client.post("/jobs", json=dict(payload, dependencies=[{"job": 1, "on": "completion"}]))
+    assert response.status_code == 201
+    identifier = response.get_json()["identifier"]
+
+    response = client.get(f"/jobs/{identifier}/dependencies")
+    assert response.get_json() == {
+        "parents": [{"job_id": identifier, "parent_id": 1, "on": "completion", "resolved": True}],
+        "children": [],
+    }
+    assert client.get("/jobs/1/dependencies").get_json()["children"][0]["job_id"] == identifier
+    assert client.get("/jobs/1000/dependencies").status_code == 404
+    client.delete(f"/jobs/{identifier}")
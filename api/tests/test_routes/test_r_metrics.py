@@ -0,0 +1,20 @@
+import logging
+
+
+logging.basicConfig(level=logging.ERROR)
+
+
+def test_metrics(client):
+    client.get("/jobs/1")
+    client.get("/jobs/999999")
+    client.get("/no-such-route")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert 'broker_http_requests_total{method="GET",route="/jobs/<int:job_id>",status="200"}' in text
+    assert 'broker_http_requests_total{method="GET",route="/jobs/<int:job_id>",status="404"}' in text
+    assert 'broker_http_requests_total{method="GET",route="<unmatched>",status="404"} 1' in text
+    assert 'broker_http_request_duration_seconds_bucket{method="GET",route="/jobs/<int:job_id>",le="+Inf"}' in text
+    assert 'broker_jobs{status="WAITING"}' in text
+    assert "broker_log_storage_bytes" in text
@@ -0,0 +1,29 @@
+import logging
+
+
+logging.basicConfig(level=logging.ERROR)
+
+
+def test_archive_jobs(client):
+    app = client.application
+    assert client.get("/archive/jobs").get_json() == []
+    assert app.schedule.archive_jobs(app.archive, max_age=10 ** 10) == []
+    assert app.schedule.archive_jobs(app.archive, max_count=0) == [1, 2]
+
+    # only finished jobs are archived
+    response = client.get("/jobs?fields=status")
+    assert [job["status"] for job in response.get_json()] == [2, 2, 2, 2]
+    response = client.get("/archive/jobs?fields=user,status,events")
+    assert [job["identifier"] for job in response.get_json()] == [1, 2]
+    assert [len(job["events"]) for job in response.get_json()] == [3, 3]
+    response = client.get("/archive/jobs?limit=1")
+    assert response.headers["Link"] == '</archive/jobs?limit=1&after=1>; rel="next"'
+
+    response = client.get("/archive/jobs/2")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == 4
+    assert client.get("/archive/jobs/4").status_code == 404
+    assert client.get("/jobs/2").status_code == 404
+    # logs of archived jobs are kept
+    response = client.get("/jobs/2/logs?offset=6")
+    assert response.data.startswith(b"world!")
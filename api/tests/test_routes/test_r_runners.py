@@ -20,6 +20,23 @@ def test_get_next_job(client):
     assert response.status_code == 200
     assert response.get_json()["identifier"] == 4
 
+def test_claim_job(client):
+    response = client.post("/runners/claim-job", json={})
+    assert response.status_code == 400
+    response = client.post("/runners/claim-job", json={"runner": "gpu-box", "capacity": {"gpus": -1}})
+    assert response.status_code == 400
+    response = client.post("/runners/claim-job", json={"runner": "gpu-box", "capacity": []})
+    assert response.status_code == 400
+    response = client.post("/runners/claim-job", json={"runner": "gpu-box"})
+    assert response.status_code == 200
+    assert response.get_json()["identifier"] == 4
+    assert response.get_json()["status"] == 3
+    assert response.get_json()["runner"] == "gpu-box"
+
+    # a claimed job is not available anymore
+    response = client.get("/runners/available-job")
+    assert response.get_json()["identifier"] == 5
+
 def test_update_job_status(client):
     response = client.put(
         "/runners/update-job",
@@ -71,6 +88,70 @@ def test_update_job_status(client):
     )
     assert response.status_code == 204 
 
+def test_update_jobs(client):
+    response = client.post("/runners/update-jobs", json={"updates": []})
+    assert response.status_code == 400
+    response = client.post("/runners/update-jobs", json={"runner": "gpu-box", "updates": [{}]})
+    assert response.status_code == 400
+    response = client.post(
+        "/runners/update-jobs",
+        json={"runner": "gpu-box", "updates": [{"identifier": 4, "status": "nothing"}]}
+    )
+    assert response.status_code == 400
+    client.post("/jobs", json={"user": "Sprite", "description": "Lemon", "command": "sip"})
+    identifier = client.post("/runners/claim-job", json={"runner": "cpu-box"}).get_json()["identifier"]
+    response = client.post(
+        "/runners/update-jobs",
+        json={"runner": "cpu-box", "updates": [
+            {"identifier": identifier, "progress": 0.5},
+            {"identifier": 1000},
+            {"identifier": 5, "status": "TERMINATED"},
+        ]}
+    )
+    assert response.status_code == 200
+    # job 5 is not held by this runner
+    assert response.get_json() == {"missing": [1000], "lost": [5]}
+    job = client.get(f"/jobs?after={identifier - 1}&limit=1").get_json()[0]
+    assert job["progress"] == 0.5
+    assert job["last_heartbeat"] is not None
+    assert job["lease_expiry"] > job["last_heartbeat"]
+    assert job["attempts"] == 1
+
+    response = client.get("/runners")
+    assert response.status_code == 200
+    runners = {runner["identifier"]: runner for runner in response.get_json()}
+    assert runners["cpu-box"]["jobs"] == [identifier]
+    assert runners["gpu-box"]["jobs"] == []
+
+    response = client.post(
+        "/runners/update-jobs",
+        json={"runner": "cpu-box", "updates": [{"identifier": identifier, "usage": [[1, 2]]}]}
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/runners/update-jobs",
+        json={"runner": "cpu-box", "updates": [{
+            "identifier": identifier, "status": "DONE",
+            "usage": [[1000.0, 1.5, 512, 0, 4096, 0], [1005.0, 0.5, 1024, 0, 8192, 10]],
+        }]}
+    )
+    assert response.get_json() == {"missing": [], "lost": []}
+    response = client.get(f"/jobs/{identifier}/usage")
+    assert response.status_code == 200
+    summary = response.get_json()["summary"]
+    assert summary["cpu"] == {"avg": 1, "peak": 1.5}
+    assert summary["rss"]["peak"] == 1024
+    assert summary["read_bytes"] == 8192
+    assert len(response.get_json()["points"]) == 1
+    assert client.get("/jobs/1000/usage").status_code == 404
+    job = client.get(f"/jobs?after={identifier - 1}&limit=1").get_json()[0]
+    assert job["status"] == 5
+    assert job["lease_expiry"] is None
+
 def test_get_next_job_none(client):
     response = client.get("/runners/available-job")
     assert response.status_code == 204
+    response = client.get("/runners/available-job?wait=0.1")
+    assert response.status_code == 204
+    response = client.post("/runners/claim-job?wait=0.1", json={"runner": "gpu-box"})
+    assert response.status_code == 204
@@ -0,0 +1,63 @@
+import json
+import logging
+
+logging.basicConfig(level=logging.ERROR)
+
+
+def parse_events(response):
+    res = []
+    for message in response.get_data(as_text=True).split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in message.split("\n")
+            if line and not line.startswith(":")
+        )
+        if "event" in fields:
+            res.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return res
+
+def test_stream_events(client, monkeypatch):
+    monkeypatch.setattr("broker.routes.events.MAX_STREAM", 0.2)
+    monkeypatch.setattr("broker.routes.events.KEEPALIVE", 0.1)
+    after = int(client.get("/jobs").headers["X-Last-Event-ID"])
+    response = client.post(
+        "/jobs",
+        json={"user": "Pepsi", "description": "Another drink", "command": "sip"}
+    )
+    identifier = response.get_json()["identifier"]
+    client.put("/runners/update-job", json={"identifier": identifier, "status": "RUNNING"})
+    client.delete(f"/jobs/{identifier}")
+
+    response = client.get(f"/events/stream?after={after}")
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    changes = parse_events(response)
+    assert [(c[1], c[2]["identifier"]) for c in changes] == [
+        ("created", identifier), ("updated", identifier), ("removed", identifier),
+    ]
+    assert changes[0][2]["user"] == "Pepsi"
+    assert changes[1][2]["status"] == 3
+
+    # Resume from the last change received
+    response = client.get("/events/stream", headers={"Last-Event-ID": changes[0][0]})
+    assert [c[1] for c in parse_events(response)] == ["updated", "removed"]
+    # Only new changes by default
+    assert parse_events(client.get("/events/stream")) == []
+
+def test_stream_reset(client, monkeypatch):
+    monkeypatch.setattr("broker.routes.events.MAX_STREAM", 0.2)
+    monkeypatch.setattr("broker.routes.events.KEEPALIVE", 0.1)
+    after = int(client.get("/jobs").headers["X-Last-Event-ID"])
+    for _ in range(2):
+        client.post(
+            "/jobs",
+            json={"user": "Pepsi", "description": "Another drink", "command": "sip"}
+        )
+    last = int(client.get("/jobs").headers["X-Last-Event-ID"])
+    client.application.schedule.prune_changes(max_count=1)
+
+    # The client missed a deleted change, it loads the jobs again
+    changes = parse_events(client.get(f"/events/stream?after={after}"))
+    assert changes == [(last, "reset", {})]
+    # Up to date clients just resume
+    assert parse_events(client.get(f"/events/stream?after={last - 1}"))[0][:2] == (
+        last, "created")
@@ -1,10 +1,17 @@
 import pytest
+import json
 import os
 from shutil import copyfile
 import logging
+import threading
+from time import time, sleep
 from os.path import isfile
-from broker.core.scheduling import Scheduler
+from broker.config import Config
+from broker.core.scheduling import Scheduler, fit_rank
 from broker.core.models import Job
+from broker.core.utils import JobStatus
+from broker.core.database import DataBaseManager
+from broker.core.logs import LogStorage
 
 
 logging.basicConfig(level=logging.ERROR)
@@ -16,20 +23,26 @@ logging.basicConfig(level=logging.ERROR)
 @pytest.fixture
 def warm_scheduler():
     copyfile("tests/test_data/data.db", "tests/test_data/backup")
-    yield Scheduler("tests/test_data/data.db")
+    scheduler = Scheduler("tests/test_data/data.db")
+    yield scheduler
+    scheduler.db_manager.close()
     os.remove("tests/test_data/data.db")
     os.rename("tests/test_data/backup", "tests/test_data/data.db")
 
 @pytest.fixture
 def warm_empty_scheduler():
     copyfile("tests/test_data/empty.db", "tests/test_data/empty_backup")
-    yield Scheduler("tests/test_data/empty.db")
+    scheduler = Scheduler("tests/test_data/empty.db")
+    yield scheduler
+    scheduler.db_manager.close()
     os.remove("tests/test_data/empty.db")
     os.rename("tests/test_data/empty_backup", "tests/test_data/empty.db")
 
 @pytest.fixture
 def cold_scheduler():
-    yield Scheduler("/tmp/no.db")
+    scheduler = Scheduler("/tmp/no.db")
+    yield scheduler
+    scheduler.db_manager.close()
     os.remove("/tmp/no.db")
 
 ########################################################################################
@@ -78,3 +91,521 @@ def test_get_jobs(warm_scheduler):
 def test_get_next(warm_scheduler):
     assert warm_scheduler.get_next().user == "jim@mail.com"
 
+
+def test_claim_next(warm_scheduler):
+    job = warm_scheduler.claim_next("runner-0")
+    assert job.identifier == 4
+    assert job.runner == "runner-0"
+    assert warm_scheduler.get_job_status(4) == 3
+    assert warm_scheduler.get_next().identifier == 5
+
+def test_claim_next_concurrent(cold_scheduler):
+    payload = {
+        "user": "RyanTheTemp",
+        "command": "ls /tmp",
+        "description": "Unix joke"
+    }
+    for _ in range(200):
+        cold_scheduler.add_job(Job.from_payload(payload))
+    claimed = []
+    barrier = threading.Barrier(16)
+
+    def runner(name):
+        barrier.wait()
+        job = cold_scheduler.claim_next(name)
+        while job is not None:
+            claimed.append((job.identifier, name))
+            job = cold_scheduler.claim_next(name)
+        cold_scheduler.db_manager.session.remove()
+
+    threads = [threading.Thread(target=runner, args=(f"runner-{i}",)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(identifier for identifier, _ in claimed) == list(range(1, 201))
+    assert cold_scheduler.get_next() is None
+    for identifier, name in claimed:
+        job = cold_scheduler.get_job_by_id(identifier)
+        assert job.runner == name
+        assert [e.status for e in job.events] == [2, 3]
+
+def test_queue(warm_scheduler):
+    assert warm_scheduler.check_queue() == (set(), set())
+    assert len(warm_scheduler.queue) == 3
+    warm_scheduler.update_job_status(4, "RUNNING")
+    assert warm_scheduler.get_next().identifier == 5
+    warm_scheduler.remove_job(5)
+    assert warm_scheduler.get_next().identifier == 6
+    warm_scheduler.update_job_status(1, "WAITING")
+    assert warm_scheduler.get_next().identifier == 1
+    assert warm_scheduler.check_queue() == (set(), set())
+
+    # out of band changes are detected
+    warm_scheduler.db_manager.update_job(6, status=3)
+    warm_scheduler.db_manager.update_job(2, status=2)
+    assert warm_scheduler.check_queue() == ({2}, {6})
+    warm_scheduler.rebuild_queue()
+    assert warm_scheduler.check_queue() == (set(), set())
+
+def test_claim_next_long_polling(cold_scheduler):
+    payload = {
+        "user": "RyanTheTemp",
+        "command": "ls /tmp",
+        "description": "Unix joke"
+    }
+    assert cold_scheduler.claim_next("runner-0", timeout=0.1) is None
+
+    def add_job():
+        cold_scheduler.add_job(Job.from_payload(payload))
+        cold_scheduler.db_manager.session.remove()
+
+    timer = threading.Timer(0.2, add_job)
+    timer.start()
+    start = time()
+    job = cold_scheduler.claim_next("runner-0", timeout=5)
+    assert job.identifier == 1
+    assert time() - start < 2
+    timer.join()
+
+def test_fit_rank():
+    rank = fit_rank({"gpus": 2, "gpu_memory": 16000, "cpus": 8, "memory": 32000})
+    assert rank((3, 0, 0, 0)) is None
+    assert rank((0, 0, 0, 64000)) is None
+    assert rank((2, 16000, 8, 32000)) == 0
+    assert rank((1, 8000, 4, 16000)) < rank((1, 4000, 1, 1000)) < rank((0, 0, 0, 0))
+
+def test_claim_next_capacity(cold_scheduler):
+    def add_job(**resources):
+        cold_scheduler.add_job(Job.from_payload(dict(
+            user="RyanTheTemp", command="ls /tmp", description="Unix joke", **resources
+        )))
+
+    add_job(gpus=2, gpu_memory=40000)
+    add_job(gpus=1, gpu_memory=8000, memory=4000)
+    add_job(gpus=1, gpu_memory=12000, memory=4000)
+    add_job(cpus=2)
+
+    capacity = {"gpus": 2, "gpu_memory": 24000, "cpus": 8, "memory": 64000}
+    job = cold_scheduler.claim_next("runner-0", capacity=capacity)
+    assert job.identifier == 3
+    capacity = {"gpus": 1, "gpu_memory": 12000, "cpus": 8, "memory": 60000}
+    assert cold_scheduler.claim_next("runner-0", capacity=capacity).identifier == 2
+    capacity = {"gpus": 0, "gpu_memory": 4000, "cpus": 8, "memory": 56000}
+    assert cold_scheduler.claim_next("runner-0", capacity=capacity).identifier == 4
+    assert cold_scheduler.claim_next("runner-0", capacity=capacity) is None
+    # without capacity, the queue is FIFO
+    assert cold_scheduler.claim_next("runner-0").identifier == 1
+
+def test_wait_for_changes(cold_scheduler):
+    payload = {
+        "user": "RyanTheTemp",
+        "command": "ls /tmp",
+        "description": "Unix joke"
+    }
+    assert not cold_scheduler.wait_for_changes(0, timeout=0.1)
+
+    def add_job():
+        cold_scheduler.add_job(Job.from_payload(payload))
+        cold_scheduler.db_manager.session.remove()
+
+    timer = threading.Timer(0.2, add_job)
+    timer.start()
+    start = time()
+    assert cold_scheduler.wait_for_changes(0, timeout=5)
+    assert time() - start < 2
+    assert [c.kind for c in cold_scheduler.get_changes()] == ["created"]
+    timer.join()
+
+    # a slow read doesn't block the writers
+    get_change_bounds = cold_scheduler.db_manager.get_change_bounds
+    def slow_bounds():
+        sleep(0.5)
+        return get_change_bounds()
+    cold_scheduler.db_manager.get_change_bounds = slow_bounds
+    waiter = threading.Thread(target=cold_scheduler.wait_for_changes, args=(1, 1))
+    waiter.start()
+    sleep(0.1)
+    start = time()
+    cold_scheduler._notify_change()
+    assert time() - start < 0.2
+    waiter.join()
+
+def test_update_jobs(warm_scheduler):
+    with pytest.raises(ValueError):
+        warm_scheduler.update_jobs([{"identifier": 4, "status": "nothing"}])
+    missing, lost = warm_scheduler.update_jobs([
+        {"identifier": 4, "status": "RUNNING"},
+        {"identifier": 1, "status": 2, "progress": 0.25},
+        {"identifier": 1000, "status": "DONE"},
+    ])
+    assert (missing, lost) == ([1000], [])
+    assert warm_scheduler.get_job_status(4) == JobStatus.RUNNING.value
+    assert warm_scheduler.get_job_by_id(1).progress == 0.25
+    assert warm_scheduler.queue.identifiers() == {1, 5, 6}
+    assert warm_scheduler.check_queue() == (set(), set())
+
+def test_leases(cold_scheduler):
+    payload = {
+        "user": "RyanTheTemp",
+        "command": "ls /tmp",
+        "description": "Unix joke"
+    }
+    cold_scheduler.lease_duration = 0.2
+    cold_scheduler.max_attempts = 2
+    cold_scheduler.add_job(Job.from_payload(payload))
+    assert cold_scheduler.claim_next("runner-0").identifier == 1
+    assert cold_scheduler.expire_leases() == []
+
+    # heartbeats renew the lease, only from the runner holding the job
+    sleep(0.15)
+    assert cold_scheduler.update_jobs([{"identifier": 1}], runner="runner-0") == ([], [])
+    assert cold_scheduler.update_jobs([{"identifier": 1}], runner="runner-1") == ([], [1])
+    sleep(0.1)
+    assert cold_scheduler.expire_leases() == []
+
+    # a lost runner's job is requeued, then left UNKNOWN after max_attempts
+    sleep(0.2)
+    assert cold_scheduler.expire_leases() == [1]
+    assert cold_scheduler.get_job_status(1) == JobStatus.WAITING.value
+    assert [e.status for e in cold_scheduler.get_job_by_id(1).events] == [2, 3, 0, 2]
+    assert cold_scheduler.update_jobs([{"identifier": 1}], runner="runner-0") == ([], [1])
+    assert cold_scheduler.claim_next("runner-1").identifier == 1
+    sleep(0.25)
+    assert cold_scheduler.expire_leases() == [1]
+    assert cold_scheduler.get_job_status(1) == JobStatus.UNKNOWN.value
+    assert cold_scheduler.check_queue() == (set(), set())
+    assert [r["identifier"] for r in cold_scheduler.get_runners()] == ["runner-0", "runner-1"]
+
+def test_reaper(cold_scheduler, monkeypatch):
+    payload = dict(user="RyanTheTemp", command="ls", description="")
+    cold_scheduler.lease_duration = 0.1
+    cold_scheduler.add_job(Job.from_payload(payload))
+    cold_scheduler.claim_next("runner-0")
+    # a failure doesn't stop the thread
+    prune_changes = cold_scheduler.prune_changes
+    failures = []
+    def flaky_prune(**kwargs):
+        if not failures:
+            failures.append(kwargs)
+            raise RuntimeError("Database is locked")
+        return prune_changes(**kwargs)
+    monkeypatch.setattr(cold_scheduler, "prune_changes", flaky_prune)
+    cold_scheduler.start_reaper(0.05, max_count=1)
+    sleep(0.4)
+    cold_scheduler.stop_reaper()
+    assert failures == [{"max_count": 1}]
+    assert cold_scheduler.get_job_status(1) == JobStatus.WAITING.value
+    assert len(cold_scheduler.get_changes()) == 1
+
+def test_archive_jobs(warm_scheduler, tmp_path):
+    archive = DataBaseManager(str(tmp_path / "archive.db"))
+    logs = LogStorage(str(tmp_path))
+    filename = warm_scheduler.db_manager.add_logfile(2)
+    logs.append(filename, b"Hello")
+    version = warm_scheduler.version
+
+    assert warm_scheduler.archive_jobs(archive, max_count=0, batch_size=1, logs=logs) == [1]
+    assert warm_scheduler.archive_jobs(archive, max_count=0, batch_size=1, logs=logs) == [2]
+    assert warm_scheduler.archive_jobs(archive, max_count=0, batch_size=1, logs=logs) == []
+    assert warm_scheduler.version == version + 2
+    assert [j.identifier for j in archive.get_jobs()] == [1, 2]
+    assert archive.get_logfile(2) is None
+    assert not logs.exists(filename)
+    archive.close()
+
+def test_priority_and_fair_share(cold_scheduler):
+    def add_job(user, **kwargs):
+        job = Job.from_payload(dict(user=user, command="ls", description="Sweep", **kwargs))
+        cold_scheduler.add_job(job)
+        return job.identifier
+
+    sweep = [add_job("RyanTheTemp") for _ in range(3)]
+    other = add_job("Kelly")
+    urgent = add_job("RyanTheTemp", priority=1)
+    assert Job.from_payload(dict(user="a", command="ls", description="", priority="high")) is None
+    assert cold_scheduler.get_job_by_id(urgent).priority == 1
+
+    # higher priority first, then the running job counts against its user
+    assert cold_scheduler.claim_next("runner-0").identifier == urgent
+    assert cold_scheduler.claim_next("runner-0").identifier == other
+    assert cold_scheduler.claim_next("runner-0").identifier == sweep[0]
+    cold_scheduler.update_jobs([
+        {"identifier": i, "status": "DONE"} for i in (urgent, sweep[0], other)
+    ])
+    cold_scheduler.fair_share.add("RyanTheTemp", 3600, time())
+    assert cold_scheduler.offsets()["RyanTheTemp"] >= 3600
+    assert cold_scheduler.offsets()["Kelly"] < 1
+
+    # recent usage puts a user behind jobs submitted later by others, until
+    # it decays
+    cold_scheduler.fair_share.add("RyanTheTemp", 3600, time())
+    late = add_job("Kelly")
+    assert cold_scheduler.get_next().identifier == late
+    cold_scheduler.fair_share.clear()
+    assert cold_scheduler.get_next().identifier == sweep[1]
+
+def test_load_fair_share(cold_scheduler):
+    for user in ("RyanTheTemp", "Kelly"):
+        cold_scheduler.add_job(Job.from_payload(dict(user=user, command="ls", description="")))
+    cold_scheduler.claim_next("runner-0")
+    cold_scheduler.claim_next("runner-0")
+    cold_scheduler.update_jobs([{"identifier": 1, "status": "DONE"}])
+    usage = cold_scheduler.fair_share.usage()
+
+    scheduler = Scheduler("/tmp/no.db")
+    assert scheduler.fair_share.usage().keys() == {"RyanTheTemp", "Kelly"}
+    assert scheduler.fair_share.usage()["RyanTheTemp"] == pytest.approx(
+        usage["RyanTheTemp"], abs=0.1)
+    scheduler.db_manager.close()
+
+def test_sleeping_jobs(cold_scheduler):
+    now = time()
+    payload = dict(user="RyanTheTemp", command="ls", description="Later")
+    later = Job.from_payload(dict(payload, run_at=now + 3600))
+    cold_scheduler.add_job(later)
+    daily = Job.from_payload(dict(payload, cron="0 3 * * *"))
+    cold_scheduler.add_jobs([daily])
+    assert Job.from_payload(dict(payload, cron="0 3 * *")) is None
+    assert cold_scheduler.get_job_status(later.identifier) == JobStatus.SLEEPING.value
+    assert cold_scheduler.get_job_status(daily.identifier) == JobStatus.SLEEPING.value
+    assert cold_scheduler.get_next() is None
+    assert cold_scheduler.wake_jobs() == []
+
+    # a new scheduler finds the sleeping jobs in the database
+    scheduler = Scheduler("/tmp/no.db")
+    assert scheduler.timers.next_due() == pytest.approx(now + 3600)
+    assert scheduler.timers.next_due() < daily.run_at < now + 25 * 3600
+    scheduler.db_manager.close()
+
+    assert cold_scheduler.wake_jobs(now + 3600) == [later.identifier]
+    assert cold_scheduler.get_next().identifier == later.identifier
+    first_run = daily.run_at
+    occurrence = cold_scheduler.wake_jobs(first_run)
+    assert cold_scheduler.get_job_by_id(occurrence[0]).command == "ls"
+    assert cold_scheduler.get_job_status(daily.identifier) == JobStatus.SLEEPING.value
+    assert cold_scheduler.get_job_by_id(daily.identifier).run_at == pytest.approx(
+        first_run + 24 * 3600, abs=3600)
+    assert cold_scheduler.wake_jobs(first_run + 60) == []
+    assert cold_scheduler.check_queue() == (set(), set())
+
+    # removing a recurring job stops it
+    cold_scheduler.remove_job(daily.identifier)
+    assert cold_scheduler.timers.next_due() is None
+
+def test_timer(cold_scheduler):
+    cold_scheduler.start_timer()
+    try:
+        job = Job.from_payload(dict(
+            user="RyanTheTemp", command="ls", description="Soon", run_at=time() + 0.2))
+        cold_scheduler.add_job(job)
+        assert cold_scheduler.get_next() is None
+        assert cold_scheduler.get_next(timeout=5).identifier == job.identifier
+    finally:
+        cold_scheduler.stop_timer()
+
+def test_dependencies(cold_scheduler):
+    def add_job(**kwargs):
+        job = Job.from_payload(dict(user="RyanTheTemp", command="ls", description="", **kwargs))
+        cold_scheduler.add_job(job)
+        return job.identifier
+
+    def status(identifier):
+        return JobStatus(cold_scheduler.get_job_status(identifier)).name
+
+    preprocess = add_job()
+    train = add_job(dependencies=[preprocess])
+    evaluate = add_job(dependencies=[train])
+    cleanup = add_job(dependencies=[{"job": train, "on": "completion"}])
+    report = add_job(dependencies=[evaluate, {"job": cleanup, "on": "completion"}])
+    with pytest.raises(IndexError):
+        add_job(dependencies=[42])
+    assert Job.from_payload(dict(
+        user="a", command="ls", description="", dependencies=[{"job": 1, "on": "never"}]
+    )) is None
+    assert [status(i) for i in (train, evaluate, cleanup, report)] == ["SLEEPING"] * 4
+    assert cold_scheduler.get_job_by_id(report).pending_dependencies == 2
+
+    assert cold_scheduler.claim_next("runner-0").identifier == preprocess
+    assert cold_scheduler.claim_next("runner-0") is None
+    cold_scheduler.update_jobs([{"identifier": preprocess, "status": "DONE"}])
+    assert status(train) == "WAITING"
+    assert cold_scheduler.claim_next("runner-0").identifier == train
+    # a failure terminates the jobs that depend on its success, down to the
+    # descendants, and releases the ones that depend on its completion
+    cold_scheduler.update_job_status(train, "TERMINATED")
+    assert [status(i) for i in (evaluate, cleanup, report)] == [
+        "TERMINATED", "WAITING", "TERMINATED"]
+    assert cold_scheduler.check_queue() == (set(), set())
+
+    # jobs that depend on finished jobs are resolved when added
+    assert status(add_job(dependencies=[preprocess])) == "WAITING"
+    orphan = add_job(dependencies=[train])
+    assert status(orphan) == "TERMINATED"
+    assert cold_scheduler.check_queue() == (set(), set())
+    assert cold_scheduler.get_next().identifier == cleanup
+    parents, children = cold_scheduler.get_dependencies(report)
+    assert [(d.parent_id, d.condition, d.resolved) for d in parents] == [
+        (evaluate, "success", True), (cleanup, "completion", False)]
+    assert [d.job_id for d in cold_scheduler.get_dependencies(train)[1]] == [
+        evaluate, cleanup, orphan]
+
+def test_dependencies_lost_parent(cold_scheduler):
+    payload = dict(user="RyanTheTemp", command="ls", description="")
+    cold_scheduler.lease_duration = 0.1
+    cold_scheduler.max_attempts = 2
+    parent = Job.from_payload(payload)
+    cold_scheduler.add_job(parent)
+    children = cold_scheduler.add_jobs([
+        Job.from_payload(dict(payload, dependencies=[parent.identifier])),
+        Job.from_payload(dict(payload, dependencies=[{"job": parent.identifier, "on": "completion"}])),
+    ])
+    # the parent's lease expires until it is left UNKNOWN
+    for _ in range(2):
+        assert cold_scheduler.claim_next("runner-0").identifier == parent.identifier
+        sleep(0.15)
+        assert cold_scheduler.expire_leases() == [parent.identifier]
+    assert cold_scheduler.get_job_status(parent.identifier) == JobStatus.UNKNOWN.value
+    # which fails the jobs that depend on it
+    assert [cold_scheduler.get_job_status(i) for i in children] == [
+        JobStatus.TERMINATED.value] * 2
+    assert cold_scheduler.db_manager.get_unresolved_parents() == {}
+    assert cold_scheduler.check_queue() == (set(), set())
+    # as do jobs added later
+    orphan = Job.from_payload(dict(payload, dependencies=[parent.identifier]))
+    cold_scheduler.add_job(orphan)
+    assert cold_scheduler.get_job_status(orphan.identifier) == JobStatus.TERMINATED.value
+
+def test_dependencies_batch(cold_scheduler):
+    payload = dict(user="RyanTheTemp", command="ls", description="")
+    parent = Job.from_payload(payload)
+    cold_scheduler.add_job(parent)
+    later = time() + 3600
+    jobs = [
+        Job.from_payload(dict(payload, dependencies=[parent.identifier])),
+        Job.from_payload(dict(payload, dependencies=[parent.identifier], run_at=later)),
+        Job.from_payload(payload),
+    ]
+    first, delayed, independent = cold_scheduler.add_jobs(jobs)
+    assert cold_scheduler.get_job_status(first) == JobStatus.SLEEPING.value
+    assert cold_scheduler.get_job_status(independent) == JobStatus.WAITING.value
+    with pytest.raises(IndexError):
+        cold_scheduler.add_jobs([Job.from_payload(dict(payload, dependencies=[first + 10]))])
+    assert cold_scheduler.n_jobs == 4
+
+    # dependencies resolved while the scheduler was stopped are resolved on
+    # startup
+    cold_scheduler.db_manager.update_job(parent.identifier, status=JobStatus.DONE.value)
+    scheduler = Scheduler("/tmp/no.db")
+    assert scheduler.get_job_status(first) == JobStatus.WAITING.value
+    assert first in scheduler.queue
+    # a job that is also delayed waits until it is due
+    assert scheduler.get_job_status(delayed) == JobStatus.SLEEPING.value
+    assert scheduler.wake_jobs(later) == [delayed]
+    scheduler.db_manager.close()
+
+def test_sync(cold_scheduler):
+    # another process serving the same database
+    other = Scheduler("/tmp/no.db")
+    payload = dict(user="RyanTheTemp", command="ls", description="")
+    cold_scheduler.add_job(Job.from_payload(payload))
+    cold_scheduler.add_job(Job.from_payload(dict(payload, run_at=time() + 3600)))
+    version = other.version
+    # changes are only read once per interval
+    other.sync(3600)
+    assert len(other.queue) == 0
+    job = other.claim_next("runner-0", timeout=2)
+    assert job.identifier == 1
+    assert other.version > version
+    assert 2 in other.timers
+    assert 1 in other.fair_share
+
+    cold_scheduler.sync()
+    assert 1 not in cold_scheduler.queue
+    assert 1 in cold_scheduler.fair_share
+    other.update_job_status(1, "DONE")
+    other.remove_job(2)
+    cold_scheduler.sync()
+    assert 1 not in cold_scheduler.fair_share
+    assert 2 not in cold_scheduler.timers
+    assert cold_scheduler.check_queue() == (set(), set())
+
+    # changes pruned before being synced
+    cold_scheduler.add_job(Job.from_payload(payload))
+    cold_scheduler.add_job(Job.from_payload(payload))
+    cold_scheduler.prune_changes(max_count=1)
+    other.sync()
+    assert other.check_queue() == (set(), set())
+    assert len(other.queue) == 2
+    other.db_manager.close()
+
+def test_sync_loads_jobs_in_bulk(cold_scheduler, monkeypatch):
+    other = Scheduler("/tmp/no.db")
+    payload = dict(user="RyanTheTemp", command="ls", description="")
+    cold_scheduler.add_jobs([Job.from_payload(payload) for _ in range(5)])
+    loads = []
+    for scheduler in (cold_scheduler, other):
+        monkeypatch.setattr(
+            scheduler.db_manager, "get_job_by_id",
+            lambda identifier: pytest.fail("jobs are loaded one by one"))
+        get_jobs_by_ids = scheduler.db_manager.get_jobs_by_ids
+        monkeypatch.setattr(
+            scheduler.db_manager, "get_jobs_by_ids",
+            lambda identifiers, load=get_jobs_by_ids: loads.append(identifiers) or load(identifiers))
+    # a process skips its own changes
+    version = cold_scheduler.version
+    cold_scheduler.sync()
+    assert loads == []
+    assert cold_scheduler.version == version
+    # and loads the ones of other processes with a single query
+    other.sync()
+    assert loads == [{1, 2, 3, 4, 5}]
+    assert len(other.queue) == 5
+    other.db_manager.close()
+
+def test_sync_progress(cold_scheduler):
+    other = Scheduler("/tmp/no.db")
+    payload = dict(user="RyanTheTemp", command="ls", description="")
+    cold_scheduler.add_job(Job.from_payload(payload))
+    job = cold_scheduler.claim_next("runner-0")
+    other.sync()
+    # progress, usage and heartbeats change the version of other processes
+    version = other.version
+    cold_scheduler.update_jobs([{
+        "identifier": job.identifier, "progress": 0.5, "usage": [[time(), 1, 10, 0, 0, 0]],
+    }], runner="runner-0")
+    other.sync()
+    assert other.version > version
+    change = other.get_changes()[-1]
+    assert json.loads(change.data)["progress"] == 0.5
+    version = other.version
+    cold_scheduler.update_jobs([{"identifier": job.identifier}], runner="runner-0")
+    other.sync()
+    assert other.version > version
+    other.db_manager.close()
+
+def test_long_polling_releases_connections():
+    class SmallPool(Config):
+        DATABASE_POOL_SIZE = 1
+    scheduler = Scheduler("/tmp/no.db", SmallPool)
+    errors = []
+
+    def poll(runner):
+        try:
+            scheduler.claim_next(runner, timeout=3)
+        except Exception as err:
+            errors.append(err)
+    # more pollers than connections in the pool, with its overflow
+    pollers = [threading.Thread(target=poll, args=(f"runner-{i}",)) for i in range(6)]
+    for poller in pollers:
+        poller.start()
+    # halfway through a wait, between two syncs
+    sleep(1.5)
+    assert scheduler.db_manager.engine.pool.checkedout() == 0
+    assert scheduler.get_jobs() == []
+    for poller in pollers:
+        poller.join()
+    assert errors == []
+    scheduler.db_manager.close()
+    os.remove("/tmp/no.db")
@@ -3,9 +3,29 @@ Runner that, once installed on a remote host, can receive jobs to execute
 from the Scheduler
 
 Manages 3 types of interactions  with the Scheduler:
-    1. Sends a GET request when the Runner is available to receive a new job
-    2. Receives via a POST request info about the job to execute
-    3. Sends a POST request when the job is done to update the status
+    1. Sends a POST request when the Runner is available to claim a new job
+    2. Receives in the response info about the job to execute, which is
+        already leased to this runner and set to RUNNING
+    3. Streams the job's output while it runs, and reports the status of
+        its jobs when they are done
+
+Status updates are sent by a single reporter thread, in batches: updates of
+slots that finish at the same time go in the same request, along with a
+heartbeat for every job still running. Heartbeats are also sent every
+`--heartbeat_interval` seconds, and renew the runner's lease on its jobs: if
+the scheduler doesn't hear from the runner for a while, its jobs are given
+to other runners. A job the runner doesn't hold anymore is killed.
+
+While jobs run, the resources used by their process tree (CPU, resident
+memory, disk I/O from `/proc`, and GPU memory if `nvidia-smi` is available)
+are sampled every `--sample_interval` seconds, and the samples are sent
+along with the next batch of updates.
+
+A runner can execute several jobs concurrently (see `--slots`). Each slot
+claims a new job only once its previous one is done, and jobs only see the
+GPUs they reserved through `CUDA_VISIBLE_DEVICES`. When claiming a job, the runner
+advertises its free resources (GPUs, GPU memory, CPUs and RAM), so that the
+scheduler only hands out jobs that fit next to the ones already running.
 
 This runner is written using no objects from the Broker API backend. This was
 done on purpose to minimize the dependancy on the Scheduler, and make the
@@ -13,36 +33,196 @@ whole architecture as compartmentalized as possible.
 """
 
 
+import os
+import time
+import random
+import signal
+import shutil
+import socket
 import logging
 import tempfile
 import argparse
+import threading
 import subprocess
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 # pylint: disable=W1510
 logging.basicConfig(level=logging.INFO)
 
+# Set on the first SIGTERM/SIGINT: finish the current jobs, then exit
+STOPPING = threading.Event()
+# Set on the second one: kill the current jobs and hand them back
+HANDING_BACK = threading.Event()
+# Slot number -> process of the job it is executing
+PROCESSES = {}
+# Slot number -> id of the job it is executing, None if idle
+SLOTS = {}
+SLOTS_LOCK = threading.Lock()
+# Slot number -> resources reserved by the job it is executing
+RESERVED = {}
+# Slot number -> ids of the GPUs reserved by the job it is executing
+RESERVED_GPUS = {}
+# Claims are serialized so that two slots can't reserve the same resources
+CLAIM_LOCK = threading.Lock()
+# Status updates waiting to be sent by the reporter: (job id, status, event
+# set once sent)
+PENDING_UPDATES = []
+REPORTER = threading.Condition()
+# Set when all slots are done, so that the reporter exits
+REPORTER_STOP = threading.Event()
+# Ids of the jobs the runner lost its lease on
+LOST = set()
+RESOURCES = ("gpus", "gpu_memory", "cpus", "memory")
+# Job id -> usage samples not sent yet, see `sample_usage`
+USAGE = {}
+# Job id -> epoch, CPU seconds and I/O bytes by pid, as of its last sample
+SAMPLED = {}
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+NVIDIA_SMI = shutil.which("nvidia-smi")
+
+
+def scheduler_url(path):
+    """Returns the URL of a scheduler endpoint"""
+    return f"http://{SCHEDULER_IP}:{SCHEDULER_PORT}{path}"
+
+
+def make_session(pool_size):
+    """Creates the HTTP session used for all requests to the scheduler
+
+    Connections are kept alive and reused instead of opening a new one for
+    each request.
+
+    Args:
+        pool_size: Integer, maximum number of concurrent connections
+    """
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    return session
+
+
+def slot_env(slot):
+    """Returns the environment of the jobs executed by a slot
+
+    Sets `BROKER_SLOT`, and pins the job to the GPUs reserved for it through
+    `CUDA_VISIBLE_DEVICES`, none if it didn't require any.
+    """
+    env = dict(os.environ, BROKER_SLOT=str(slot))
+    if GPUS:
+        env["CUDA_VISIBLE_DEVICES"] = ",".join(RESERVED_GPUS.get(slot, []))
+    return env
+
+
+def detect_memory():
+    """Returns the total RAM of the host in MB, 0 if unknown"""
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 0
+
+
+def free_capacity():
+    """Returns the resources that are not reserved by running jobs"""
+    with SLOTS_LOCK:
+        return {
+            resource: CAPACITY[resource] - sum(r[resource] for r in RESERVED.values())
+            for resource in RESOURCES
+        }
+
+
+def reserve(slot, job):
+    """Reserves the resources required by a job for a slot"""
+    with SLOTS_LOCK:
+        RESERVED[slot] = {resource: job.get(resource) or 0 for resource in RESOURCES}
+        used = {gpu for gpus in RESERVED_GPUS.values() for gpu in gpus}
+        RESERVED_GPUS[slot] = [gpu for gpu in GPUS if gpu not in used][:RESERVED[slot]["gpus"]]
+
+
+def release(slot):
+    """Releases the resources reserved by a slot"""
+    with SLOTS_LOCK:
+        RESERVED.pop(slot, None)
+        RESERVED_GPUS.pop(slot, None)
+
+
+def set_slot(slot, identifier):
+    """Records which job a slot is executing, and logs the status of all slots"""
+    with SLOTS_LOCK:
+        SLOTS[slot] = identifier
+        status = ", ".join(
+            f"{s}=JOB #{i}" if i is not None else f"{s}=idle"
+            for s, i in sorted(SLOTS.items())
+        )
+    logging.info("Slots: %s", status)
+
+
+def backoff(attempt):
+    """Returns a jittered exponential backoff delay in seconds"""
+    return random.uniform(0, min(MAX_BACKOFF, 2 ** attempt))
+
+
+def with_retries(send, retries=None):
+    """Sends a request until it succeeds or the retries are exhausted
+
+    Connection errors and 5xx responses are considered transient, and are
+    retried after a jittered exponential backoff.
+
+    Args:
+        send: Callable sending one request and returning the response
+        retries: Integer, maximum number of retries. Defaults to `RETRIES`
+
+    Returns:
+        requests.Response, None if every attempt failed
+    """
+    retries = RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            response = send()
+            if response.status_code < 500:
+                return response
+            logging.warning("Scheduler answered with status %s", response.status_code)
+        except requests.exceptions.RequestException as err:
+            logging.warning("Couldn't send request to scheduler.\n%s", err)
+        if attempt < retries:
+            time.sleep(backoff(attempt))
+    logging.error("Giving up after %d attempts", retries + 1)
+    return None
+
+
+def get_job(slot=0):
+    """Sends a POST request to the scheduler to claim a new job to execute
 
-def get_job():
-    """Sends a GET request to the scheduler for a new job to execute
+    The runner's free capacity is sent along, and the resources required by
+    the claimed job are reserved for the slot.
 
     Returns:
         Dict, job parameters
     """
     try:
-        response = requests.get(
-            f"http://{SCHEDULER_IP}:{SCHEDULER_PORT}/runners/available-job"
-        )
-        response.raise_for_status()
-        if response.status_code == 200:
-            response = response.json()
+        with CLAIM_LOCK:
+            response = SESSION.post(
+                scheduler_url("/runners/claim-job"),
+                params={"wait": WAIT},
+                json={"runner": RUNNER_ID, "capacity": free_capacity()},
+                timeout=(TIMEOUT, TIMEOUT + WAIT)
+            )
+            response.raise_for_status()
+            job = response.json() if response.status_code == 200 else None
+            if job is not None:
+                reserve(slot, job)
+        if job is not None:
             logging.info(
                 "Successfully received JOB #%d from scheduler",
-                response["identifier"]
+                job["identifier"]
             )
-            return response
+            return job
         if response.status_code == 204:
             return None
         logging.error("Weird response status code %s", response.status_code)
@@ -52,47 +232,383 @@ def get_job():
         return None
 
 
-def execute_job(identifier, command):
-    """Execute a job"""
-    send_update(identifier, "RUNNING")
-    logfile = tempfile.NamedTemporaryFile(mode="w+b")
-    logging.info("Executing JOB #%d: %s", identifier, command)
-    result = subprocess.run(
-        command,
-        shell=True,
-        stdout=logfile,
-        stderr=subprocess.STDOUT
-    )
-    requests.post(
-        f"http://{SCHEDULER_IP}:{SCHEDULER_PORT}/jobs/{identifier}/logs",
-        files={"logfile": open(logfile.name, mode="rb")}
-    )
-    if result.returncode == 0:
+def execute_job(identifier, command, slot=0):
+    """Execute a job in a slot
+
+    The job's output is streamed to the scheduler while it runs (see
+    `stream_logfile`). If the runner is asked to hand back its jobs while
+    this one runs, it is killed and set back to WAITING so that another
+    runner can pick it up.
+    """
+    if HANDING_BACK.is_set():
+        send_update(identifier, "WAITING")
+        release(slot)
+        return
+    set_slot(slot, identifier)
+    with tempfile.NamedTemporaryFile(mode="w+b") as logfile:
+        logging.info("Executing JOB #%d in slot %d: %s", identifier, slot, command)
+        done = threading.Event()
+        streamer = threading.Thread(
+            target=stream_logfile,
+            args=(identifier, logfile.name, done),
+            name=f"logs-{identifier}"
+        )
+        streamer.start()
+        PROCESSES[slot] = subprocess.Popen(
+            command,
+            shell=True,
+            stdout=logfile,
+            stderr=subprocess.STDOUT,
+            env=slot_env(slot),
+            start_new_session=True
+        )
+        SAMPLED[identifier] = {"epoch": time.time(), "cpu": 0.0, "io": {}}
+        returncode = PROCESSES[slot].wait()
+        del PROCESSES[slot]
+        SAMPLED.pop(identifier, None)
+        done.set()
+        streamer.join()
+    if identifier in LOST:
+        logging.info("JOB #%d was lost, not sending its status", identifier)
+    elif HANDING_BACK.is_set():
+        send_update(identifier, "WAITING")
+    elif returncode == 0:
         send_update(identifier, "DONE")
     else:
         send_update(identifier, "TERMINATED")
+    release(slot)
+    set_slot(slot, None)
+
+
+def stream_logfile(identifier, path, done):
+    """Streams a job's log file to the scheduler while the job runs
+
+    Every `--log_interval` seconds, the bytes written since the last upload
+    are appended to the job's log on the scheduler, in chunks of at most
+    `--log_chunk_size` bytes, so memory stays bounded and a runner crash
+    only loses the last interval. Chunks are sent with their offset in the
+    log, so that retries never duplicate output. Runs until `done` is set,
+    then sends what is left.
+
+    Args:
+        identifier: Integer, job's id
+        path: String, path of the log file written by the job
+        done: threading.Event, set when the job is done
+    """
+    # Output of a previous run of the job (e.g. handed back) is kept
+    base = append_log(identifier, b"")
+    base = 0 if base is None else base
+    offset = 0
+    while True:
+        finished = done.wait(LOG_INTERVAL)
+        with open(path, mode="rb") as logfile:
+            logfile.seek(offset)
+            chunk = logfile.read(LOG_CHUNK_SIZE)
+            while chunk:
+                size = append_log(identifier, chunk, base + offset)
+                if size is None:
+                    break  # Scheduler unreachable, try again next interval
+                offset = size - base
+                logfile.seek(offset)
+                chunk = logfile.read(LOG_CHUNK_SIZE)
+        if finished:
+            return
+
+
+def append_log(identifier, chunk, offset=None):
+    """Appends a chunk to a job's log on the scheduler
+
+    Args:
+        identifier: Integer, job's id
+        chunk: Bytes to append
+        offset: Integer, position of the chunk in the log. If None, the
+            chunk is appended at the end of the log.
+
+    Returns:
+        Integer, size of the log on the scheduler, None if it is unknown
+    """
+    response = with_retries(lambda: SESSION.post(
+        scheduler_url(f"/jobs/{identifier}/logs/append"),
+        params={} if offset is None else {"offset": offset},
+        data=chunk,
+        headers={"Content-Type": "application/octet-stream"},
+        timeout=TIMEOUT
+    ))
+    if response is None or response.status_code not in (200, 409):
+        return None
+    return response.json()["size"]
+
+
+def read_processes():
+    """Returns the processes of the host, by session
+
+    Jobs are started in their own session, so the process tree of a job is
+    every process of its session, even the ones that were re-parented.
+
+    Returns:
+        Dict, session id -> list of (pid, CPU seconds, RSS in bytes) tuples.
+            CPU seconds include the children a process waited for.
+    """
+    sessions = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", encoding="utf-8") as stat:
+                # The command name can contain spaces, fields start after it
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue  # Process exited
+        cpu = sum(int(value) for value in fields[11:15]) / CLOCK_TICKS
+        sessions.setdefault(int(fields[3]), []).append(
+            (int(pid), cpu, int(fields[21]) * PAGE_SIZE)
+        )
+    return sessions
+
+
+def read_io(pid):
+    """Returns the bytes read from and written to disk by a process"""
+    counters = {}
+    try:
+        with open(f"/proc/{pid}/io", encoding="utf-8") as io_file:
+            for line in io_file:
+                name, _, value = line.partition(":")
+                counters[name] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
+
+
+def read_gpu_memory():
+    """Returns the GPU memory used by each process in MB, empty if
+    `nvidia-smi` is not available"""
+    if NVIDIA_SMI is None:
+        return {}
+    try:
+        output = subprocess.run(
+            [NVIDIA_SMI, "--query-compute-apps=pid,used_memory", "--format=csv,noheader,nounits"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            timeout=TIMEOUT,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    memory = {}
+    for line in output.splitlines():
+        pid, _, used = line.partition(",")
+        try:
+            memory[int(pid)] = memory.get(int(pid), 0) + int(used)
+        except ValueError:
+            continue
+    return memory
+
+
+def sample_usage():
+    """Samples the resources used by the running jobs
+
+    A sample is a list of: epoch, CPU cores used since the previous sample,
+    resident memory in MB, GPU memory in MB, and bytes read and written
+    since the job started (processes that exited keep their last count).
+    Samples are kept in `USAGE` until the reporter sends them.
+    """
+    with SLOTS_LOCK:
+        sessions = {
+            process.pid: SLOTS[slot] for slot, process in list(PROCESSES.items())
+            if SLOTS.get(slot) is not None
+        }
+    if not sessions:
+        return
+    processes = read_processes()
+    gpu_memory = read_gpu_memory()
+    now = time.time()
+    for session, identifier in sessions.items():
+        state = SAMPLED.get(identifier)
+        if state is None:
+            continue  # Job just started or ended
+        tree = processes.get(session, [])
+        for pid, _, _ in tree:
+            state["io"][pid] = read_io(pid)
+        cpu = sum(process[1] for process in tree)
+        cores = max(cpu - state["cpu"], 0) / max(now - state["epoch"], 1e-3)
+        state.update(epoch=now, cpu=max(cpu, state["cpu"]))
+        sample = [
+            round(now, 1),
+            round(cores, 3),
+            sum(process[2] for process in tree) // 2 ** 20,
+            sum(gpu_memory.get(process[0], 0) for process in tree),
+            sum(read for read, _ in state["io"].values()),
+            sum(written for _, written in state["io"].values()),
+        ]
+        with REPORTER:
+            USAGE.setdefault(identifier, []).append(sample)
+
+
+def run_sampler():
+    """Sampler loop, samples the running jobs every `--sample_interval`
+    seconds until the runner stops"""
+    while not REPORTER_STOP.wait(SAMPLE_INTERVAL):
+        sample_usage()
 
 
 def send_update(identifier, status):
     """Sends a job status update to the scheduler
 
+    The update is handed to the reporter thread, and sent in its next batch.
+
     3 types of status are possible:
-        * RUNNING: Job is running
         * TERMINATED: Job terminated itself or was terminated by the runner
         * DONE: Successfully executed
+        * WAITING: Job was handed back by the runner
 
     Args:
         identifier: Integer, job's id
         status: String, job's status
     """
     logging.info("Setting JOB #%d status to %s", identifier, status)
-    try:
-        requests.put(
-            f"http://{SCHEDULER_IP}:{SCHEDULER_PORT}/runners/update-job",
-            json={"identifier": identifier, "status": status}
-        )
-    except requests.exceptions.RequestException as err:
-        logging.info("Couldn't send request to scheduler.\n%s", err)
+    sent = threading.Event()
+    with REPORTER:
+        PENDING_UPDATES.append((identifier, status, sent))
+        REPORTER.notify()
+    sent.wait()
+
+
+def report():
+    """Reporter loop, sends batches of updates until the runner stops
+
+    A batch is sent as soon as a status update is pending, or every
+    `--heartbeat_interval` seconds if jobs are running.
+    """
+    while True:
+        with REPORTER:
+            REPORTER.wait_for(
+                lambda: PENDING_UPDATES or REPORTER_STOP.is_set(), HEARTBEAT_INTERVAL
+            )
+            batch = PENDING_UPDATES[:]
+            del PENDING_UPDATES[:]
+        send_updates([(identifier, status) for identifier, status, _ in batch])
+        for _, _, sent in batch:
+            sent.set()
+        if REPORTER_STOP.is_set() and not batch:
+            return
+
+
+def send_updates(statuses):
+    """Sends status updates and heartbeats to the scheduler in one request
+
+    Args:
+        statuses: List of (job id, status) tuples. A heartbeat is added for
+            every running job that has no status update. Pending usage
+            samples are sent with the update of their job.
+
+    Returns:
+        Boolean, whether the scheduler received the updates
+    """
+    updates = [{"identifier": i, "status": status} for i, status in statuses]
+    with SLOTS_LOCK:
+        running = [i for i in SLOTS.values() if i is not None]
+    updated = {identifier for identifier, _ in statuses}
+    updates += [{"identifier": i} for i in running if i not in updated]
+    if not updates:
+        return True
+    with REPORTER:
+        usage = dict(USAGE)
+        USAGE.clear()
+    for update in updates:
+        if update["identifier"] in usage:
+            update["usage"] = usage[update["identifier"]]
+    response = with_retries(lambda: SESSION.post(
+        scheduler_url("/runners/update-jobs"),
+        json={"runner": RUNNER_ID, "updates": updates},
+        timeout=TIMEOUT
+    ))
+    if response is not None and response.status_code == 200:
+        for identifier in response.json()["missing"]:
+            logging.warning("JOB #%d doesn't exist on the scheduler anymore", identifier)
+        for identifier in response.json()["lost"]:
+            kill_lost_job(identifier)
+    return response is not None
+
+
+def kill_lost_job(identifier):
+    """Kills a job the runner doesn't hold anymore
+
+    This happens when the runner couldn't send heartbeats for longer than
+    its lease, and the scheduler gave the job to another runner.
+    """
+    logging.warning("Lost the lease on JOB #%d, killing it", identifier)
+    with SLOTS_LOCK:
+        LOST.add(identifier)
+        slots = [slot for slot, i in SLOTS.items() if i == identifier]
+    for slot in slots:
+        process = PROCESSES.get(slot)
+        if process is not None and process.poll() is None:
+            os.killpg(process.pid, signal.SIGTERM)
+
+
+def handle_signal(signum, _frame):
+    """Shuts down gracefully on SIGTERM/SIGINT
+
+    The first signal lets the current jobs finish, the second one kills
+    them and hands them back to the scheduler.
+    """
+    if not STOPPING.is_set():
+        logging.info("Received signal %d, shutting down after the current jobs", signum)
+        STOPPING.set()
+    elif not HANDING_BACK.is_set():
+        logging.info("Received signal %d again, handing back the current jobs", signum)
+        HANDING_BACK.set()
+        for process in list(PROCESSES.values()):
+            os.killpg(process.pid, signal.SIGTERM)
+
+
+def run_slot(slot):
+    """Slot loop, executes jobs until there are none left
+
+    A slot only asks for a new job once its previous one is done. In daemon
+    mode, it keeps asking for jobs until the runner is stopped. If the
+    scheduler answers faster than the long polling delay (e.g. it is
+    unreachable), the slot backs off before asking again.
+    """
+    attempt = 0
+    while not STOPPING.is_set():
+        start = time.monotonic()
+        job = get_job(slot)
+        if job is not None and STOPPING.is_set():
+            # Claimed while long polling, after being asked to stop
+            send_update(job["identifier"], "WAITING")
+            release(slot)
+        elif job is not None:
+            attempt = 0
+            execute_job(job["identifier"], job["command"], slot)
+        elif not DAEMON:
+            logging.info("No jobs available, shutting down slot %d.", slot)
+            return
+        elif time.monotonic() - start < WAIT:
+            STOPPING.wait(backoff(attempt))
+            attempt += 1
+
+
+def run():
+    """Main loop, runs one thread per slot until all of them are done"""
+    SLOTS.update({slot: None for slot in range(N_SLOTS)})
+    reporter = threading.Thread(target=report, name="reporter")
+    reporter.start()
+    if SAMPLE_INTERVAL > 0 and os.path.isdir("/proc"):
+        threading.Thread(target=run_sampler, name="sampler", daemon=True).start()
+    threads = [
+        threading.Thread(target=run_slot, args=(slot,), name=f"slot-{slot}")
+        for slot in range(N_SLOTS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with REPORTER:
+        REPORTER_STOP.set()
+        REPORTER.notify()
+    reporter.join()
+    logging.info("Runner stopped. Box.")
 
 
 PARSER = argparse.ArgumentParser()
@@ -106,14 +622,121 @@ PARSER.add_argument(
     default="5000",
     help="Port on which the scheduler is listening"
 )
+PARSER.add_argument(
+    "--runner_id",
+    default=f"{socket.gethostname()}-{os.getpid()}",
+    help="Unique id of this runner"
+)
+PARSER.add_argument(
+    "--wait",
+    default=30,
+    type=float,
+    help="Seconds to wait for a job before shutting down (long polling)"
+)
+PARSER.add_argument(
+    "--daemon",
+    action="store_true",
+    help="Keep running when no jobs are available"
+)
+PARSER.add_argument(
+    "--retries",
+    default=5,
+    type=int,
+    help="Number of retries for status updates and log uploads"
+)
+PARSER.add_argument(
+    "--max_backoff",
+    default=60,
+    type=float,
+    help="Maximum delay in seconds between two retries"
+)
+PARSER.add_argument(
+    "--timeout",
+    default=30,
+    type=float,
+    help="Timeout in seconds of a request to the scheduler"
+)
+PARSER.add_argument(
+    "--slots",
+    default=1,
+    type=int,
+    help="Number of jobs executed concurrently"
+)
+PARSER.add_argument(
+    "--gpus",
+    default="",
+    help=(
+        "Comma separated list of GPU ids. Jobs requiring GPUs get their own, "
+        "other jobs get none"
+    )
+)
+PARSER.add_argument(
+    "--gpu_memory",
+    default=0,
+    type=int,
+    help="Total GPU memory in MB offered to jobs"
+)
+PARSER.add_argument(
+    "--cpus",
+    default=os.cpu_count(),
+    type=float,
+    help="Number of CPU cores offered to jobs"
+)
+PARSER.add_argument(
+    "--memory",
+    default=detect_memory(),
+    type=int,
+    help="RAM in MB offered to jobs"
+)
+PARSER.add_argument(
+    "--log_interval",
+    default=5,
+    type=float,
+    help="Seconds between two uploads of a running job's output"
+)
+PARSER.add_argument(
+    "--log_chunk_size",
+    default=1024 * 1024,
+    type=int,
+    help="Maximum size in bytes of a log upload"
+)
+PARSER.add_argument(
+    "--heartbeat_interval",
+    default=30,
+    type=float,
+    help="Seconds between two heartbeats for the running jobs"
+)
+PARSER.add_argument(
+    "--sample_interval",
+    default=10,
+    type=float,
+    help="Seconds between two samples of the resources used by jobs, 0 to disable"
+)
 ARGS = PARSER.parse_args()
 SCHEDULER_IP = ARGS.scheduler_ip
 SCHEDULER_PORT = ARGS.scheduler_port
+RUNNER_ID = ARGS.runner_id
+WAIT = ARGS.wait
+DAEMON = ARGS.daemon
+RETRIES = ARGS.retries
+MAX_BACKOFF = ARGS.max_backoff
+TIMEOUT = ARGS.timeout
+N_SLOTS = ARGS.slots
+GPUS = [gpu for gpu in ARGS.gpus.split(",") if gpu]
+CAPACITY = {
+    "gpus": len(GPUS),
+    "gpu_memory": ARGS.gpu_memory,
+    "cpus": ARGS.cpus,
+    "memory": ARGS.memory,
+}
+LOG_INTERVAL = ARGS.log_interval
+LOG_CHUNK_SIZE = ARGS.log_chunk_size
+HEARTBEAT_INTERVAL = ARGS.heartbeat_interval
+SAMPLE_INTERVAL = ARGS.sample_interval
+SESSION = make_session(2 * N_SLOTS + 1)
 
 
 if __name__ == "__main__":
-    JOB = get_job()
-    while JOB is not None:
-        execute_job(JOB["identifier"], JOB["command"])
-        JOB = get_job()
-    logging.info("No jobs available, shutting down this runner. Box.")
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    run()